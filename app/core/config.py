@@ -27,6 +27,7 @@ class DatabaseConfig:
     # Pool configuration
     POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
     MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
     POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
     POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
     ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"
@@ -34,6 +35,10 @@ class DatabaseConfig:
     @property
     def url(self) -> str:
         return f"mysql+pymysql://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.NAME}?charset=utf8mb4"
+    
+    @property
+    def async_url(self) -> str:
+        return f"mysql+aiomysql://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.NAME}?charset=utf8mb4"
 
 
 class OllamaConfig:
@@ -41,13 +46,100 @@ class OllamaConfig:
     HOST: str = os.getenv("OLLAMA_HOST", "http://localhost")
     PORT: int = int(os.getenv("OLLAMA_PORT", "11434"))
     MODEL: str = os.getenv("OLLAMA_MODEL", "mistral")
+    # Varios servidores Ollama separados por coma (vacío = solo HOST:PORT)
+    URLS: str = os.getenv("OLLAMA_URLS", "")
+    HEALTH_INTERVAL: float = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
     TIMEOUT: int = int(os.getenv("OLLAMA_TIMEOUT", "120"))
     
+    # Mantener el modelo cargado entre turnos y tamaño de la ventana de contexto
+    KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    NUM_CTX: int = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+    # Reutilizar el contexto (KV) devuelto por Ollama en los turnos siguientes
+    CONTEXT_REUSE: bool = os.getenv("OLLAMA_CONTEXT_REUSE", "true").lower() == "true"
+    CONTEXT_REUSE_MAX_TOKENS: int = int(os.getenv("OLLAMA_CONTEXT_REUSE_MAX_TOKENS", "2560"))
+    CONTEXT_CACHE_TTL: int = int(os.getenv("OLLAMA_CONTEXT_CACHE_TTL", "1800"))
+    CONTEXT_CACHE_SIZE: int = int(os.getenv("OLLAMA_CONTEXT_CACHE_SIZE", "1000"))
+    
+    # Control de admisión: generaciones simultáneas, espera máxima en cola y
+    # pesos por empresa para el round-robin ("company_id:peso,...")
+    MAX_CONCURRENCY: int = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+    QUEUE_TIMEOUT: float = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30"))
+    MAX_QUEUE: int = int(os.getenv("OLLAMA_MAX_QUEUE", "100"))
+    COMPANY_WEIGHTS: str = os.getenv("OLLAMA_COMPANY_WEIGHTS", "")
+    
+    # Costo por token en USD (0 = LLM local sin costo por token)
+    COST_PER_PROMPT_TOKEN: str = os.getenv("OLLAMA_COST_PER_PROMPT_TOKEN", "0")
+    COST_PER_COMPLETION_TOKEN: str = os.getenv("OLLAMA_COST_PER_COMPLETION_TOKEN", "0")
+    
     @property
     def base_url(self) -> str:
         return f"{self.HOST}:{self.PORT}"
 
 
+class RAGConfig:
+    """Configuración de ingesta y recuperación RAG"""
+    # PDFs con al menos esta cantidad de páginas se extraen en paralelo
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", "64"))
+    PDF_WORKERS: int = int(os.getenv("RAG_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+    # Chunks por lote al calcular embeddings / insertar en el vector store
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "128"))
+    # Chunking: recursive (caracteres) | tokens | markdown | auto (markdown para .md, recursive para el resto)
+    # UserRAGConfig.chunk_strategy lo sobrescribe por empresa
+    CHUNK_STRATEGY: str = os.getenv("RAG_CHUNK_STRATEGY", "auto")
+    # Parent-document retrieval: se indexan hijos de PARENT_CHILD_SIZE tokens de cada chunk
+    # (sección) y al buscar se devuelve cada sección una vez, si no supera PARENT_MAX_TOKENS
+    PARENT_RETRIEVAL: bool = os.getenv("RAG_PARENT_RETRIEVAL", "false").lower() == "true"
+    PARENT_CHILD_SIZE: int = int(os.getenv("RAG_PARENT_CHILD_SIZE", "128"))
+    PARENT_CHILD_OVERLAP: int = int(os.getenv("RAG_PARENT_CHILD_OVERLAP", "16"))
+    PARENT_MAX_TOKENS: int = int(os.getenv("RAG_PARENT_MAX_TOKENS", "800"))
+    # Respuestas directas de precio/stock desde el índice de productos (sin LLM);
+    # con puntaje o margen menores la consulta sigue por RAG
+    CATALOG_FAST_PATH: bool = os.getenv("RAG_CATALOG_FAST_PATH", "true").lower() == "true"
+    CATALOG_MIN_SCORE: float = float(os.getenv("RAG_CATALOG_MIN_SCORE", "0.6"))
+    CATALOG_MIN_MARGIN: float = float(os.getenv("RAG_CATALOG_MIN_MARGIN", "0.2"))
+    CATALOG_INDEX_TTL: int = int(os.getenv("RAG_CATALOG_INDEX_TTL", "300"))
+    CATALOG_CURRENCY: str = os.getenv("RAG_CATALOG_CURRENCY", "S/")
+    # Excel: un chunk por fila (o grupo de filas) con encabezados y metadata
+    EXCEL_STRUCTURED: bool = os.getenv("RAG_EXCEL_STRUCTURED", "true").lower() == "true"
+    EXCEL_ROWS_PER_CHUNK: int = int(os.getenv("RAG_EXCEL_ROWS_PER_CHUNK", "1"))
+    # Filtros estructurados: índice de metadata en memoria por empresa
+    METADATA_INDEX_TTL: int = int(os.getenv("RAG_METADATA_INDEX_TTL", "300"))
+    # GC de vectores huérfanos: cada cuántos segundos (0 = solo bajo demanda)
+    VECTOR_GC_INTERVAL: int = int(os.getenv("RAG_VECTOR_GC_INTERVAL", "86400"))
+    VECTOR_GC_BATCH_SIZE: int = int(os.getenv("RAG_VECTOR_GC_BATCH_SIZE", "1000"))
+    # Si el índice deja a lo sumo estos candidatos se rankean directamente (sin HNSW)
+    EXACT_SEARCH_MAX_CANDIDATES: int = int(os.getenv("RAG_EXACT_SEARCH_MAX_CANDIDATES", "2000"))
+    # Chunks que llegan al prompt
+    TOP_K: int = int(os.getenv("RAG_TOP_K", "5"))
+    # Reranking: off | lexical | cross-encoder, sobre RERANK_CANDIDATES candidatos
+    RERANK_MODE: str = os.getenv("RAG_RERANK_MODE", "off")
+    RERANK_CANDIDATES: int = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+    RERANK_MODEL: str = os.getenv("RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+    RERANK_LEXICAL_WEIGHT: float = float(os.getenv("RAG_RERANK_LEXICAL_WEIGHT", "0.5"))
+    RERANK_CACHE_SIZE: int = int(os.getenv("RAG_RERANK_CACHE_SIZE", "50000"))
+    # Diversificación: off | dedup (quita casi-duplicados) | mmr
+    DIVERSITY_MODE: str = os.getenv("RAG_DIVERSITY_MODE", "dedup")
+    DEDUP_THRESHOLD: float = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.92"))
+    MMR_LAMBDA: float = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+    # Memoria conversacional: mensajes recientes sin resumir y cada cuántos se compacta
+    MEMORY_RECENT_MESSAGES: int = int(os.getenv("RAG_MEMORY_RECENT_MESSAGES", "4"))
+    MEMORY_COMPACT_BATCH: int = int(os.getenv("RAG_MEMORY_COMPACT_BATCH", "6"))
+    MEMORY_SUMMARY_MAX_TOKENS: int = int(os.getenv("RAG_MEMORY_SUMMARY_MAX_TOKENS", "200"))
+
+
+class ArchiveConfig:
+    """Archivado de conversaciones antiguas a Parquet"""
+    DIR: str = os.getenv("ARCHIVE_DIR", "./archive")
+    # Se archivan las conversaciones sin actividad en AFTER_DAYS días
+    # o con estado cerrado y sin actividad en CLOSED_AFTER_DAYS días
+    AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+    CLOSED_AFTER_DAYS: int = int(os.getenv("ARCHIVE_CLOSED_AFTER_DAYS", "7"))
+    CLOSED_STATUSES: str = os.getenv("ARCHIVE_CLOSED_STATUSES", "closed,archived")
+    BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))  # Conversaciones por lote
+    DELETE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_DELETE_BATCH_SIZE", "1000"))  # Filas por DELETE
+    COMPRESSION: str = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+
+
 class WebConfig:
     """Configuración del servidor web"""
     SECRET_KEY: str = os.getenv("WEB_SECRET", "demo-secret-key-change-in-production")
@@ -70,7 +162,9 @@ class AppConfig:
     # Sub-configuraciones
     db = DatabaseConfig()
     ollama = OllamaConfig()
+    rag = RAGConfig()
     web = WebConfig()
+    archive = ArchiveConfig()
     demo = DemoConfig()
     
     # Configuraciones generales
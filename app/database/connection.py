@@ -1,43 +1,139 @@
 import os
+import time
 from contextlib import contextmanager
 import pymysql
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
-import os
-from pathlib import Path
-from dotenv import load_dotenv, find_dotenv
-
-# Cargar .env de python/ de forma explícita para asegurar consistencia entre procesos
-_base_dir = Path(__file__).resolve().parents[1]
-_env_path = _base_dir / '.env'
-if _env_path.exists():
-    load_dotenv(_env_path.as_posix())
-else:
-    load_dotenv(find_dotenv())
-
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASS = os.getenv("DB_PASS", "root")
-DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
-DB_PORT = int(os.getenv("DB_PORT", "3306"))
-DB_NAME = os.getenv("DB_NAME", "chatbot_db")
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.core.config import settings
+from app.services.metrics import (
+    DB_POOL_CHECKOUT_WAIT,
+    DB_POOL_OVERFLOW_CONNECTIONS,
+    DB_POOL_TIMEOUTS,
+    instrument_engine,
+)
 
 
 def _ensure_database():
-    conn = pymysql.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, autocommit=True)
+    db = settings.db
+    conn = pymysql.connect(host=db.HOST, port=db.PORT, user=db.USER, password=db.PASSWORD, autocommit=True)
     try:
         with conn.cursor() as cur:
-            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{DB_NAME}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db.NAME}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
     finally:
         conn.close()
 
 
 _ensure_database()
 
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True, pool_recycle=1800)
+SQLALCHEMY_DATABASE_URL = settings.db.url
+
+
+class _PoolInstrumentation:
+    """
+    Mide la espera para obtener una conexión y cuenta las conexiones de
+    overflow y los timeouts del pool (la etiqueta la fija _instrumented_pool)
+    """
+
+    metrics_label = "sync"
+
+    def _do_get(self):
+        overflow_before = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(engine=self.metrics_label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(engine=self.metrics_label).observe(time.perf_counter() - start)
+        if self.overflow() > overflow_before and self.overflow() > 0:
+            # Se abrió una conexión por encima de pool_size
+            DB_POOL_OVERFLOW_CONNECTIONS.labels(engine=self.metrics_label).inc()
+        return connection
+
+
+class InstrumentedQueuePool(_PoolInstrumentation, QueuePool):
+    """QueuePool instrumentado (engine síncrono)"""
+
+
+class InstrumentedAsyncQueuePool(_PoolInstrumentation, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool instrumentado (engine aiomysql)"""
+
+
+def _instrumented_pool(base, label: str):
+    # Subclase con la etiqueta como atributo de clase: sobrevive a pool.recreate()
+    return type(f"{base.__name__}_{label}", (base,), {"metrics_label": label, "__module__": __name__})
+
+
+def _engine_options() -> dict:
+    """Opciones de pool comunes, tomadas de settings.db"""
+    db = settings.db
+    return {
+        "pool_size": db.POOL_SIZE,
+        "max_overflow": db.MAX_OVERFLOW,
+        "pool_timeout": db.POOL_TIMEOUT,
+        "pool_recycle": db.POOL_RECYCLE,
+        "pool_pre_ping": db.POOL_PRE_PING,
+        "echo": db.ECHO,
+    }
+
+
+def create_db_engine(label: str = "sync"):
+    """
+    Engine síncrono (pymysql) configurado desde settings.db e instrumentado
+
+    Args:
+        label: Etiqueta del engine en las métricas
+    """
+    db_engine = create_engine(
+        settings.db.url,
+        poolclass=_instrumented_pool(InstrumentedQueuePool, label),
+        **_engine_options()
+    )
+    instrument_engine(db_engine, label)
+    return db_engine
+
+
+def create_async_db_engine(label: str = "async"):
+    """
+    Engine asíncrono (aiomysql) configurado desde settings.db e instrumentado
+
+    Args:
+        label: Etiqueta del engine en las métricas
+    """
+    db_engine = create_async_engine(
+        settings.db.async_url,
+        poolclass=_instrumented_pool(InstrumentedAsyncQueuePool, label),
+        **_engine_options()
+    )
+    instrument_engine(db_engine.sync_engine, label)
+    return db_engine
+
+
+def pool_stats(db_engine) -> dict:
+    """Estado actual del pool de un engine (sync o async)"""
+    pool = getattr(db_engine, "sync_engine", db_engine).pool
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": getattr(pool, "_max_overflow", settings.db.MAX_OVERFLOW),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "timeout_seconds": pool.timeout(),
+        "status": pool.status(),
+    }
+
+
+engine = create_db_engine("sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
+# Engine asíncrono (aiomysql) para los handlers async de FastAPI
+async_engine = create_async_db_engine("async")
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 
 def _ensure_schema():
     """Auto‑migración mínima para columnas nuevas sin usar Alembic."""
@@ -99,6 +195,18 @@ def _ensure_schema():
             if sent_col.fetchone() is None:
                 conn.execute(text("ALTER TABLE `messages` ADD COLUMN `sent_at` DATETIME NULL"))
 
+            # Contabilidad de tokens por mensaje: tiempo de generación, velocidad y prompt
+            gen_col = conn.execute(text("SHOW COLUMNS FROM `messages` LIKE 'generation_time_ms'"))
+            if gen_col.fetchone() is None:
+                conn.execute(text("ALTER TABLE `messages` ADD COLUMN `generation_time_ms` INT NULL"))
+            tps_col = conn.execute(text("SHOW COLUMNS FROM `messages` LIKE 'tokens_per_second'"))
+            if tps_col.fetchone() is None:
+                conn.execute(text("ALTER TABLE `messages` ADD COLUMN `tokens_per_second` DECIMAL(8,2) NULL"))
+            ph_col = conn.execute(text("SHOW COLUMNS FROM `messages` LIKE 'prompt_hash'"))
+            if ph_col.fetchone() is None:
+                conn.execute(text("ALTER TABLE `messages` ADD COLUMN `prompt_hash` VARCHAR(16) NULL"))
+                conn.execute(text("ALTER TABLE `messages` ADD INDEX `idx_messages_prompt_hash` (`prompt_hash`)"))
+
             # Tabla settings para modo global
             tables = conn.execute(text("SHOW TABLES LIKE 'settings'"))
             if tables.fetchone() is None:
@@ -272,10 +380,30 @@ def _ensure_schema():
                 cd_col = conn.execute(text("SHOW COLUMNS FROM `user_rag_config` LIKE 'company_description'"))
                 if cd_col.fetchone() is None:
                     conn.execute(text("ALTER TABLE `user_rag_config` ADD COLUMN `company_description` TEXT NULL"))
-    except Exception:
+                
+                # chunk_strategy
+                cs_col = conn.execute(text("SHOW COLUMNS FROM `user_rag_config` LIKE 'chunk_strategy'"))
+                if cs_col.fetchone() is None:
+                    conn.execute(text("ALTER TABLE `user_rag_config` ADD COLUMN `chunk_strategy` VARCHAR(20) NULL"))
+
+            # TABLA document_chunks - hash de contenido
+            chunk_tables = conn.execute(text("SHOW TABLES LIKE 'document_chunks'"))
+            if chunk_tables.fetchone():
+                ch_col = conn.execute(text("SHOW COLUMNS FROM `document_chunks` LIKE 'content_hash'"))
+                if ch_col.fetchone() is None:
+                    conn.execute(text("ALTER TABLE `document_chunks` ADD COLUMN `content_hash` VARCHAR(40) NULL"))
+                    conn.execute(text("ALTER TABLE `document_chunks` ADD INDEX `ix_document_chunks_content_hash` (`content_hash`)"))
+
+            # TABLA rag_usage_stats - desglose de latencia por etapa
+            stats_tables = conn.execute(text("SHOW TABLES LIKE 'rag_usage_stats'"))
+            if stats_tables.fetchone():
+                st_col = conn.execute(text("SHOW COLUMNS FROM `rag_usage_stats` LIKE 'stage_timings'"))
+                if st_col.fetchone() is None:
+                    conn.execute(text("ALTER TABLE `rag_usage_stats` ADD COLUMN `stage_timings` JSON NULL"))
+    except Exception as e:
         # Evitar que el arranque caiga si la tabla aún no existe (primera vez)
         # Será creada por Base.metadata.create_all en main.py
-        pass
+        print(f"⚠️ Auto-migración de esquema incompleta: {e}")
 
 
 # Intentar alinear el esquema antes de servir dependencias
@@ -291,6 +419,12 @@ def get_session():
         db.close()
 
 
+async def get_async_session():
+    """FastAPI dependency: sesión async (no bloquea el event loop en cada consulta)."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 @contextmanager
 def session_scope():
     """Context manager for imperative use (commit/rollback)."""
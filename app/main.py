@@ -3,25 +3,43 @@ Main application - Chatbot RAG Demo
 Versión simplificada sin WhatsApp, sin login, una sola empresa
 """
 
+import asyncio
 import os
+import time
 from datetime import datetime
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Body, Depends, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Body, Depends, UploadFile, File, BackgroundTasks
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path
 
 # Importaciones locales
-from app.database.connection import engine, get_session
+from app.database.connection import engine, SessionLocal, get_session, async_engine, get_async_session, pool_stats
 from app.models.current import Base, Message, Conversation, Client
-from app.models.rag_models import UserDocument
+from app.models.rag_models import UserDocument, RAGUsageStats
 from app.core.config import settings
 
 # Servicios
 from app.services.rag_service import rag_service
 from app.services.llm_service import ollama_service
+from app.services.metadata_index import normalize_filters
+from app.services.tracing import trace_request, span, record_span, trace_recorder, summarize_latencies
+from app.services.metrics import PrometheusMiddleware, render_metrics, mark_process_dead
+from app.services.accounting import usage_from_result, apply_message_usage, increment_totals, usage_summary
+from app.services.memory_service import memory_service
+from app.services.llm_scheduler import llm_scheduler, LLMBusyError
+from app.services.single_flight import request_coalescer, retrieval_coalescer, request_key, retrieval_key
+from app.services.training_export import stream_training_data
+from app.services.archive_service import archive_service
+from app.services.vector_gc import vector_gc
+from app.services.chunk_store import build_chunk_rows, insert_chunk_rows, get_chunks_by_ids
+from app.services.chunking import resolve_strategy
+from app.services.product_catalog import product_catalog, replace_document_products
+from app.services.document_extractors import extract_products, products_from_rows, with_product_metadata
 
 # Crear tablas
 Base.metadata.create_all(bind=engine)
@@ -37,9 +55,23 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠️ Error inicializando datos demo: {e}")
     
+    # Escritor de trazas en segundo plano (rag_usage_stats)
+    trace_recorder.start()
+    
+    # Verificación de salud de los backends Ollama (solo con OLLAMA_URLS)
+    ollama_service.start()
+    
+    # Reconciliación periódica del vector store (RAG_VECTOR_GC_INTERVAL)
+    vector_gc.start(SessionLocal)
+    
     yield
     
     # Cleanup (si es necesario)
+    vector_gc.stop()
+    ollama_service.stop()
+    trace_recorder.stop()
+    await async_engine.dispose()
+    mark_process_dead()
     print("👋 Cerrando aplicación...")
 
 # Inicializar FastAPI con lifespan
@@ -49,6 +81,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Métricas por ruta (latencia y códigos de estado)
+app.add_middleware(PrometheusMiddleware)
+
 # Configurar templates
 templates_dir = Path(__file__).parent / "webapp" / "templates"
 templates = Jinja2Templates(directory=str(templates_dir))
@@ -69,41 +104,66 @@ async def health():
     return {"status": "ok", "mode": "demo"}
 
 
+@app.get("/health/ollama")
+async def ollama_backends():
+    """Estado de los backends Ollama (salud, carga, modelos, tokens/s)"""
+    if ollama_service.pool:
+        return {"backends": ollama_service.pool.status()}
+    healthy = await asyncio.to_thread(ollama_service.check_health)
+    return {"backends": [{"url": ollama_service.base_url, "healthy": healthy}]}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato Prometheus"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 # ============================================================================
 # API DE CONVERSACIONES
 # ============================================================================
 
 @app.get("/api/conversations")
-async def get_conversations(session: Session = Depends(get_session)):
+async def get_conversations(session: AsyncSession = Depends(get_async_session)):
     """Obtener todas las conversaciones"""
     try:
-        # Obtener clientes con conversaciones
-        clients = session.query(Client).filter(
-            Client.company_id == settings.demo.COMPANY_ID
-        ).all()
+        # Conversaciones de los clientes de la empresa (la más reciente por cliente)
+        rows = (await session.execute(
+            select(Conversation, Client)
+            .join(Client, Client.id == Conversation.client_id)
+            .where(Client.company_id == settings.demo.COMPANY_ID)
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+        )).all()
+        
+        latest = {}
+        for conv, client in rows:
+            latest.setdefault(client.id, (conv, client))
+        
+        # Último mensaje de cada conversación en una sola consulta
+        last_messages = {}
+        if latest:
+            last_ids = (
+                select(func.max(Message.id))
+                .where(Message.conversation_id.in_([conv.id for conv, _ in latest.values()]))
+                .group_by(Message.conversation_id)
+            )
+            last_messages = dict((await session.execute(
+                select(Message.conversation_id, Message.content).where(Message.id.in_(last_ids))
+            )).all())
         
         conversations = []
-        for client in clients:
-            # Obtener última conversación del cliente
-            conv = session.query(Conversation).filter(
-                Conversation.client_id == client.id
-            ).order_by(Conversation.updated_at.desc()).first()
-            
-            if conv:
-                # Obtener último mensaje
-                last_msg = session.query(Message).filter(
-                    Message.conversation_id == conv.id
-                ).order_by(Message.created_at.desc()).first()
-                
-                conversations.append({
-                    "id": conv.id,
-                    "client_id": client.id,
-                    "client_name": client.first_name or "Cliente",
-                    "phone": client.phone_number,
-                    "last_message": last_msg.content[:50] if last_msg else "",
-                    "updated_at": conv.updated_at.isoformat() if conv.updated_at else None,
-                    "mode": conv.mode
-                })
+        for conv, client in latest.values():
+            last_msg = last_messages.get(conv.id)
+            conversations.append({
+                "id": conv.id,
+                "client_id": client.id,
+                "client_name": client.first_name or "Cliente",
+                "phone": client.phone_number,
+                "last_message": last_msg[:50] if last_msg else "",
+                "updated_at": conv.updated_at.isoformat() if conv.updated_at else None,
+                "mode": conv.mode
+            })
         
         # Ordenar por fecha de actualización
         conversations.sort(key=lambda x: x["updated_at"] or "", reverse=True)
@@ -184,13 +244,58 @@ async def update_conversation_mode(conv_id: int, payload=Body(...), session: Ses
         )
 
 
+@app.get("/api/conversation/{conv_id}/archive")
+async def get_archived_conversation(conv_id: int, session: Session = Depends(get_session)):
+    """Leer una conversación archivada (Parquet) sin restaurarla"""
+    try:
+        archived = await asyncio.to_thread(archive_service.load, session, conv_id)
+        if archived is None:
+            return JSONResponse(
+                {"ok": False, "detail": "Conversación no archivada"},
+                status_code=404
+            )
+        return {"ok": True, **archived}
+        
+    except Exception as e:
+        print(f"❌ Error leyendo conversación archivada: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
+@app.post("/api/conversation/{conv_id}/restore")
+async def restore_archived_conversation(conv_id: int, session: Session = Depends(get_session)):
+    """Devolver una conversación archivada a MySQL"""
+    try:
+        restored = await asyncio.to_thread(archive_service.restore, session, conv_id)
+        if restored is None:
+            return JSONResponse(
+                {"ok": False, "detail": "Conversación no archivada"},
+                status_code=404
+            )
+        
+        print(f"✅ Conversación {conv_id} restaurada ({restored} mensajes)")
+        return {"ok": True, "conversation_id": conv_id, "messages": restored}
+        
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error restaurando conversación: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
 @app.get("/api/messages/{conv_id}")
-async def get_messages(conv_id: int, session: Session = Depends(get_session)):
+async def get_messages(conv_id: int, session: AsyncSession = Depends(get_async_session)):
     """Obtener mensajes de una conversación"""
     try:
-        messages = session.query(Message).filter(
-            Message.conversation_id == conv_id
-        ).order_by(Message.created_at.asc()).all()
+        messages = (await session.execute(
+            select(Message)
+            .where(Message.conversation_id == conv_id)
+            .order_by(Message.created_at.asc())
+        )).scalars().all()
         
         return [
             {
@@ -211,35 +316,22 @@ async def get_messages(conv_id: int, session: Session = Depends(get_session)):
 # API DE SIMULACIÓN DE MENSAJES
 # ============================================================================
 
-@app.post("/api/simulate-message")
-async def simulate_message(payload=Body(...), session: Session = Depends(get_session)):
+async def _record_incoming_message(session: AsyncSession, phone_number: str, message: str) -> dict:
     """
-    Simula un mensaje de un cliente
-    Crea/busca cliente, crea conversación, procesa con RAG y genera respuesta
+    Escrituras en BD de un mensaje entrante: cliente, conversación, mensaje
+    del usuario y memoria de la conversación
+    
+    Usa la sesión async: mientras espera a MySQL, el event loop sigue
+    atendiendo la recuperación de documentos y otros requests.
     """
-    try:
-        phone_number = payload.get("phone_number", "").strip()
-        message = payload.get("message", "").strip()
-        system_prompt = payload.get("system_prompt", "").strip()
-        
-        if not phone_number or not message:
-            return JSONResponse(
-                {"ok": False, "detail": "phone_number y message son requeridos"},
-                status_code=400
+    # 1. Buscar o crear cliente
+    with span("db.client_upsert"):
+        client = (await session.execute(
+            select(Client).where(
+                Client.phone_number == phone_number,
+                Client.company_id == settings.demo.COMPANY_ID
             )
-        
-        # Usar prompt por defecto si no se proporciona
-        if not system_prompt:
-            system_prompt = "Eres un asistente útil que responde preguntas basándote en los documentos proporcionados. Sé conciso y preciso."
-        
-        print(f"📱 Simulando mensaje de {phone_number}: {message[:50]}...")
-        print(f"🎯 System Prompt: {system_prompt[:100]}...")
-        
-        # 1. Buscar o crear cliente
-        client = session.query(Client).filter(
-            Client.phone_number == phone_number,
-            Client.company_id == settings.demo.COMPANY_ID
-        ).first()
+        )).scalars().first()
         
         if not client:
             # Crear nuevo cliente
@@ -253,20 +345,23 @@ async def simulate_message(payload=Body(...), session: Session = Depends(get_ses
                 last_contact_at=datetime.now()
             )
             session.add(client)
-            session.commit()
-            session.refresh(client)
+            await session.commit()
+            await session.refresh(client)
             print(f"✅ Cliente creado: {client.id}")
         else:
             # Actualizar última interacción
             client.last_contact_at = datetime.now()
-            session.commit()
+            await session.commit()
             print(f"✅ Cliente existente: {client.id}")
-        
-        # 2. Buscar o crear conversación
-        conv = session.query(Conversation).filter(
-            Conversation.client_id == client.id,
-            Conversation.status == "active"
-        ).first()
+    
+    # 2. Buscar o crear conversación
+    with span("db.conversation_upsert"):
+        conv = (await session.execute(
+            select(Conversation).where(
+                Conversation.client_id == client.id,
+                Conversation.status == "active"
+            )
+        )).scalars().first()
         
         if not conv:
             conv = Conversation(
@@ -277,15 +372,16 @@ async def simulate_message(payload=Body(...), session: Session = Depends(get_ses
                 updated_at=datetime.now()
             )
             session.add(conv)
-            session.commit()
-            session.refresh(conv)
+            await session.commit()
+            await session.refresh(conv)
             print(f"✅ Conversación creada: {conv.id}")
         else:
             conv.updated_at = datetime.now()
-            session.commit()
+            await session.commit()
             print(f"✅ Conversación existente: {conv.id}")
-        
-        # 3. Guardar mensaje del cliente
+    
+    # 3. Guardar mensaje del cliente
+    with span("db.user_message"):
         user_msg = Message(
             conversation_id=conv.id,
             client_id=client.id,
@@ -294,77 +390,211 @@ async def simulate_message(payload=Body(...), session: Session = Depends(get_ses
             created_at=datetime.now()
         )
         session.add(user_msg)
-        session.commit()
-        print(f"✅ Mensaje del usuario guardado: {user_msg.id}")
-        
-        # 4. Procesar con RAG
-        response_text = "Lo siento, no tengo información sobre eso."
-        sources = []
+        await session.commit()
+    print(f"✅ Mensaje del usuario guardado: {user_msg.id}")
+    
+    # Memoria: resumen de turnos antiguos + últimos mensajes sin resumir
+    with span("db.history"):
+        memory = await session.run_sync(memory_service.load_context, conv.id, user_msg.id)
+        # Cerrar la transacción de lectura: la conexión vuelve al pool durante la generación
+        await session.commit()
+    
+    return {"client": client, "conv": conv, "user_msg": user_msg, "memory": memory}
+
+
+async def _retrieve_chunks(message: str, filters) -> list:
+    """Recuperación de chunks (consultas idénticas simultáneas comparten la búsqueda)"""
+    key = retrieval_key(settings.demo.COMPANY_ID, message, filters, rag_service.documents_version)
+    chunks, _ = await retrieval_coalescer.do(
+        key,
+        lambda: asyncio.to_thread(
+            rag_service.search_similar_chunks,
+            query=message,
+            company_id=settings.demo.COMPANY_ID,
+            top_k=settings.rag.TOP_K,
+            filters=filters
+        )
+    )
+    return chunks
+
+
+async def _generate_answer(message: str, chunks: list, system_prompt: str, memory: dict, conversation_id: int = None) -> dict:
+    """Generación con RAG: turno justo por empresa, fuera del event loop"""
+    return await llm_scheduler.run(
+        settings.demo.COMPANY_ID,
+        ollama_service.generate_with_rag,
+        query=message,
+        retrieved_chunks=chunks,
+        conversation_history=memory["history"],
+        temperature=0.7,
+        system_prompt=system_prompt,  # Pasar el prompt personalizado
+        memory_summary=memory["summary"],
+        conversation_id=conversation_id,
+        company_profile=settings.demo.COMPANY_NAME
+    )
+
+
+@app.post("/api/simulate-message")
+async def simulate_message(background_tasks: BackgroundTasks, payload=Body(...), session: AsyncSession = Depends(get_async_session)):
+    """
+    Simula un mensaje de un cliente
+    Crea/busca cliente, crea conversación, procesa con RAG y genera respuesta
+    """
+    try:
+        phone_number = payload.get("phone_number", "").strip()
+        message = payload.get("message", "").strip()
+        system_prompt = payload.get("system_prompt", "").strip()
+        filters = payload.get("filters") or None
         
-        try:
-            # Buscar en documentos RAG
-            chunks = rag_service.search_similar_chunks(
-                query=message,
-                company_id=settings.demo.COMPANY_ID,
-                top_k=5
+        if not phone_number or not message:
+            return JSONResponse(
+                {"ok": False, "detail": "phone_number y message son requeridos"},
+                status_code=400
             )
+        
+        # Filtros estructurados opcionales (precio, marca, categoría, stock)
+        if filters is not None:
+            try:
+                if not isinstance(filters, dict):
+                    raise ValueError("filters debe ser un objeto")
+                normalize_filters(filters)
+            except (TypeError, ValueError) as e:
+                return JSONResponse(
+                    {"ok": False, "detail": f"Filtros inválidos: {e}"},
+                    status_code=400
+                )
+        
+        # Usar prompt por defecto si no se proporciona
+        if not system_prompt:
+            system_prompt = "Eres un asistente útil que responde preguntas basándote en los documentos proporcionados. Sé conciso y preciso."
+        
+        print(f"📱 Simulando mensaje de {phone_number}: {message[:50]}...")
+        print(f"🎯 System Prompt: {system_prompt[:100]}...")
+        
+        with trace_request("simulate_message", query=message, system_user_id=settings.demo.USER_ID) as trace:
+            # 0. Consultas de precio/stock de un solo producto: respuesta directa
+            # desde el índice de catálogo, sin recuperación ni LLM
+            fast_answer = None
+            if settings.rag.CATALOG_FAST_PATH and not filters:
+                with span("catalog.lookup"):
+                    fast_answer = await asyncio.to_thread(
+                        product_catalog.answer, SessionLocal, settings.demo.COMPANY_ID, message
+                    )
             
-            if chunks:
-                print(f"✅ Encontrados {len(chunks)} chunks relevantes")
-                
-                # Obtener historial de conversación (últimos 10 mensajes)
-                history_messages = session.query(Message).filter(
-                    Message.conversation_id == conv.id
-                ).order_by(Message.created_at.desc()).limit(10).all()
-                
-                # Formatear historial para el LLM (orden cronológico)
-                conversation_history = [
-                    {
-                        "role": msg.role,
-                        "content": msg.content
-                    }
-                    for msg in reversed(history_messages)
-                ]
+            # 1-3. La recuperación solo depende del texto y la empresa: arranca
+            # ya y corre en paralelo con las escrituras en BD
+            rag_start = time.perf_counter()
+            retrieval = None if fast_answer else asyncio.create_task(_retrieve_chunks(message, filters))
+            try:
+                turn = await _record_incoming_message(session, phone_number, message)
+            except BaseException:
+                if retrieval:
+                    retrieval.cancel()
+                raise
+            client, conv, memory = turn["client"], turn["conv"], turn["memory"]
+            conversation_history = memory["history"]
+            trace.conversation_id = conv.id
+            
+            # 4. Procesar con RAG
+            response_text = "Lo siento, no tengo información sobre eso."
+            sources = []
+            usage = None
+            context_updated = False
+            
+            try:
+                if fast_answer:
+                    response_text = fast_answer["response"]
+                    sources = fast_answer["sources"]
+                    trace.model_used = "catalog"
+                    print(f"⚡ Respuesta directa del catálogo: {fast_answer['product']} ({fast_answer['elapsed_ms']:.2f} ms)")
+                else:
+                    chunks = await retrieval
+                    trace.retrieved_chunks_count = len(chunks)
                 
-                # Generar respuesta con LLM usando el prompt personalizado y contexto
-                result = ollama_service.generate_with_rag(
-                    query=message,
-                    retrieved_chunks=chunks,
-                    conversation_history=conversation_history,
-                    temperature=0.7,
-                    system_prompt=system_prompt  # Pasar el prompt personalizado
+                    if chunks:
+                        print(f"✅ Encontrados {len(chunks)} chunks relevantes")
+                        shared = False
+                        if not conversation_history and not memory["summary"]:
+                            # Turno sin historial: mensajes idénticos simultáneos comparten
+                            # una sola generación
+                            key = request_key(
+                                settings.demo.COMPANY_ID, message, system_prompt, filters,
+                                rag_service.documents_version, ollama_service.model
+                            )
+                            start = time.perf_counter()
+                            result, shared = await request_coalescer.do(
+                                key,
+                                lambda: _generate_answer(message, chunks, system_prompt, memory)
+                            )
+                            if shared:
+                                record_span("llm.coalesced", (time.perf_counter() - start) * 1000)
+                                print("♻️ Respuesta compartida con una solicitud idéntica en curso")
+                            ollama_service.store_context(conv.id, result, system_prompt, settings.demo.COMPANY_NAME)
+                        else:
+                            result = await _generate_answer(message, chunks, system_prompt, memory, conv.id)
+                    
+                        context_updated = True
+                        response_text = result.get("response", response_text)
+                        sources = result.get("sources", [])
+                        trace.model_used = result.get("model") or ollama_service.model
+                        if not shared:
+                            # Las respuestas compartidas no consumieron GPU propia
+                            usage = usage_from_result(result, ollama_service.model)
+                        product_catalog.record_rag_answer((time.perf_counter() - rag_start) * 1000)
+                        print(f"✅ Respuesta generada con RAG (con {len(conversation_history)} mensajes de contexto)")
+                    else:
+                        print("⚠️ No se encontraron chunks relevantes")
+                        response_text = "No encontré información relevante en los documentos. Por favor, sube documentos relacionados con tu consulta."
+                    
+            except LLMBusyError:
+                raise
+            except Exception as e:
+                print(f"❌ Error en RAG: {e}")
+                trace.fail(e)
+                response_text = "Ocurrió un error al procesar tu consulta. Por favor, intenta de nuevo."
+            
+            if not context_updated:
+                # La respuesta no salió del LLM: el contexto KV guardado ya no
+                # incluye el historial completo de la conversación
+                ollama_service.context_cache.invalidate(conv.id)
+            
+            # 5. Guardar respuesta del asistente
+            with span("db.persist_response"):
+                assistant_msg = Message(
+                    conversation_id=conv.id,
+                    client_id=client.id,
+                    role="assistant",
+                    content=response_text,
+                    created_at=datetime.now()
                 )
-                
-                response_text = result.get("response", response_text)
-                sources = result.get("sources", [])
-                print(f"✅ Respuesta generada con RAG (con {len(conversation_history)} mensajes de contexto)")
-            else:
-                print("⚠️ No se encontraron chunks relevantes")
-                response_text = "No encontré información relevante en los documentos. Por favor, sube documentos relacionados con tu consulta."
-                
-        except Exception as e:
-            print(f"❌ Error en RAG: {e}")
-            response_text = "Ocurrió un error al procesar tu consulta. Por favor, intenta de nuevo."
-        
-        # 5. Guardar respuesta del asistente
-        assistant_msg = Message(
-            conversation_id=conv.id,
-            client_id=client.id,
-            role="assistant",
-            content=response_text,
-            created_at=datetime.now()
-        )
-        session.add(assistant_msg)
-        session.commit()
-        print(f"✅ Respuesta del asistente guardada: {assistant_msg.id}")
+                if usage:
+                    # Tokens, velocidad y modelo del mensaje
+                    apply_message_usage(assistant_msg, usage, system_prompt)
+                # Totales atómicos: mensajes del turno siempre, tokens si hubo generación propia
+                await session.run_sync(increment_totals, conv.id, client.id, usage)
+                session.add(assistant_msg)
+                await session.commit()
+            print(f"✅ Respuesta del asistente guardada: {assistant_msg.id}")
+        
+        # Compactar turnos antiguos en el resumen después de responder (en un hilo;
+        # solo la llamada al LLM pide turno al scheduler, con baja prioridad)
+        background_tasks.add_task(asyncio.to_thread, memory_service.compact, conv.id, asyncio.get_running_loop())
         
         return {
             "ok": True,
             "conversation_id": conv.id,
             "response": response_text,
-            "sources": sources
+            "sources": sources,
+            "fast_path": fast_answer is not None
         }
         
+    except LLMBusyError as e:
+        print(f"⏳ LLM saturado, solicitud rechazada: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         print(f"❌ Error en simulate_message: {e}")
         import traceback
@@ -380,7 +610,7 @@ async def simulate_message(payload=Body(...), session: Session = Depends(get_ses
 # ============================================================================
 
 @app.post("/api/chat")
-async def send_chat_message(payload=Body(...), session: Session = Depends(get_session)):
+async def send_chat_message(payload=Body(...), session: AsyncSession = Depends(get_async_session)):
     """Enviar mensaje desde el panel (respuesta del asesor)"""
     try:
         conversation_id = payload.get("conversation_id")
@@ -393,9 +623,7 @@ async def send_chat_message(payload=Body(...), session: Session = Depends(get_se
             )
         
         # Buscar conversación
-        conv = session.query(Conversation).filter(
-            Conversation.id == conversation_id
-        ).first()
+        conv = await session.get(Conversation, conversation_id)
         
         if not conv:
             return JSONResponse(
@@ -412,10 +640,14 @@ async def send_chat_message(payload=Body(...), session: Session = Depends(get_se
             created_at=datetime.now()
         )
         session.add(assistant_msg)
+        await session.run_sync(increment_totals, conv.id, conv.client_id, None, 1)
         
         # Actualizar conversación
         conv.updated_at = datetime.now()
-        session.commit()
+        await session.commit()
+        
+        # El siguiente turno del RAG debe ver la respuesta del asesor en el historial
+        ollama_service.context_cache.invalidate(conv.id)
         
         return {"ok": True}
         
@@ -478,9 +710,6 @@ async def upload_document(file: UploadFile = File(...), session: Session = Depen
         
         # Procesar documento
         try:
-            # Extraer texto
-            text = rag_service.process_document(str(file_path), file_ext)
-            
             # Obtener configuración RAG
             config = session.query(UserRAGConfig).filter(
                 UserRAGConfig.company_id == settings.demo.COMPANY_ID
@@ -488,36 +717,100 @@ async def upload_document(file: UploadFile = File(...), session: Session = Depen
             
             chunk_size = config.chunk_size if config else 512
             chunk_overlap = config.chunk_overlap if config else 50
+            strategy = resolve_strategy((config.chunk_strategy if config else None) or settings.rag.CHUNK_STRATEGY, file_ext)
             
-            # Dividir en chunks
-            chunks = rag_service.chunk_text(text, chunk_size, chunk_overlap)
+            def persist_chunks(ids, texts, metadatas):
+                # Filas de DocumentChunk del lote en un solo INSERT (commit junto con el documento)
+                insert_chunk_rows(session, build_chunk_rows(doc.id, ids, texts, metadatas))
             
-            # Agregar al vector store
-            rag_service.add_document_to_vectorstore(
-                chunks=chunks,
-                system_user_id=settings.demo.USER_ID,
-                company_id=settings.demo.COMPANY_ID,
-                document_id=doc.id,
-                filename=file.filename,
-                metadata={"file_type": file_ext}
-            )
+            # Parent-document retrieval: se indexan hijos pequeños y se guardan las secciones
+            parents = [] if settings.rag.PARENT_RETRIEVAL else None
+            
+            def with_children(records):
+                return rag_service.split_children(records, parents) if parents is not None else records
+            
+            # Productos del catálogo (índice de respuestas directas)
+            products = []
+            excel_rows = []
+            
+            def collect_rows(records):
+                for record in records:
+                    excel_rows.append(record["metadata"])
+                    yield record
+            
+            if file_ext == "pdf":
+                # PDF: extracción por páginas en streaming, se indexa mientras se lee
+                pages = rag_service.iter_pdf_pages(str(file_path))
+                ids = rag_service.add_chunk_stream(
+                    chunk_records=with_children(rag_service.chunk_pages(pages, chunk_size, chunk_overlap, strategy)),
+                    system_user_id=settings.demo.USER_ID,
+                    company_id=settings.demo.COMPANY_ID,
+                    document_id=doc.id,
+                    filename=file.filename,
+                    metadata={"file_type": file_ext, "chunk_strategy": strategy},
+                    on_batch=persist_chunks
+                )
+                chunk_count = len(ids)
+            elif file_ext == "xlsx" and settings.rag.EXCEL_STRUCTURED:
+                # Excel: un chunk por fila con encabezados y valores como metadata
+                ids = rag_service.add_chunk_stream(
+                    chunk_records=collect_rows(rag_service.process_excel_structured(str(file_path))),
+                    system_user_id=settings.demo.USER_ID,
+                    company_id=settings.demo.COMPANY_ID,
+                    document_id=doc.id,
+                    filename=file.filename,
+                    metadata={"file_type": file_ext, "structured": True},
+                    on_batch=persist_chunks
+                )
+                chunk_count = len(ids)
+                products = products_from_rows(excel_rows)
+            else:
+                # Extraer texto
+                text = rag_service.process_document(str(file_path), file_ext)
+                products = extract_products(text)
+                
+                # Dividir en chunks (con precio/stock/marca del producto de su sección)
+                # y agregar al vector store
+                ids = rag_service.add_chunk_stream(
+                    chunk_records=with_children(with_product_metadata(
+                        rag_service.chunk_records(text, chunk_size, chunk_overlap, strategy), products
+                    )),
+                    system_user_id=settings.demo.USER_ID,
+                    company_id=settings.demo.COMPANY_ID,
+                    document_id=doc.id,
+                    filename=file.filename,
+                    metadata={"file_type": file_ext, "chunk_strategy": strategy},
+                    on_batch=persist_chunks
+                )
+                chunk_count = len(ids)
+            
+            if parents:
+                rag_service.parent_store.put(doc.id, parents)
+            if products:
+                replace_document_products(session, settings.demo.COMPANY_ID, doc.id, products)
             
             # Actualizar documento
             doc.processed = True
-            doc.chunk_count = len(chunks)
+            doc.chunk_count = chunk_count
             session.commit()
+            if products:
+                product_catalog.invalidate(settings.demo.COMPANY_ID)
             
-            print(f"✅ Documento procesado: {file.filename} - {len(chunks)} chunks")
+            print(f"✅ Documento procesado: {file.filename} - {chunk_count} chunks, {len(products)} productos")
             
             return {
                 "ok": True,
                 "document_id": doc.id,
                 "filename": file.filename,
-                "chunks": len(chunks)
+                "chunks": chunk_count,
+                "products": len(products)
             }
             
         except Exception as e:
             print(f"❌ Error procesando documento: {e}")
+            # Descartar las filas de chunks del lote fallido y los vectores ya indexados
+            session.rollback()
+            rag_service.delete_document_from_vectorstore(doc.id)
             doc.processed = False
             session.commit()
             return JSONResponse(
@@ -533,6 +826,27 @@ async def upload_document(file: UploadFile = File(...), session: Session = Depen
         )
 
 
+@app.post("/api/rag/chunks/lookup")
+async def lookup_chunks(payload=Body(...), session: Session = Depends(get_session)):
+    """Buscar chunks por id (los "chunk_id" de sources) sin consultar el vector store"""
+    try:
+        ids = payload.get("ids") or []
+        if not isinstance(ids, list) or len(ids) > 500:
+            return JSONResponse(
+                {"ok": False, "detail": "ids debe ser una lista de hasta 500 elementos"},
+                status_code=400
+            )
+        chunks = get_chunks_by_ids(session, [str(chunk_id) for chunk_id in ids])
+        return {"ok": True, "chunks": chunks, "missing": [chunk_id for chunk_id in ids if str(chunk_id) not in chunks]}
+        
+    except Exception as e:
+        print(f"❌ Error buscando chunks: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
 @app.get("/api/rag/documents")
 async def list_documents(session: Session = Depends(get_session)):
     """Listar documentos RAG"""
@@ -576,6 +890,10 @@ async def delete_document(document_id: int, session: Session = Depends(get_sessi
                 status_code=404
             )
         
+        # Eliminar chunks del vector store
+        if not await asyncio.to_thread(rag_service.delete_document_from_vectorstore, doc.id):
+            print(f"⚠️ Chunks del documento {doc.id} pendientes para el GC de vectores")
+        
         # Eliminar archivo físico si existe
         if doc.file_path and os.path.exists(doc.file_path):
             os.remove(doc.file_path)
@@ -583,6 +901,7 @@ async def delete_document(document_id: int, session: Session = Depends(get_sessi
         # Eliminar de la base de datos
         session.delete(doc)
         session.commit()
+        product_catalog.invalidate(doc.company_id)
         
         print(f"✅ Documento eliminado: {doc.filename}")
         
@@ -596,6 +915,92 @@ async def delete_document(document_id: int, session: Session = Depends(get_sessi
         )
 
 
+@app.post("/api/rag/gc")
+async def run_vector_gc(dry_run: bool = False):
+    """Reconciliar el vector store con los documentos: borrar chunks huérfanos (sin compactar)"""
+    try:
+        report = await asyncio.to_thread(vector_gc.run, SessionLocal, dry_run)
+        if not report.get("ok"):
+            return JSONResponse(report, status_code=409)
+        return report
+        
+    except Exception as e:
+        print(f"❌ Error en GC de vectores: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
+@app.get("/api/rag/gc")
+async def get_vector_gc_report():
+    """Último reporte del GC de vectores"""
+    return {"ok": True, "interval_s": vector_gc.interval, "last_report": vector_gc.last_report}
+
+
+# ============================================================================
+# API DE ESTADÍSTICAS
+# ============================================================================
+
+@app.get("/api/stats/latency")
+async def latency_dashboard(limit: int = 1000, session: Session = Depends(get_session)):
+    """Percentiles de latencia por etapa sobre los últimos requests trazados"""
+    try:
+        limit = max(1, min(limit, 20000))
+        rows = session.query(
+            RAGUsageStats.response_time_ms,
+            RAGUsageStats.success,
+            RAGUsageStats.stage_timings
+        ).order_by(RAGUsageStats.id.desc()).limit(limit).all()
+        
+        summary = summarize_latencies(
+            {"response_time_ms": row.response_time_ms, "success": row.success, "stage_timings": row.stage_timings}
+            for row in rows
+        )
+        summary["window"] = limit
+        summary["dropped_traces"] = trace_recorder.dropped
+        summary["llm_scheduler"] = llm_scheduler.stats()
+        return summary
+        
+    except Exception as e:
+        print(f"❌ Error calculando latencias: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
+@app.get("/api/stats/db-pool")
+async def db_pool_stats():
+    """Ocupación actual de los pools de conexiones (sync y async)"""
+    return {
+        "sync": pool_stats(engine),
+        "async": pool_stats(async_engine),
+    }
+
+
+@app.get("/api/stats/catalog")
+async def catalog_stats():
+    """Respuestas directas desde el índice de productos: tasa de aciertos y latencia ahorrada"""
+    return product_catalog.stats()
+
+
+@app.get("/api/stats/tokens")
+async def token_usage(company_id: int = None, days: int = None, session: Session = Depends(get_session)):
+    """Uso de tokens y tiempo de GPU agregado por empresa/modelo y por prompt"""
+    try:
+        from datetime import timedelta
+        since = datetime.now() - timedelta(days=days) if days else None
+        return usage_summary(session, company_id=company_id, since=since)
+        
+    except Exception as e:
+        print(f"❌ Error agregando uso de tokens: {e}")
+        return JSONResponse(
+            {"ok": False, "detail": str(e)},
+            status_code=500
+        )
+
+
 @app.post("/api/scrape-prices")
 async def scrape_prices(request: dict):
     """
@@ -664,75 +1069,27 @@ async def scrape_prices(request: dict):
         )
 
 
-@app.post("/api/export-training-data")
-async def export_training_data(request: dict):
+@app.get("/api/export-training-data")
+async def export_training_data(
+    company_id: int = settings.demo.COMPANY_ID,
+    min_messages: int = 2,
+    gzip: bool = False,
+    system_prompt: str = None
+):
     """
     Exportar conversaciones en formato JSONL para fine-tuning
+
+    La respuesta se genera en streaming desde un cursor del servidor: el
+    tamaño de la exportación no afecta la memoria del proceso.
     """
-    try:
-        company_id = request.get("company_id", 2)
-        
-        print(f"📤 Exportando datos de entrenamiento para company_id: {company_id}")
-        
-        # Obtener conversaciones con mensajes
-        session = SessionLocal()
-        conversations = session.query(Conversation).filter(
-            Conversation.company_id == company_id
-        ).limit(100).all()
-        
-        if len(conversations) < 10:
-            return JSONResponse(
-                {"ok": False, "detail": "Necesitas al menos 10 conversaciones"},
-                status_code=400
-            )
-        
-        # Formatear en JSONL para OpenAI
-        training_data = []
-        for conv in conversations:
-            messages_query = session.query(Message).filter(
-                Message.conversation_id == conv.id
-            ).order_by(Message.created_at).all()
-            
-            if len(messages_query) < 2:
-                continue
-            
-            # Formato OpenAI
-            conversation_messages = [
-                {"role": "system", "content": "Eres un asesor de ventas experto de TechStore Perú, especializado en productos tecnológicos."}
-            ]
-            
-            for msg in messages_query:
-                role = "user" if msg.sender_type == "client" else "assistant"
-                conversation_messages.append({
-                    "role": role,
-                    "content": msg.content
-                })
-            
-            training_data.append({
-                "messages": conversation_messages
-            })
-        
-        session.close()
-        
-        # Convertir a JSONL
-        import json
-        jsonl_data = "\n".join([json.dumps(item, ensure_ascii=False) for item in training_data])
-        
-        print(f"✅ {len(training_data)} conversaciones exportadas")
-        
-        return {
-            "ok": True,
-            "training_data": jsonl_data,
-            "count": len(training_data),
-            "format": "JSONL (OpenAI compatible)"
-        }
-        
-    except Exception as e:
-        print(f"❌ Error exportando datos: {e}")
-        return JSONResponse(
-            {"ok": False, "detail": str(e)},
-            status_code=500
-        )
+    print(f"📤 Exportando datos de entrenamiento para company_id: {company_id}")
+    filename = f"training_data_{company_id}_{datetime.now().strftime('%Y%m%d')}.jsonl"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}{".gz" if gzip else ""}"'}
+    return StreamingResponse(
+        stream_training_data(company_id, system_prompt, max(1, min_messages), compress=gzip),
+        media_type="application/gzip" if gzip else "application/jsonl",
+        headers=headers
+    )
 
 
 # ============================================================================
@@ -313,6 +313,9 @@ class Message(Base):
 
     # Model info
     model_used: Mapped[str] = mapped_column(String(50), nullable=True, comment='OpenAI model used (e.g., gpt-4-turbo-preview)')
+    generation_time_ms: Mapped[int] = mapped_column(Integer, nullable=True, comment='LLM generation time (Ollama total_duration) in ms')
+    tokens_per_second: Mapped[Decimal] = mapped_column(Numeric(8, 2), nullable=True, comment='Completion tokens per second')
+    prompt_hash: Mapped[str] = mapped_column(String(16), nullable=True, index=True, comment='Hash of the system prompt used')
 
     sent_at: Mapped[str] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[str] = mapped_column(DateTime, server_default=func.now())
@@ -406,3 +409,19 @@ class KnowledgeBaseFile(Base):
     uploaded_by_user: Mapped[Optional['SystemUser']] = relationship('SystemUser', back_populates='uploaded_files', foreign_keys=[uploaded_by_id])
 
 
+
+
+class ArchivedConversation(Base):
+    """Manifiesto de conversaciones movidas a archivos Parquet (ver archive_service)"""
+    __tablename__ = 'archived_conversations'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    conversation_id: Mapped[int] = mapped_column(Integer, unique=True, index=True, nullable=False, comment='Original conversation ID')
+    client_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True, comment='Client ID at archive time')
+    company_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True, comment='Company ID at archive time')
+    month: Mapped[str] = mapped_column(String(7), index=True, comment='Partition month (YYYY-MM)')
+    file_path: Mapped[str] = mapped_column(String(500), comment='Parquet file holding the messages')
+    message_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    first_message_at: Mapped[str] = mapped_column(DateTime, nullable=True)
+    last_message_at: Mapped[str] = mapped_column(DateTime, nullable=True)
+    conversation_data: Mapped[str] = mapped_column(JSON, nullable=True, comment='Original conversation row')
+    archived_at: Mapped[str] = mapped_column(DateTime, server_default=func.now())
@@ -47,7 +47,7 @@ class UserDocument(Base):
     # Relationships
     system_user = relationship("SystemUser")
     company = relationship("Company")
-    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class DocumentChunk(Base):
@@ -60,6 +60,7 @@ class DocumentChunk(Base):
     content = Column(Text, nullable=False, comment="Contenido del chunk")
     embedding_id = Column(String(100), index=True, comment="ID en la vector DB (Chroma)")
     token_count = Column(Integer, comment="Número de tokens en el chunk")
+    content_hash = Column(String(40), index=True, comment="SHA-1 del contenido (re-ingesta incremental)")
     chunk_metadata = Column(JSON, comment="Metadata del chunk")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -67,6 +68,25 @@ class DocumentChunk(Base):
     document = relationship("UserDocument", back_populates="chunks")
 
 
+class CatalogProduct(Base):
+    """Productos extraídos de los documentos de catálogo (respuestas directas de precio/stock)"""
+    __tablename__ = "catalog_products"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("user_documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String(255), nullable=False, comment="Nombre del producto")
+    brand = Column(String(100), index=True)
+    model = Column(String(100), comment="Modelo o código del fabricante")
+    sku = Column(String(100), index=True)
+    category = Column(String(255))
+    price = Column(Float)
+    stock = Column(Integer)
+    specs = Column(JSON, comment="Especificaciones: {etiqueta: valor}")
+    section = Column(String(500), comment="Ruta de encabezados o fila de origen")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class UserRAGConfig(Base):
     """Configuración RAG por usuario"""
     __tablename__ = "user_rag_config"
@@ -76,6 +96,7 @@ class UserRAGConfig(Base):
     company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=True, index=True, comment="Company (shared config)")
     chunk_size = Column(Integer, default=512, comment="Tamaño de chunks en tokens")
     chunk_overlap = Column(Integer, default=50, comment="Overlap entre chunks")
+    chunk_strategy = Column(String(20), nullable=True, comment="recursive | tokens | markdown | auto (NULL = RAG_CHUNK_STRATEGY)")
     top_k = Column(Integer, default=5, comment="Número de chunks a recuperar")
     temperature = Column(Float, default=0.7, comment="Temperatura del LLM")
     model_name = Column(String(50), default="mistral", comment="Modelo LLM a usar")
@@ -120,6 +141,7 @@ class RAGUsageStats(Base):
     model_used = Column(String(50))
     success = Column(Boolean, default=True, index=True)
     error_message = Column(Text)
+    stage_timings = Column(JSON, comment="Spans por etapa: [{name, start_ms, duration_ms}]")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
     # Relationships
@@ -0,0 +1,177 @@
+"""
+Contabilidad de tokens y costos
+Registra el uso de cada respuesta del LLM en Message y acumula los totales
+de Conversation y Client con incrementos atómicos en SQL
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, update, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.current import Client, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_fingerprint(system_prompt: Optional[str]) -> Optional[str]:
+    """Hash corto del system prompt para agrupar el uso por prompt"""
+    if not system_prompt:
+        return None
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def usage_from_result(result: Dict[str, Any], model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extrae el uso de tokens de una respuesta de OllamaService.generate
+
+    Args:
+        result: Dict retornado por generate / generate_with_rag
+        model: Modelo (si no viene en el resultado)
+
+    Returns:
+        Dict con tokens, costos, tiempo de generación y velocidad
+    """
+    prompt_tokens = int(result.get("prompt_eval_count") or 0)
+    completion_tokens = int(result.get("eval_count") or 0)
+    cost_per_prompt = Decimal(settings.ollama.COST_PER_PROMPT_TOKEN)
+    cost_per_completion = Decimal(settings.ollama.COST_PER_COMPLETION_TOKEN)
+    eval_duration = result.get("eval_duration") or 0
+
+    return {
+        "model_used": result.get("model") or model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost_per_prompt_token": cost_per_prompt,
+        "cost_per_completion_token": cost_per_completion,
+        "total_cost": cost_per_prompt * prompt_tokens + cost_per_completion * completion_tokens,
+        "generation_time_ms": int((result.get("total_duration") or 0) / 1e6),
+        "tokens_per_second": (
+            Decimal(completion_tokens / (eval_duration / 1e9)).quantize(Decimal("0.01"))
+            if completion_tokens and eval_duration else None
+        ),
+    }
+
+
+def apply_message_usage(message: Message, usage: Dict[str, Any], system_prompt: Optional[str] = None):
+    """
+    Copia el uso de tokens a un Message (antes de insertarlo)
+
+    Args:
+        message: Mensaje del asistente
+        usage: Uso calculado con usage_from_result
+        system_prompt: System prompt usado (se guarda su hash)
+    """
+    for field, value in usage.items():
+        setattr(message, field, value)
+    message.prompt_hash = prompt_fingerprint(system_prompt)
+
+
+def increment_totals(
+    session: Session,
+    conversation_id: int,
+    client_id: Optional[int],
+    usage: Optional[Dict[str, Any]] = None,
+    messages: int = 2
+):
+    """
+    Acumula el uso en Conversation y Client con UPDATE ... SET x = x + n
+
+    Evita el read-modify-write: dos respuestas concurrentes de la misma
+    conversación no se pisan los totales. Se llama en cada turno guardado,
+    aunque la respuesta no haya consumido tokens (catálogo, respuesta
+    compartida o de error), para que Client.total_messages cuente todos los
+    mensajes. No hace commit.
+
+    Args:
+        session: Sesión de BD
+        conversation_id: ID de la conversación
+        client_id: ID del cliente (opcional)
+        usage: Uso calculado con usage_from_result (None si no hubo generación)
+        messages: Mensajes guardados en el turno (usuario + asistente)
+    """
+    conversation_values: Dict[str, Any] = {"last_message_at": datetime.now()}
+    client_values: Dict[str, Any] = {"total_messages": Client.total_messages + messages}
+    if usage and (usage["total_tokens"] or usage["total_cost"]):
+        conversation_values.update(
+            total_tokens_used=Conversation.total_tokens_used + usage["total_tokens"],
+            total_prompt_tokens=Conversation.total_prompt_tokens + usage["prompt_tokens"],
+            total_completion_tokens=Conversation.total_completion_tokens + usage["completion_tokens"],
+            total_cost=Conversation.total_cost + usage["total_cost"]
+        )
+        client_values.update(
+            total_tokens_used=Client.total_tokens_used + usage["total_tokens"],
+            total_prompt_tokens=Client.total_prompt_tokens + usage["prompt_tokens"],
+            total_completion_tokens=Client.total_completion_tokens + usage["completion_tokens"],
+            total_cost=Client.total_cost + usage["total_cost"]
+        )
+
+    session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(**conversation_values)
+        .execution_options(synchronize_session=False)
+    )
+    if client_id:
+        session.execute(
+            update(Client)
+            .where(Client.id == client_id)
+            .values(**client_values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def usage_summary(session: Session, company_id: Optional[int] = None, since: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Agrega el uso de tokens y tiempo de GPU por empresa, modelo y prompt
+
+    Args:
+        session: Sesión de BD
+        company_id: Filtrar por empresa (opcional)
+        since: Considerar solo mensajes desde esta fecha (opcional)
+
+    Returns:
+        {"companies": [...], "prompts": [...]} ordenados por tiempo de generación
+    """
+    conditions = [Message.role == "assistant", Message.total_tokens > 0]
+    if company_id is not None:
+        conditions.append(Client.company_id == company_id)
+    if since is not None:
+        conditions.append(Message.created_at >= since)
+
+    metrics = (
+        func.count(Message.id).label("messages"),
+        func.sum(Message.prompt_tokens).label("prompt_tokens"),
+        func.sum(Message.completion_tokens).label("completion_tokens"),
+        func.sum(Message.total_tokens).label("total_tokens"),
+        func.sum(Message.total_cost).label("total_cost"),
+        func.sum(Message.generation_time_ms).label("generation_time_ms"),
+        func.avg(Message.tokens_per_second).label("avg_tokens_per_second"),
+    )
+
+    def _rows(*group_by):
+        stmt = (
+            select(*group_by, *metrics)
+            .join(Client, Client.id == Message.client_id)
+            .where(*conditions)
+            .group_by(*group_by)
+            .order_by(func.sum(Message.generation_time_ms).desc())
+        )
+        return [
+            {
+                key: (float(value) if isinstance(value, Decimal) else value)
+                for key, value in row._mapping.items()
+            }
+            for row in session.execute(stmt)
+        ]
+
+    return {
+        "companies": _rows(Client.company_id, Message.model_used),
+        "prompts": _rows(Client.company_id, Message.prompt_hash),
+    }
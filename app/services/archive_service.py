@@ -0,0 +1,321 @@
+"""
+Archivado de conversaciones antiguas
+Mueve las conversaciones cerradas o inactivas y sus mensajes a archivos
+Parquet comprimidos particionados por empresa y mes, los borra de MySQL en
+lotes acotados y permite leerlas o restaurarlas bajo demanda. Así la tabla
+messages conserva solo el conjunto de trabajo que usan las consultas en vivo
+"""
+
+import logging
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.current import ArchivedConversation, ChatAssignment, Client, Conversation, Message
+from app.models.rag_models import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _row_to_json(table, row) -> Dict[str, Any]:
+    """Fila de una tabla como dict serializable a JSON"""
+    return {column.name: _json_value(getattr(row, column.name)) for column in table.columns}
+
+
+def _row_from_json(table, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverso de _row_to_json: restaura fechas y decimales según el tipo de columna"""
+    row = {}
+    for column in table.columns:
+        if column.name not in data:
+            continue
+        value = data[column.name]
+        python_type = None
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            pass
+        if value is not None and python_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif value is not None and python_type is Decimal:
+            value = Decimal(value)
+        row[column.name] = value
+    return row
+
+
+def _partition_month(conversation: Dict[str, Any]) -> str:
+    last_activity = conversation.get("last_message_at") or conversation.get("updated_at") or conversation.get("created_at")
+    return last_activity[:7] if last_activity else "unknown"
+
+
+class ConversationArchiveService:
+    """Archiva conversaciones en Parquet y las restaura bajo demanda"""
+
+    def __init__(
+        self,
+        base_dir: str = "./archive",
+        batch_size: int = 200,
+        delete_batch_size: int = 1000,
+        compression: str = "zstd"
+    ):
+        """
+        Args:
+            base_dir: Directorio raíz de los archivos Parquet
+            batch_size: Conversaciones por lote (un archivo por partición y lote)
+            delete_batch_size: Filas máximas por DELETE (transacciones cortas)
+            compression: Códec Parquet (zstd, snappy, gzip)
+        """
+        self.base_dir = base_dir
+        self.batch_size = batch_size
+        self.delete_batch_size = delete_batch_size
+        self.compression = compression
+
+    # ------------------------------------------------------------------
+    # Selección
+    # ------------------------------------------------------------------
+
+    def _candidates_query(self, older_than_days: int, closed_after_days: int, closed_statuses: List[str], company_id: Optional[int]):
+        now = datetime.now()
+        last_activity = func.coalesce(Conversation.last_message_at, Conversation.updated_at, Conversation.created_at)
+        stmt = (
+            select(Conversation, Client.company_id)
+            .outerjoin(Client, Client.id == Conversation.client_id)
+            .where(or_(
+                last_activity < now - timedelta(days=older_than_days),
+                and_(
+                    Conversation.status.in_(closed_statuses),
+                    last_activity < now - timedelta(days=closed_after_days)
+                )
+            ))
+        )
+        if company_id is not None:
+            stmt = stmt.where(Client.company_id == company_id)
+        return stmt
+
+    # ------------------------------------------------------------------
+    # Archivado
+    # ------------------------------------------------------------------
+
+    def _write_partition(self, company_id: Optional[int], month: str, rows: List[Dict[str, Any]]) -> str:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.base_dir, f"company_id={company_id if company_id is not None else 0}", f"month={month}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+        # Escribir a un temporal y renombrar: nunca queda un Parquet a medias
+        tmp_path = path + ".tmp"
+        pq.write_table(pa.Table.from_pylist(rows), tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+        return path
+
+    def _delete_in_batches(self, session: Session, model, column, values: List[int]) -> int:
+        """DELETE ... WHERE column IN (...) en lotes, con commit por lote"""
+        deleted = 0
+        for start in range(0, len(values), self.delete_batch_size):
+            batch = values[start:start + self.delete_batch_size]
+            deleted += session.execute(delete(model).where(column.in_(batch))).rowcount or 0
+            session.commit()
+        return deleted
+
+    def _purge(self, session: Session, conversation_ids: List[int]) -> int:
+        """Borra de MySQL los mensajes y conversaciones ya registrados en el manifiesto"""
+        message_ids = session.scalars(
+            select(Message.id).where(Message.conversation_id.in_(conversation_ids)).order_by(Message.id)
+        ).all()
+        deleted = self._delete_in_batches(session, Message, Message.id, list(message_ids))
+        self._delete_in_batches(session, ConversationMemory, ConversationMemory.conversation_id, conversation_ids)
+        self._delete_in_batches(session, ChatAssignment, ChatAssignment.conversation_id, conversation_ids)
+        self._delete_in_batches(session, Conversation, Conversation.id, conversation_ids)
+        return deleted
+
+    def archive(
+        self,
+        session: Session,
+        older_than_days: int,
+        closed_after_days: int,
+        closed_statuses: List[str],
+        company_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        dry_run: bool = False,
+        progress: Optional[Callable[[Dict[str, int]], None]] = None
+    ) -> Dict[str, int]:
+        """
+        Archiva las conversaciones candidatas lote a lote
+
+        Cada lote escribe primero los Parquet y el manifiesto (commit) y
+        después borra en MySQL; si el proceso se corta entre ambos pasos, la
+        siguiente ejecución completa el borrado sin volver a escribir.
+
+        Args:
+            session: Sesión síncrona
+            older_than_days: Días sin actividad para archivar cualquier conversación
+            closed_after_days: Días sin actividad para archivar una conversación cerrada
+            closed_statuses: Estados que se consideran cerrados
+            company_id: Limitar a una empresa
+            limit: Máximo de conversaciones a procesar
+            dry_run: Solo contar candidatas
+            progress: Callback con las estadísticas tras cada lote
+
+        Returns:
+            {"conversations", "messages", "files", "purged_only"}
+        """
+        stats = {"conversations": 0, "messages": 0, "files": 0, "purged_only": 0}
+        candidates = self._candidates_query(older_than_days, closed_after_days, closed_statuses, company_id)
+        last_id = 0
+
+        while limit is None or stats["conversations"] < limit:
+            batch_size = self.batch_size if limit is None else min(self.batch_size, limit - stats["conversations"])
+            rows = session.execute(
+                candidates.where(Conversation.id > last_id).order_by(Conversation.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0].id
+            stats["conversations"] += len(rows)
+            if dry_run:
+                continue
+
+            conversation_ids = [conversation.id for conversation, _ in rows]
+            already_archived = set(session.scalars(
+                select(ArchivedConversation.conversation_id).where(ArchivedConversation.conversation_id.in_(conversation_ids))
+            ).all())
+            stats["purged_only"] += len(already_archived)
+
+            pending = [(conversation, owner) for conversation, owner in rows if conversation.id not in already_archived]
+            if pending:
+                stats["files"] += self._archive_batch(session, pending)
+            stats["messages"] += self._purge(session, conversation_ids)
+            session.expunge_all()
+            if progress:
+                progress(stats)
+
+        return stats
+
+    def _archive_batch(self, session: Session, rows) -> int:
+        """Escribe los Parquet de un lote y registra el manifiesto; devuelve los archivos creados"""
+        message_table = Message.__table__
+        conversations = {conversation.id: (_row_to_json(Conversation.__table__, conversation), owner) for conversation, owner in rows}
+        messages: Dict[int, List[Dict[str, Any]]] = {conversation_id: [] for conversation_id in conversations}
+        for message in session.execute(
+            select(message_table).where(message_table.c.conversation_id.in_(list(conversations))).order_by(message_table.c.id)
+        ).mappings():
+            messages[message["conversation_id"]].append(dict(message))
+
+        partitions: Dict[tuple, List[int]] = {}
+        for conversation_id, (data, owner) in conversations.items():
+            partitions.setdefault((owner, _partition_month(data)), []).append(conversation_id)
+
+        manifest = []
+        files = 0
+        for (owner, month), conversation_ids in partitions.items():
+            partition_rows = [message for conversation_id in conversation_ids for message in messages[conversation_id]]
+            path = None
+            if partition_rows:
+                path = self._write_partition(owner, month, partition_rows)
+                files += 1
+            for conversation_id in conversation_ids:
+                data, _ = conversations[conversation_id]
+                conversation_messages = messages[conversation_id]
+                manifest.append({
+                    "conversation_id": conversation_id,
+                    "client_id": data.get("client_id"),
+                    "company_id": owner,
+                    "month": month,
+                    "file_path": path or "",
+                    "message_count": len(conversation_messages),
+                    "first_message_at": conversation_messages[0]["created_at"] if conversation_messages else None,
+                    "last_message_at": conversation_messages[-1]["created_at"] if conversation_messages else None,
+                    "conversation_data": data,
+                })
+
+        session.execute(insert(ArchivedConversation), manifest)
+        session.commit()
+        return files
+
+    # ------------------------------------------------------------------
+    # Lectura y restauración
+    # ------------------------------------------------------------------
+
+    def _read_messages(self, entry: ArchivedConversation) -> List[Dict[str, Any]]:
+        if not entry.file_path:
+            return []
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(entry.file_path, filters=[("conversation_id", "=", entry.conversation_id)])
+        return sorted(table.to_pylist(), key=lambda message: message["id"])
+
+    def load(self, session: Session, conversation_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Lee una conversación archivada sin restaurarla
+
+        Returns:
+            {"conversation", "messages", "archive"} o None si no está archivada
+        """
+        entry = session.scalar(select(ArchivedConversation).where(ArchivedConversation.conversation_id == conversation_id))
+        if entry is None:
+            return None
+        return {
+            "conversation": entry.conversation_data,
+            "messages": [{key: _json_value(value) for key, value in message.items()} for message in self._read_messages(entry)],
+            "archive": {
+                "company_id": entry.company_id,
+                "month": entry.month,
+                "file_path": entry.file_path,
+                "archived_at": _json_value(entry.archived_at),
+            },
+        }
+
+    def restore(self, session: Session, conversation_id: int) -> Optional[int]:
+        """
+        Devuelve una conversación archivada a MySQL (con sus IDs originales)
+
+        El Parquet no se modifica (puede contener otras conversaciones); se
+        elimina la entrada del manifiesto para que vuelva a ser una
+        conversación activa. Si no recibe actividad, la siguiente ejecución
+        del archivado la volverá a archivar.
+
+        Returns:
+            Mensajes restaurados, o None si no está archivada
+        """
+        entry = session.scalar(select(ArchivedConversation).where(ArchivedConversation.conversation_id == conversation_id))
+        if entry is None:
+            return None
+
+        conversation = _row_from_json(Conversation.__table__, entry.conversation_data or {"id": conversation_id})
+        messages = self._read_messages(entry)
+        # El cliente pudo haberse eliminado desde el archivado
+        client_id = conversation.get("client_id")
+        if client_id is not None and session.get(Client, client_id) is None:
+            conversation["client_id"] = None
+            for message in messages:
+                message["client_id"] = None
+
+        session.execute(insert(Conversation), [conversation])
+        for start in range(0, len(messages), self.delete_batch_size):
+            session.execute(insert(Message.__table__), messages[start:start + self.delete_batch_size])
+        session.delete(entry)
+        session.commit()
+        return len(messages)
+
+
+# Instancia global
+archive_service = ConversationArchiveService(
+    base_dir=settings.archive.DIR,
+    batch_size=settings.archive.BATCH_SIZE,
+    delete_batch_size=settings.archive.DELETE_BATCH_SIZE,
+    compression=settings.archive.COMPRESSION
+)
@@ -0,0 +1,95 @@
+"""
+Persistencia de chunks en MySQL (DocumentChunk)
+Filas con contenido, id del vector en Chroma, tokens y hash, insertadas en
+bloque por lote de embeddings; permiten borrados dirigidos, re-ingesta
+incremental y buscar un chunk por id sin consultar el vector store
+"""
+
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models.rag_models import DocumentChunk, UserDocument
+from app.services.chunking import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Claves a nivel de documento (build_chunk_metadata): no se duplican en chunk_metadata
+STANDARD_METADATA_KEYS = frozenset((
+    "user_id", "company_id", "document_id", "filename", "chunk_index", "total_chunks", "timestamp", "file_type", "chunk_strategy",
+))
+
+
+def content_hash(text: str) -> str:
+    """SHA-1 del contenido normalizado en espacios"""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def build_chunk_rows(
+    document_id: int,
+    embedding_ids: List[str],
+    texts: List[str],
+    metadatas: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Filas de DocumentChunk para un lote ya indexado
+
+    Args:
+        document_id: ID del documento
+        embedding_ids: IDs devueltos por el vector store (mismo orden que texts)
+        texts: Contenido de cada chunk
+        metadatas: Metadata de cada chunk (ver RAGService.build_chunk_metadata)
+    """
+    rows = []
+    for embedding_id, text, metadata in zip(embedding_ids, texts, metadatas):
+        extra = {key: value for key, value in metadata.items() if key not in STANDARD_METADATA_KEYS}
+        rows.append({
+            "document_id": document_id,
+            "chunk_index": metadata.get("chunk_index", len(rows)),
+            "content": text,
+            "embedding_id": embedding_id,
+            "token_count": count_tokens(text),
+            "content_hash": content_hash(text),
+            "chunk_metadata": extra or None,
+        })
+    return rows
+
+
+def insert_chunk_rows(session: Session, rows: List[Dict[str, Any]]) -> int:
+    """Inserta las filas en una sola sentencia (executemany); no hace commit"""
+    if rows:
+        session.execute(insert(DocumentChunk), rows)
+    return len(rows)
+
+
+def get_chunks_by_ids(session: Session, embedding_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Busca chunks por id del vector store (índice sobre embedding_id)
+
+    Returns:
+        {embedding_id: {"id", "document_id", "filename", "chunk_index", "content", "token_count", "metadata"}}
+    """
+    embedding_ids = list(dict.fromkeys(embedding_ids))
+    if not embedding_ids:
+        return {}
+    rows = session.execute(
+        select(DocumentChunk, UserDocument.filename)
+        .join(UserDocument, UserDocument.id == DocumentChunk.document_id)
+        .where(DocumentChunk.embedding_id.in_(embedding_ids))
+    ).all()
+    return {
+        chunk.embedding_id: {
+            "id": chunk.embedding_id,
+            "document_id": chunk.document_id,
+            "filename": filename,
+            "chunk_index": chunk.chunk_index,
+            "content": chunk.content,
+            "token_count": chunk.token_count,
+            "metadata": chunk.chunk_metadata or {},
+        }
+        for chunk, filename in rows
+    }
+
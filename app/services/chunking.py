@@ -0,0 +1,278 @@
+"""
+Motor de chunking
+Estrategias intercambiables para dividir texto en chunks:
+
+- recursive: separadores jerárquicos con tamaño en caracteres (comportamiento original)
+- tokens: los mismos separadores con tamaño en tokens (cl100k_base)
+- markdown: una sección por chunk según los encabezados (#...######), con la
+  ruta de encabezados como contexto; solo se subdividen las secciones que
+  exceden el tamaño
+- auto: markdown para .md, recursive para el resto (chunk_size sigue
+  en caracteres para los demás archivos)
+
+parent_child_records subdivide esos chunks (padres) en hijos pequeños para
+parent-document retrieval (ver app.services.parent_store).
+
+Los chunkers son inmutables y se comparten por (estrategia, tamaño, overlap),
+así que pueden usarse desde varias cargas concurrentes. El largo de cada
+fragmento se calcula una sola vez y los chunks se arman en una pasada.
+"""
+
+import logging
+import re
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STRATEGIES = ("recursive", "tokens", "markdown", "auto")
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", ". ", " ", "")
+
+_HEADER_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_RULE_PATTERN = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Encoding de tiktoken (carga diferida; False si no está disponible)"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"tiktoken no disponible, se estiman tokens por longitud: {e}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens del texto (cl100k_base; ~4 caracteres por token si no hay tiktoken)"""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4) if text else 0
+
+
+def resolve_strategy(strategy: Optional[str], file_type: Optional[str] = None) -> str:
+    """
+    Estrategia concreta para un archivo
+
+    Args:
+        strategy: recursive | tokens | markdown | auto (None = auto)
+        file_type: Extensión del archivo (pdf, md, ...)
+    """
+    strategy = (strategy or "auto").lower()
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"Estrategia de chunking inválida: {strategy!r} (usar {', '.join(CHUNK_STRATEGIES)})")
+    if strategy == "auto":
+        return "markdown" if (file_type or "").lower() == "md" else "recursive"
+    return strategy
+
+
+class TextChunker:
+    """Divide texto con una estrategia fija (inmutable: seguro entre threads)"""
+
+    def __init__(self, strategy: str = "recursive", chunk_size: int = 512, chunk_overlap: int = 50, separators=DEFAULT_SEPARATORS):
+        """
+        Args:
+            strategy: recursive | tokens | markdown
+            chunk_size: Tamaño máximo de un chunk (caracteres en recursive, tokens en el resto)
+            chunk_overlap: Solapamiento entre chunks consecutivos de una misma sección
+            separators: Separadores en orden de preferencia ("" = corte duro)
+        """
+        if strategy not in ("recursive", "tokens", "markdown"):
+            raise ValueError(f"Estrategia de chunking inválida: {strategy!r}")
+        if chunk_size <= 0 or chunk_overlap < 0 or chunk_overlap >= chunk_size:
+            raise ValueError(f"Tamaños inválidos: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
+        self.strategy = strategy
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        self.length: Callable[[str], int] = len if strategy == "recursive" else count_tokens
+
+    # ------------------------------------------------------------------
+    # División recursiva + fusión
+    # ------------------------------------------------------------------
+
+    def _hard_split(self, text: str, limit: int) -> List[Tuple[str, int]]:
+        encoding = _get_encoding() if self.length is count_tokens else None
+        if encoding:
+            tokens = encoding.encode(text, disallowed_special=())
+            return [
+                (encoding.decode(tokens[start:start + limit]), len(tokens[start:start + limit]))
+                for start in range(0, len(tokens), limit)
+            ]
+        # Caracteres (o tokens estimados a ~4 caracteres)
+        step = limit if self.length is len else limit * 4
+        return [(text[start:start + step], self.length(text[start:start + step])) for start in range(0, len(text), step)]
+
+    def _split(self, text: str, length: int, separators: Tuple[str, ...], limit: int) -> List[Tuple[str, int]]:
+        """Fragmentos de a lo sumo `limit` con su largo (cada largo se calcula una vez)"""
+        if length <= limit:
+            return [(text, length)]
+        for position, separator in enumerate(separators):
+            if separator == "":
+                return self._hard_split(text, limit)
+            if separator in text:
+                parts = text.split(separator)
+                pieces = []
+                for index, part in enumerate(parts):
+                    # Conservar el separador para que unir los fragmentos reconstruya el texto
+                    if index < len(parts) - 1:
+                        part += separator
+                    if part:
+                        pieces.extend(self._split(part, self.length(part), separators[position + 1:], limit))
+                return pieces
+        return self._hard_split(text, limit)
+
+    def _merge(self, pieces: List[Tuple[str, int]], limit: int) -> List[str]:
+        """Agrupa fragmentos consecutivos hasta `limit`, repitiendo hasta chunk_overlap al inicio del siguiente"""
+        chunks = []
+        window: "deque[Tuple[str, int]]" = deque()
+        window_length = 0
+        for text, length in pieces:
+            if window and window_length + length > limit:
+                chunk = "".join(piece for piece, _ in window).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while window and (window_length > self.chunk_overlap or window_length + length > limit):
+                    window_length -= window.popleft()[1]
+            window.append((text, length))
+            window_length += length
+        chunk = "".join(piece for piece, _ in window).strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _split_plain(self, text: str, limit: Optional[int] = None) -> List[str]:
+        limit = limit or self.chunk_size
+        return self._merge(self._split(text, self.length(text), self.separators, limit), limit)
+
+    # ------------------------------------------------------------------
+    # Markdown
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def markdown_sections(text: str) -> Iterator[Dict[str, Any]]:
+        """
+        Secciones de un markdown: cada encabezado con su cuerpo hasta el siguiente
+
+        Yields:
+            {"title", "level", "path": [encabezados ancestros], "body"}
+        """
+        stack: List[Tuple[int, str]] = []
+        title, level, body = None, 0, []
+        in_code = False
+        for line in text.splitlines():
+            if line.lstrip().startswith("```"):
+                in_code = not in_code
+            match = None if in_code else _HEADER_PATTERN.match(line)
+            if match:
+                yield {"title": title, "level": level, "path": [t for _, t in stack[:-1]] if title else [], "body": "\n".join(body)}
+                level, title = len(match.group(1)), match.group(2).strip()
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                stack.append((level, title))
+                body = []
+            elif in_code or not _RULE_PATTERN.match(line):
+                body.append(line)
+        yield {"title": title, "level": level, "path": [t for _, t in stack[:-1]] if title else [], "body": "\n".join(body)}
+
+    def _split_markdown(self, text: str) -> Iterator[Dict[str, Any]]:
+        for section in self.markdown_sections(text):
+            body = section["body"].strip()
+            if not body:
+                # Encabezado sin contenido propio: solo aporta contexto a sus hijos
+                continue
+            header_lines = []
+            if section["path"]:
+                header_lines.append(" > ".join(section["path"]))
+            if section["title"]:
+                header_lines.append("#" * section["level"] + " " + section["title"])
+            header = "\n".join(header_lines)
+            metadata = {"section": section["title"] or "", "section_path": " > ".join(section["path"])}
+
+            full = f"{header}\n{body}" if header else body
+            if self.length(full) <= self.chunk_size:
+                yield {"content": full, "metadata": metadata}
+                continue
+            # Sección grande: se subdivide y cada parte repite el encabezado
+            limit = max(self.chunk_size - self.length(header) - 1, self.chunk_size // 2)
+            for part in self._split_plain(body, limit):
+                yield {"content": f"{header}\n{part}" if header else part, "metadata": dict(metadata)}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def split_records(self, text: str) -> Iterator[Dict[str, Any]]:
+        """
+        Chunks con metadata propia de la estrategia
+
+        Yields:
+            {"content", "metadata"} (markdown agrega "section" y "section_path")
+        """
+        if self.strategy == "markdown":
+            yield from self._split_markdown(text)
+            return
+        for chunk in self._split_plain(text):
+            yield {"content": chunk, "metadata": {}}
+
+    def split_text(self, text: str) -> List[str]:
+        """Chunks como lista de textos"""
+        return [record["content"] for record in self.split_records(text)]
+
+
+def parent_child_records(
+    parent_records: Iterable[Dict[str, Any]],
+    child_chunker: TextChunker,
+    parents: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Divide cada chunk padre en chunks hijos enlazados por parent_index
+
+    Los hijos repiten el título de la sección (si no lo contienen) para no
+    perder contexto en la búsqueda. Los textos padre se agregan a `parents`
+    a medida que se recorren, en el orden de parent_index.
+
+    Yields:
+        {"content", "metadata"} con la metadata del padre más "parent_index"
+    """
+    for parent in parent_records:
+        parent_index = len(parents)
+        parents.append(parent["content"])
+        title = parent["metadata"].get("section")
+        for child in child_chunker.split_records(parent["content"]):
+            content = child["content"]
+            if title and title not in content:
+                content = f"{title}\n{content}"
+            yield {"content": content, "metadata": {**parent["metadata"], **child["metadata"], "parent_index": parent_index}}
+
+
+_chunkers: Dict[Tuple[str, int, int], TextChunker] = {}
+_chunkers_lock = threading.Lock()
+
+
+def get_chunker(strategy: str, chunk_size: int = 512, chunk_overlap: int = 50, file_type: Optional[str] = None) -> TextChunker:
+    """
+    Chunker compartido para la estrategia y tamaños indicados
+
+    Args:
+        strategy: recursive | tokens | markdown | auto
+        chunk_size: Tamaño máximo de un chunk
+        chunk_overlap: Solapamiento entre chunks
+        file_type: Extensión del archivo (para resolver "auto")
+    """
+    key = (resolve_strategy(strategy, file_type), chunk_size, chunk_overlap)
+    chunker = _chunkers.get(key)
+    if chunker is None:
+        with _chunkers_lock:
+            chunker = _chunkers.setdefault(key, TextChunker(*key))
+    return chunker
@@ -0,0 +1,105 @@
+"""
+Diversificación de chunks recuperados
+Quita casi-duplicados (solapamiento entre chunks, texto repetido en
+catálogos) o aplica MMR sobre los candidatos, con similitudes calculadas en
+una sola pasada matricial de NumPy
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+DIVERSITY_MODES = ("off", "dedup", "mmr")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _scale(values: np.ndarray) -> np.ndarray:
+    """Escala a [0, 1] (los scores de cross-encoder no están acotados)"""
+    low, high = float(values.min()), float(values.max())
+    if high - low < 1e-9:
+        return np.ones_like(values)
+    return (values - low) / (high - low)
+
+
+def remove_near_duplicates(embeddings: np.ndarray, top_k: int, threshold: float = 0.92) -> List[int]:
+    """
+    Recorre los candidatos en orden de relevancia y descarta los que se
+    parecen demasiado a uno ya elegido
+
+    Args:
+        embeddings: Matriz (n, d) en orden de relevancia
+        top_k: Candidatos a conservar
+        threshold: Similitud coseno a partir de la cual se considera duplicado
+
+    Returns:
+        Índices elegidos (en orden de relevancia)
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    unit = _normalize_rows(embeddings)
+    similarity = unit @ unit.T
+    selected: List[int] = []
+    # Máxima similitud de cada candidato con los ya elegidos
+    max_similarity = np.full(n, -1.0, dtype=np.float32)
+    for i in range(n):
+        if max_similarity[i] >= threshold:
+            continue
+        selected.append(i)
+        if len(selected) == top_k:
+            break
+        np.maximum(max_similarity, similarity[i], out=max_similarity)
+    return selected
+
+
+def mmr_select(
+    query_embedding: Sequence[float],
+    embeddings: np.ndarray,
+    top_k: int,
+    lambda_mult: float = 0.7,
+    relevance: Optional[np.ndarray] = None
+) -> List[int]:
+    """
+    Maximal Marginal Relevance
+
+    En cada paso elige el candidato que maximiza
+    lambda * relevancia - (1 - lambda) * similitud máxima con los ya elegidos.
+
+    Args:
+        query_embedding: Embedding de la consulta
+        embeddings: Matriz (n, d) de candidatos
+        top_k: Candidatos a elegir
+        lambda_mult: 1 = solo relevancia, 0 = solo diversidad
+        relevance: Relevancia externa por candidato (p.ej. score del reranker);
+            por defecto la similitud coseno con la consulta
+
+    Returns:
+        Índices elegidos (en orden de selección)
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    unit = _normalize_rows(embeddings)
+    if relevance is None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        relevance = unit @ query
+    relevance = _scale(np.asarray(relevance, dtype=np.float32))
+    similarity = unit @ unit.T
+
+    selected: List[int] = []
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float32)
+    for _ in range(min(top_k, n)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
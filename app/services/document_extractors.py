@@ -0,0 +1,522 @@
+"""
+Extractores de texto para documentos RAG
+Funciones sin estado para poder ejecutarse en procesos worker sin
+inicializar el modelo de embeddings ni ChromaDB
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import re
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Document processing
+import fitz  # PyMuPDF
+from docx import Document
+import pandas as pd
+import openpyxl
+
+from app.services.chunking import TextChunker
+
+logger = logging.getLogger(__name__)
+
+# Extensiones soportadas por la ingesta (mismas que /api/rag/upload)
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "xlsx", "txt", "md")
+
+# Encabezados de planillas de precios → campo canónico de metadata
+HEADER_ALIASES = {
+    "sku": "sku", "codigo": "sku", "cod": "sku", "item": "sku",
+    "precio": "price", "price": "price", "pvp": "price", "precio venta": "price",
+    "marca": "brand", "brand": "brand", "fabricante": "brand",
+    "categoria": "category", "category": "category", "linea": "category", "familia": "category",
+    "stock": "stock", "existencias": "stock", "unidades": "stock", "cantidad": "stock",
+    "modelo": "model", "model": "model",
+    "producto": "name", "nombre": "name", "descripcion": "name", "product": "name",
+}
+# Campos canónicos numéricos (permiten filtros por rango)
+NUMERIC_FIELDS = ("price", "stock")
+# Campos canónicos categóricos (se guardan en minúsculas para filtros exactos)
+CATEGORICAL_FIELDS = ("brand", "category", "model", "sku")
+
+
+def iter_pdf_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Itera las páginas de un PDF sin acumular el texto completo en memoria
+
+    Args:
+        file_path: Ruta al archivo PDF
+        start: Índice (0-based) de la primera página
+        end: Índice (0-based, exclusivo) de la última página; None = hasta el final
+
+    Yields:
+        Tuplas (número de página 1-based, texto de la página)
+    """
+    with fitz.open(file_path) as doc:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_index in range(start, end):
+            yield page_index + 1, doc.load_page(page_index).get_text()
+
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extrae un rango de páginas (se ejecuta en un proceso worker)"""
+    return list(iter_pdf_pages(file_path, start, end))
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Retorna el número de páginas de un PDF"""
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages_parallel(file_path: str, workers: int, pages_per_task: int = 16) -> Iterator[Tuple[int, str]]:
+    """
+    Itera las páginas de un PDF extrayendo rangos de páginas en varios procesos
+
+    Las páginas se entregan en orden a medida que terminan los rangos, con
+    una ventana acotada de tareas en vuelo para que la memoria no crezca con
+    el tamaño del documento.
+
+    Args:
+        file_path: Ruta al archivo PDF
+        workers: Número de procesos worker
+        pages_per_task: Páginas por rango enviado a cada worker
+
+    Yields:
+        Tuplas (número de página 1-based, texto de la página)
+    """
+    page_count = pdf_page_count(file_path)
+    ranges = iter([(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)])
+
+    # spawn: el proceso padre (uvicorn) tiene hilos y el modelo de embeddings cargado
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight = deque()
+        for start, end in ranges:
+            in_flight.append(pool.submit(_extract_pdf_range, file_path, start, end))
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            yield from in_flight.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                in_flight.append(pool.submit(_extract_pdf_range, file_path, *next_range))
+
+
+def extract_pdf(file_path: str) -> str:
+    """
+    Extrae texto de un archivo PDF
+
+    Args:
+        file_path: Ruta al archivo PDF
+
+    Returns:
+        Texto extraído del PDF
+    """
+    try:
+        return "".join(text for _, text in iter_pdf_pages(file_path))
+    except Exception as e:
+        logger.error(f"Error procesando PDF {file_path}: {e}")
+        raise
+
+
+def extract_docx(file_path: str) -> str:
+    """
+    Extrae texto de un archivo Word (.docx)
+
+    Args:
+        file_path: Ruta al archivo DOCX
+
+    Returns:
+        Texto extraído del documento
+    """
+    try:
+        doc = Document(file_path)
+        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    except Exception as e:
+        logger.error(f"Error procesando DOCX {file_path}: {e}")
+        raise
+
+
+def extract_excel(file_path: str) -> str:
+    """
+    Extrae texto de un archivo Excel (.xlsx)
+
+    Args:
+        file_path: Ruta al archivo Excel
+
+    Returns:
+        Texto extraído del Excel (formato CSV-like)
+    """
+    try:
+        df = pd.read_excel(file_path, sheet_name=None)  # Lee todas las hojas
+        text = ""
+        for sheet_name, sheet_df in df.items():
+            text += f"\n\n=== Hoja: {sheet_name} ===\n"
+            text += sheet_df.to_string(index=False)
+        return text
+    except Exception as e:
+        logger.error(f"Error procesando Excel {file_path}: {e}")
+        raise
+
+
+def _slugify(value: str) -> str:
+    """Normaliza un encabezado: minúsculas, sin tildes ni símbolos"""
+    value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """
+    Convierte a número un valor de celda ("S/. 8,999.00", "15 unidades", 4999)
+
+    Args:
+        value: Valor de la celda
+
+    Returns:
+        Número o None si no se puede interpretar
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d[\d,]*(?:\.\d+)?", str(value))
+    if not match:
+        return None
+    try:
+        return float(match.group(0).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _cell_text(value: Any) -> str:
+    """Representación de texto de una celda"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _row_metadata(headers: List[str], keys: List[str], row: Tuple[Any, ...]) -> Dict[str, Any]:
+    """Metadata escalar (compatible con Chroma) de una fila"""
+    metadata: Dict[str, Any] = {}
+    for key, value in zip(keys, row):
+        if value is None or _cell_text(value) == "":
+            continue
+        if key == "stock":
+            # "agotado" / "sin stock" cuentan como 0 unidades
+            stock = _to_stock(value)
+            if stock is not None:
+                metadata[key] = stock
+        elif key in NUMERIC_FIELDS:
+            number = parse_number(value)
+            if number is not None:
+                metadata[key] = number
+        elif key in CATEGORICAL_FIELDS:
+            metadata[key] = _cell_text(value).lower()
+        elif isinstance(value, (int, float, bool)):
+            metadata[key] = value
+        else:
+            metadata[key] = _cell_text(value)
+    return metadata
+
+
+def _header_keys(headers: List[str]) -> List[str]:
+    """
+    Asigna a cada encabezado su campo canónico o col_<encabezado>
+
+    Primero se resuelven coincidencias exactas ("Precio Venta") y luego por
+    primera palabra ("Precio (S/)"), sin repetir un mismo campo canónico.
+    """
+    slugs = [_slugify(header) for header in headers]
+    keys: List[Optional[str]] = [HEADER_ALIASES.get(slug.replace("_", " ")) for slug in slugs]
+    used = {key for key in keys if key}
+    for i, slug in enumerate(slugs):
+        if keys[i] is None:
+            candidate = HEADER_ALIASES.get(slug.split("_")[0]) if slug else None
+            if candidate and candidate not in used:
+                keys[i] = candidate
+                used.add(candidate)
+    return [key or f"col_{slug or i + 1}" for i, (key, slug) in enumerate(zip(keys, slugs))]
+
+
+def iter_excel_records(file_path: str, rows_per_chunk: int = 1) -> Iterator[Dict[str, Any]]:
+    """
+    Lee un Excel en streaming (openpyxl read-only) y genera un chunk por fila o grupo de filas
+
+    Cada fila se renderiza con sus encabezados ("Marca: ASUS | Precio: 4999"),
+    así el splitter nunca la corta ni pierde el contexto de las columnas.
+    Con rows_per_chunk=1 los valores de la fila van también como metadata
+    (campos canónicos price, stock, brand, category, model, sku, name y el
+    resto como col_<encabezado>) para poder filtrar por SKU o precio.
+
+    Args:
+        file_path: Ruta al archivo Excel
+        rows_per_chunk: Filas por chunk
+
+    Yields:
+        Diccionarios {"content", "metadata"}
+    """
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        logger.error(f"Error procesando Excel {file_path}: {e}")
+        raise
+
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            headers: List[str] = []
+            header_row = 0
+            for header_row, row in enumerate(rows, start=1):
+                if any(cell is not None and _cell_text(cell) for cell in row):
+                    headers = [_cell_text(cell) if cell is not None else "" for cell in row]
+                    break
+            if not headers:
+                continue
+
+            headers = [header or f"Columna {i + 1}" for i, header in enumerate(headers)]
+            keys = _header_keys(headers)
+
+            group: List[Tuple[int, Tuple[Any, ...]]] = []
+            for row_number, row in enumerate(rows, start=header_row + 1):
+                if not any(cell is not None and _cell_text(cell) for cell in row):
+                    continue
+                group.append((row_number, row))
+                if len(group) >= rows_per_chunk:
+                    yield _build_excel_record(sheet.title, headers, keys, group)
+                    group = []
+            if group:
+                yield _build_excel_record(sheet.title, headers, keys, group)
+    finally:
+        workbook.close()
+
+
+def _build_excel_record(sheet_name: str, headers: List[str], keys: List[str], group: List[Tuple[int, Tuple[Any, ...]]]) -> Dict[str, Any]:
+    """Construye el chunk de un grupo de filas"""
+    lines = []
+    for _row_number, row in group:
+        fields = [
+            f"{header}: {_cell_text(value)}"
+            for header, value in zip(headers, row)
+            if value is not None and _cell_text(value) != ""
+        ]
+        lines.append(" | ".join(fields))
+
+    metadata: Dict[str, Any] = {
+        "sheet": sheet_name,
+        "row_start": group[0][0],
+        "row_end": group[-1][0],
+    }
+    if len(group) == 1:
+        metadata.update(_row_metadata(headers, keys, group[0][1]))
+    return {"content": f"Hoja: {sheet_name}\n" + "\n".join(lines), "metadata": metadata}
+
+
+# Campos de catálogo en texto: "- **Precio**: S/. 8,999.00"
+_FIELD_PATTERN = re.compile(r"^\s*[-*]?\s*\*{0,2}([^:*\n]{2,40}?):?\*{0,2}\s*:\s*(.*)$")
+_SUBITEM_PATTERN = re.compile(r"^\s{2,}[-*]\s+(.+)$")
+_NUMBERING_PATTERN = re.compile(r"^\d+[.)]\s*")
+_OUT_OF_STOCK_PATTERN = re.compile(r"agotado|sin stock|no disponible", re.IGNORECASE)
+
+
+def _field_key(label: str) -> Optional[str]:
+    """Campo canónico de una etiqueta ("Precio" → price) o None"""
+    return HEADER_ALIASES.get(_slugify(label).replace("_", " "))
+
+
+def _to_stock(value: Any) -> Optional[int]:
+    if isinstance(value, str) and _OUT_OF_STOCK_PATTERN.search(value):
+        return 0
+    number = parse_number(value)
+    return int(number) if number is not None else None
+
+
+def _product_from_fields(name: str, fields: Dict[str, str], category: Optional[str], section: str) -> Optional[Dict[str, Any]]:
+    price = None
+    product: Dict[str, Any] = {"name": name, "category": category, "section": section, "specs": {}}
+    for label, value in fields.items():
+        key = _field_key(label)
+        if key == "price":
+            price = parse_number(value)
+        elif key == "stock":
+            product["stock"] = _to_stock(value)
+        elif key in ("brand", "model", "sku", "category") and value:
+            product[key] = value.strip()
+        else:
+            product["specs"][label] = value
+    if price is None or not name:
+        return None
+    product["price"] = price
+    product.setdefault("brand", name.split()[0])
+    return product
+
+
+def extract_products(text: str) -> List[Dict[str, Any]]:
+    """
+    Productos de un catálogo en texto: cada sección con encabezado y un
+    campo de precio es un producto, el resto de campos son especificaciones
+
+    Returns:
+        Lista de {"name", "brand", "model", "sku", "category", "price", "stock", "specs", "section"}
+    """
+    products = []
+    for section in TextChunker.markdown_sections(text):
+        if not section["title"]:
+            continue
+        fields: Dict[str, str] = {}
+        last_label = None
+        for line in section["body"].splitlines():
+            subitem = _SUBITEM_PATTERN.match(line)
+            if subitem and last_label:
+                current = fields[last_label]
+                fields[last_label] = f"{current}, {subitem.group(1).strip()}" if current else subitem.group(1).strip()
+                continue
+            match = _FIELD_PATTERN.match(line)
+            if match:
+                last_label = match.group(1).strip()
+                fields[last_label] = match.group(2).strip()
+        if not fields:
+            continue
+        name = _NUMBERING_PATTERN.sub("", section["title"]).strip()
+        category = section["path"][-1] if section["path"] else None
+        product = _product_from_fields(name, fields, category, " > ".join(section["path"] + [section["title"]]))
+        if product:
+            products.append(product)
+    return products
+
+
+def products_from_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Productos de una planilla estructurada (metadata de iter_excel_records)
+
+    Solo se toman las filas con precio y nombre, modelo o SKU.
+    """
+    products = []
+    for row in rows:
+        price = row.get("price")
+        name = row.get("name") or row.get("model") or row.get("sku")
+        if price is None or not name:
+            continue
+        products.append({
+            "name": str(name),
+            "brand": row.get("brand") or str(name).split()[0],
+            "model": row.get("model"),
+            "sku": row.get("sku"),
+            "category": row.get("category"),
+            "price": float(price),
+            "stock": int(row["stock"]) if row.get("stock") is not None else None,
+            "specs": {key[4:]: value for key, value in row.items() if key.startswith("col_")},
+            "section": f"{row.get('sheet', '')} fila {row.get('row_start', '')}".strip(),
+        })
+    return products
+
+
+def _product_chunk_metadata(product: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos filtrables de un producto, con el mismo formato que _row_metadata"""
+    metadata: Dict[str, Any] = {}
+    for key in NUMERIC_FIELDS:
+        if product.get(key) is not None:
+            metadata[key] = product[key]
+    for key in CATEGORICAL_FIELDS:
+        if product.get(key):
+            metadata[key] = str(product[key]).strip().lower()
+    return metadata
+
+
+def with_product_metadata(records: Iterable[Dict[str, Any]], products: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Copia precio, stock, marca, modelo, SKU y categoría de cada producto a
+    los chunks de su sección, para que los filtros estructurados funcionen
+    también sobre catálogos en markdown/DOCX/TXT (no solo sobre Excel)
+
+    El chunk se asocia por su sección (chunking markdown) o, si no la
+    tiene, cuando su texto nombra exactamente a un producto.
+
+    Args:
+        records: Chunks {"content", "metadata"} (antes de dividir en hijos)
+        products: Productos de extract_products sobre el mismo texto
+    """
+    if not products:
+        yield from records
+        return
+    by_section = {product["section"]: product for product in products}
+    by_name = [(" ".join(product["name"].lower().split()), product) for product in products]
+    for record in records:
+        metadata = record["metadata"]
+        section = metadata.get("section")
+        key = f"{metadata['section_path']} > {section}" if metadata.get("section_path") else section
+        product = by_section.get(key)
+        if product is None:
+            content = " ".join(record["content"].lower().split())
+            named = [candidate for name, candidate in by_name if name in content]
+            product = named[0] if len(named) == 1 else None
+        if product is not None:
+            record = {**record, "metadata": {**_product_chunk_metadata(product), **metadata}}
+        yield record
+
+
+def extract_txt(file_path: str) -> str:
+    """
+    Lee un archivo de texto plano
+
+    Args:
+        file_path: Ruta al archivo TXT
+
+    Returns:
+        Contenido del archivo
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except Exception as e:
+        logger.error(f"Error procesando TXT {file_path}: {e}")
+        raise
+
+
+EXTRACTORS = {
+    'pdf': extract_pdf,
+    'docx': extract_docx,
+    'xlsx': extract_excel,
+    'txt': extract_txt,
+    'md': extract_txt,
+}
+
+
+def extract_text(file_path: str, file_type: str) -> str:
+    """
+    Extrae el texto de un documento según su tipo
+
+    Args:
+        file_path: Ruta al archivo
+        file_type: Tipo de archivo (pdf, docx, xlsx, txt, md)
+
+    Returns:
+        Texto extraído del documento
+    """
+    extractor = EXTRACTORS.get(file_type.lower())
+    if not extractor:
+        raise ValueError(f"Tipo de archivo no soportado: {file_type}")
+    return extractor(file_path)
+
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Calcula el hash SHA-256 del contenido de un archivo (lectura por bloques)
+
+    Args:
+        file_path: Ruta al archivo
+        block_size: Tamaño de bloque de lectura en bytes
+
+    Returns:
+        Hash hexadecimal del archivo
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
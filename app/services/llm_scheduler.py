@@ -0,0 +1,276 @@
+"""
+Control de admisión para llamadas al LLM
+Limita las generaciones concurrentes contra Ollama y reparte los turnos
+entre empresas con round-robin ponderado; si la espera en cola supera el
+plazo se rechaza rápido (HTTP 429) en lugar de acumular timeouts.
+Las tareas en segundo plano (resúmenes de memoria) esperan en una cola
+aparte y solo reciben turno cuando no hay solicitudes interactivas en cola.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+
+from app.services.metrics import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_REJECTED
+from app.services.tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBusyError(Exception):
+    """El LLM está saturado: la solicitud no obtuvo turno a tiempo"""
+
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_weights(raw: str) -> Dict[int, int]:
+    """
+    Parsea pesos por empresa con formato "company_id:peso,company_id:peso"
+
+    Args:
+        raw: Cadena de configuración (vacía = todos con peso 1)
+
+    Returns:
+        Dict company_id -> peso
+    """
+    weights = {}
+    for item in (raw or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        company_id, _, weight = item.partition(":")
+        try:
+            weights[int(company_id)] = max(1, int(weight or 1))
+        except ValueError:
+            logger.warning(f"Peso de empresa inválido ignorado: {item!r}")
+    return weights
+
+
+class FairScheduler:
+    """
+    Semáforo con colas por empresa y round-robin ponderado
+
+    Todo el estado se modifica desde el event loop, así que no necesita locks.
+    Cada empresa con solicitudes en cola recibe hasta 'peso' turnos seguidos
+    antes de ceder el paso a la siguiente; dentro de una empresa se atiende
+    en orden de llegada.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        queue_timeout: float = 30.0,
+        max_queue: int = 100,
+        weights: Optional[Dict[int, int]] = None
+    ):
+        """
+        Args:
+            max_concurrency: Generaciones simultáneas contra el LLM
+            queue_timeout: Segundos máximos de espera en cola antes de rechazar
+            max_queue: Solicitudes en cola a partir de las cuales se rechaza de inmediato
+            weights: Peso por empresa (por defecto 1)
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.weights = weights or {}
+        self.in_flight = 0
+        self._queues: Dict[Any, Deque[asyncio.Future]] = {}
+        self._ring: Deque[Any] = deque()
+        self._credits = 0
+        self._queued = 0
+        self._background: Deque[asyncio.Future] = deque()
+
+    def _weight(self, company_id) -> int:
+        return self.weights.get(company_id, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado actual del scheduler"""
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queued": self._queued,
+            "queued_by_company": {str(key): len(q) for key, q in self._queues.items()},
+            "background_queued": len(self._background),
+        }
+
+    async def acquire(self, company_id):
+        """
+        Espera un turno de generación para la empresa
+
+        Raises:
+            LLMBusyError: Cola llena o plazo de espera superado
+        """
+        start = time.perf_counter()
+        if self.in_flight < self.max_concurrency and not self._queued:
+            self.in_flight += 1
+            LLM_IN_FLIGHT.inc()
+            LLM_QUEUE_WAIT.labels(outcome="admitted").observe(0)
+            return
+
+        if self._queued >= self.max_queue:
+            LLM_REJECTED.labels(reason="queue_full").inc()
+            raise LLMBusyError("Demasiadas solicitudes en cola, intenta de nuevo en unos segundos")
+
+        waiter = asyncio.get_running_loop().create_future()
+        if company_id not in self._queues:
+            self._queues[company_id] = deque()
+            self._ring.append(company_id)
+        self._queues[company_id].append(waiter)
+        self._queued += 1
+        LLM_QUEUE_DEPTH.inc()
+
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # release() ya le cedió el turno: devolverlo antes de abandonar
+                self.release()
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            if not waiter.done():
+                # Sigue en cola: retirarlo (release() solo atiende futures pendientes)
+                waiter.cancel()
+                self._remove(company_id, waiter)
+        if waiter.cancelled():
+            LLM_QUEUE_WAIT.labels(outcome="timeout").observe(waited)
+            LLM_REJECTED.labels(reason="timeout").inc()
+            raise LLMBusyError("El asistente está ocupado, intenta de nuevo en unos segundos")
+
+        # release() transfirió su turno: in_flight ya cuenta esta solicitud
+        LLM_QUEUE_WAIT.labels(outcome="admitted").observe(waited)
+        record_span("llm.queue_wait", waited * 1000)
+
+    async def acquire_background(self):
+        """
+        Espera un turno de baja prioridad: no ocupa lugar en las colas por
+        empresa y solo se atiende cuando no hay solicitudes interactivas en cola
+
+        Raises:
+            LLMBusyError: Plazo de espera superado
+        """
+        if self.in_flight < self.max_concurrency and not self._queued and not self._background:
+            self.in_flight += 1
+            LLM_IN_FLIGHT.inc()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._background.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._background.remove(waiter)
+        if waiter.cancelled():
+            LLM_REJECTED.labels(reason="background_timeout").inc()
+            raise LLMBusyError("Sin turno libre para la tarea en segundo plano")
+
+    @contextmanager
+    def background_turn(self, loop: asyncio.AbstractEventLoop):
+        """
+        Turno de baja prioridad pedido desde un hilo (p.ej. asyncio.to_thread)
+
+        Args:
+            loop: Event loop dueño del scheduler
+        """
+        asyncio.run_coroutine_threadsafe(self.acquire_background(), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self.release)
+
+    def _remove(self, company_id, waiter: asyncio.Future):
+        queue = self._queues.get(company_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        LLM_QUEUE_DEPTH.dec()
+        if not queue:
+            self._drop_company(company_id)
+
+    def _drop_company(self, company_id):
+        del self._queues[company_id]
+        if self._ring and self._ring[0] == company_id:
+            self._credits = 0
+        self._ring.remove(company_id)
+
+    def release(self):
+        """Libera un turno y se lo cede al siguiente en la ronda"""
+        while self._ring:
+            company_id = self._ring[0]
+            if self._credits <= 0:
+                self._credits = self._weight(company_id)
+            queue = self._queues[company_id]
+            waiter = queue.popleft()
+            self._queued -= 1
+            LLM_QUEUE_DEPTH.dec()
+            self._credits -= 1
+            if not queue:
+                self._drop_company(company_id)
+            elif self._credits <= 0:
+                self._ring.rotate(-1)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        # Sin solicitudes interactivas en cola: turno para segundo plano
+        while self._background:
+            waiter = self._background.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+        LLM_IN_FLIGHT.dec()
+
+    async def run(self, company_id, func: Callable, *args, **kwargs):
+        """
+        Ejecuta una función bloqueante (p.ej. generate_with_rag) con turno asignado
+
+        La función corre en un hilo (asyncio.to_thread) y conserva el contexto
+        de la traza activa. El turno se libera cuando termina el hilo, no
+        cuando deja de esperarlo quien llamó: si la solicitud se cancela
+        (cliente desconectado, timeout), la generación sigue ocupando su
+        lugar hasta terminar y no se supera max_concurrency.
+
+        Raises:
+            LLMBusyError: Si no obtuvo turno a tiempo
+        """
+        await self.acquire(company_id)
+        try:
+            work = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+        except BaseException:
+            self.release()
+            raise
+        work.add_done_callback(self._release_when_done)
+        return await asyncio.shield(work)
+
+    def _release_when_done(self, work: asyncio.Future):
+        if not work.cancelled():
+            # Si quien esperaba se canceló, nadie más lee el error del hilo
+            work.exception()
+        self.release()
+
+
+def _build_scheduler() -> FairScheduler:
+    from app.core.config import settings
+    return FairScheduler(
+        max_concurrency=settings.ollama.MAX_CONCURRENCY,
+        queue_timeout=settings.ollama.QUEUE_TIMEOUT,
+        max_queue=settings.ollama.MAX_QUEUE,
+        weights=parse_weights(settings.ollama.COMPANY_WEIGHTS)
+    )
+
+
+# Instancia global del scheduler
+llm_scheduler = _build_scheduler()
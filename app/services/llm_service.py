@@ -3,36 +3,189 @@ Servicio LLM usando Ollama
 Maneja la generación de respuestas con contexto RAG
 """
 
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 import requests
 import json
 
+from app.services.tracing import span, record_span
+from app.services.metrics import observe_ollama, OLLAMA_CONTEXT_REUSE, OLLAMA_FAILOVERS
+from app.services.ollama_pool import OllamaBackendPool, parse_backend_urls
+import time
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_RAG_SYSTEM_PROMPT = """Eres un asistente inteligente que responde preguntas basándote en documentos proporcionados.
+
+INSTRUCCIONES:
+1. Usa SOLO la información de los documentos proporcionados para responder
+2. Si la información no está en los documentos, di "No tengo información sobre eso en los documentos proporcionados"
+3. Sé preciso y conciso
+4. Si citas información, menciona de qué documento proviene
+5. Mantén un tono profesional y amigable
+6. Responde en español"""
+
+
+class ConversationContextCache:
+    """
+    Contexto KV de Ollama por conversación (LRU con TTL)
+
+    Cada entrada guarda el arreglo 'context' devuelto por /api/generate junto
+    con la huella del prefijo estable con el que se generó: si el system
+    prompt o el modelo cambian, el contexto deja de ser válido.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: int = 1800):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[str, List[int], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: int, prefix_hash: str) -> Optional[List[int]]:
+        """Contexto vigente de la conversación para ese prefijo (None si no hay)"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return None
+            cached_hash, context, stored_at = entry
+            if cached_hash != prefix_hash or time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[conversation_id]
+                return None
+            self._entries.move_to_end(conversation_id)
+            return context
+
+    def put(self, conversation_id: int, prefix_hash: str, context: List[int]):
+        """Guarda el contexto devuelto por Ollama para el siguiente turno"""
+        with self._lock:
+            self._entries[conversation_id] = (prefix_hash, context, time.monotonic())
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, conversation_id: int):
+        """Descarta el contexto de una conversación"""
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
 
 class OllamaService:
     """Servicio para interactuar con Ollama LLM"""
     
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "mistral"):
+    def __init__(
+        self,
+        base_url: str = "http://localhost:11434",
+        model: str = "mistral",
+        keep_alive: Optional[str] = None,
+        num_ctx: Optional[int] = None,
+        context_reuse: bool = False,
+        context_reuse_max_tokens: int = 2560,
+        context_cache: Optional[ConversationContextCache] = None,
+        backend_urls: Optional[List[str]] = None,
+        health_interval: float = 15.0
+    ):
         """
         Inicializa el servicio Ollama
         
         Args:
             base_url: URL base de Ollama API
             model: Nombre del modelo a usar
+            keep_alive: Tiempo que Ollama mantiene el modelo cargado (p.ej. "30m")
+            num_ctx: Tamaño de la ventana de contexto
+            context_reuse: Reutilizar el contexto KV entre turnos de una conversación
+            context_reuse_max_tokens: Tokens máximos de contexto acumulado antes de reiniciar
+            context_cache: Cache de contexto por conversación
+            backend_urls: Varios servidores Ollama (pool con balanceo y failover)
+            health_interval: Segundos entre verificaciones de salud del pool
         """
         self.base_url = base_url
         self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.context_reuse = context_reuse
+        self.context_reuse_max_tokens = context_reuse_max_tokens
+        self.context_cache = context_cache or ConversationContextCache()
+        self.pool = None
+        if backend_urls and len(backend_urls) > 1:
+            self.pool = OllamaBackendPool(
+                backend_urls,
+                health_check=self.check_health,
+                list_models=self.fetch_models,
+                health_interval=health_interval
+            )
+            base_url = ", ".join(backend_urls)
         logger.info(f"Ollama Service inicializado - Model: {model}, URL: {base_url}")
     
+    def start(self):
+        """Inicia las verificaciones de salud del pool (si hay varios backends)"""
+        if self.pool:
+            self.pool.start()
+    
+    def stop(self):
+        """Detiene las verificaciones de salud del pool"""
+        if self.pool:
+            self.pool.stop()
+    
+    def _post_generate(self, payload: Dict[str, Any], affinity_key=None) -> Dict[str, Any]:
+        """
+        Envía la solicitud a /api/generate
+        
+        Con pool, elige el backend menos cargado que tenga el modelo y, si la
+        conexión falla o el backend no tiene el modelo, reintenta en otro.
+        
+        Args:
+            payload: Cuerpo de la solicitud
+            affinity_key: Clave para mantener una conversación en el mismo backend
+            
+        Returns:
+            Respuesta JSON de Ollama
+        """
+        if not self.pool:
+            response = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=60)
+            response.raise_for_status()
+            return response.json()
+        
+        tried = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self.pool.select(self.model, exclude=tried, affinity_key=affinity_key)
+            if backend is None:
+                raise last_error or requests.exceptions.ConnectionError(
+                    f"Ningún backend Ollama disponible con el modelo {self.model}"
+                )
+            tried.add(backend.url)
+            try:
+                with self.pool.lease(backend, affinity_key):
+                    response = requests.post(f"{backend.url}/api/generate", json=payload, timeout=60)
+                    if response.status_code == 404:
+                        # Ollama responde 404 cuando el modelo no está descargado en ese nodo
+                        self.pool.record_missing_model(backend, self.model)
+                        OLLAMA_FAILOVERS.labels(backend=backend.url, reason="model_missing").inc()
+                        last_error = requests.exceptions.HTTPError(
+                            f"Modelo {self.model} no disponible en {backend.url}", response=response
+                        )
+                        continue
+                    response.raise_for_status()
+                    result = response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.pool.record_failure(backend, e)
+                OLLAMA_FAILOVERS.labels(backend=backend.url, reason="connection").inc()
+                last_error = e
+                continue
+            self.pool.record_success(backend, result)
+            return result
+    
     def generate(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        context: Optional[List[str]] = None
+        context: Optional[List[str]] = None,
+        kv_context: Optional[List[int]] = None,
+        affinity_key=None
     ) -> Dict[str, Any]:
         """
         Genera una respuesta usando Ollama
@@ -43,6 +196,8 @@ class OllamaService:
             temperature: Temperatura para generación (0.0-1.0)
             max_tokens: Máximo de tokens a generar
             context: Contexto adicional (chunks recuperados)
+            kv_context: Arreglo 'context' de una respuesta anterior de Ollama (continúa esa secuencia)
+            affinity_key: Clave de afinidad de backend (p.ej. conversation_id)
             
         Returns:
             Dict con la respuesta y metadata
@@ -61,16 +216,29 @@ class OllamaService:
                     "num_predict": max_tokens
                 }
             }
+            if self.num_ctx:
+                payload["options"]["num_ctx"] = self.num_ctx
+            if self.keep_alive:
+                payload["keep_alive"] = self.keep_alive
+            if kv_context:
+                payload["context"] = kv_context
             
             # Llamar a Ollama API
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=60
-            )
-            response.raise_for_status()
+            start = time.perf_counter()
+            try:
+                with span("llm.total"):
+                    result = self._post_generate(payload, affinity_key)
+            except Exception:
+                observe_ollama(self.model, time.perf_counter() - start, outcome="error")
+                raise
+            observe_ollama(self.model, time.perf_counter() - start, result)
             
-            result = response.json()
+            # Ollama reporta duraciones en nanosegundos: el tiempo hasta el primer
+            # token es la carga del modelo más el prefill del prompt
+            load_duration = result.get("load_duration", 0)
+            prompt_eval_duration = result.get("prompt_eval_duration", 0)
+            record_span("llm.time_to_first_token", (load_duration + prompt_eval_duration) / 1e6)
+            record_span("llm.generation", result.get("eval_duration", 0) / 1e6)
             
             return {
                 "response": result.get("response", ""),
@@ -78,7 +246,11 @@ class OllamaService:
                 "done": result.get("done", False),
                 "context": result.get("context", []),
                 "total_duration": result.get("total_duration", 0),
-                "eval_count": result.get("eval_count", 0)
+                "load_duration": load_duration,
+                "prompt_eval_count": result.get("prompt_eval_count", 0),
+                "prompt_eval_duration": prompt_eval_duration,
+                "eval_count": result.get("eval_count", 0),
+                "eval_duration": result.get("eval_duration", 0)
             }
             
         except requests.exceptions.RequestException as e:
@@ -94,77 +266,68 @@ class OllamaService:
         retrieved_chunks: List[Dict[str, Any]],
         conversation_history: Optional[List[Dict[str, str]]] = None,
         temperature: float = 0.7,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        memory_summary: Optional[str] = None,
+        conversation_id: Optional[int] = None,
+        company_profile: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Genera respuesta usando RAG (Retrieval-Augmented Generation)
         
+        Con conversation_id y reutilización de contexto habilitada, el turno
+        continúa el contexto KV del turno anterior: solo se envían los
+        documentos nuevos y la pregunta, y Ollama no vuelve a procesar el
+        prefijo ni el historial.
+        
         Args:
             query: Pregunta del usuario
             retrieved_chunks: Chunks recuperados del vector store
             conversation_history: Historial de conversación
             temperature: Temperatura para generación
             system_prompt: Prompt del sistema personalizado (opcional)
+            memory_summary: Resumen de los turnos anteriores (opcional)
+            conversation_id: Conversación (para reutilizar su contexto KV)
+            company_profile: Datos fijos de la empresa que van en el prefijo estable
             
         Returns:
             Dict con respuesta y metadata
         """
-        # Construir contexto desde chunks
-        context_parts = []
-        for i, chunk in enumerate(retrieved_chunks, 1):
-            content = chunk.get("content", "")
-            filename = chunk.get("metadata", {}).get("filename", "documento")
-            context_parts.append(f"[Documento {i}: {filename}]\n{content}")
-        
-        # System prompt para RAG (usar personalizado si se proporciona)
-        if not system_prompt:
-            system_prompt = """Eres un asistente inteligente que responde preguntas basándote en documentos proporcionados.
-
-INSTRUCCIONES:
-1. Usa SOLO la información de los documentos proporcionados para responder
-2. Si la información no está en los documentos, di "No tengo información sobre eso en los documentos proporcionados"
-3. Sé preciso y conciso
-4. Si citas información, menciona de qué documento proviene
-5. Mantén un tono profesional y amigable
-6. Responde en español
-
-DOCUMENTOS DISPONIBLES:
-"""
-        else:
-            # Si hay prompt personalizado, agregar contexto de documentos
-            system_prompt = f"""{system_prompt}
-
-DOCUMENTOS DISPONIBLES:
-"""
-        
-        # Agregar contexto de documentos
-        context = "\n\n".join(context_parts) if context_parts else "No hay documentos disponibles."
-        
-        # Construir prompt con historial
-        full_prompt = f"{system_prompt}\n{context}\n\n"
-        
-        if conversation_history:
-            full_prompt += "HISTORIAL DE CONVERSACIÓN:\n"
-            for msg in conversation_history[-5:]:  # Últimos 5 mensajes
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                full_prompt += f"{role.upper()}: {content}\n"
-            full_prompt += "\n"
-        
-        full_prompt += f"PREGUNTA DEL USUARIO:\n{query}\n\nRESPUESTA:"
+        with span("llm.prompt_build"):
+            prefix = self._build_stable_prefix(system_prompt, company_profile)
+            prefix_hash = self._prefix_hash(prefix)
+            kv_context = None
+            if self.context_reuse and conversation_id is not None:
+                kv_context = self.context_cache.get(conversation_id, prefix_hash)
+                OLLAMA_CONTEXT_REUSE.labels(outcome="hit" if kv_context else "miss").inc()
+            
+            if kv_context:
+                # El historial y el prefijo ya están en el contexto
+                full_prompt = self._build_turn_prompt(query, retrieved_chunks)
+            else:
+                full_prompt = prefix + self._build_turn_prompt(
+                    query, retrieved_chunks, conversation_history, memory_summary
+                )
         
         # Generar respuesta
         result = self.generate(
             prompt=full_prompt,
             temperature=temperature,
-            max_tokens=2000
+            max_tokens=2000,
+            kv_context=kv_context,
+            affinity_key=conversation_id
         )
+        result["context_reused"] = bool(kv_context)
+        
+        if conversation_id is not None:
+            self.store_context(conversation_id, result, system_prompt, company_profile)
         
         # Agregar información de fuentes
         result["sources"] = [
             {
+                "chunk_id": chunk.get("id"),
                 "filename": chunk.get("metadata", {}).get("filename", ""),
-                "chunk_index": chunk.get("metadata", {}).get("chunk_index", 0)
+                "chunk_index": chunk.get("metadata", {}).get("chunk_index", 0),
+                "page": chunk.get("metadata", {}).get("page")
             }
             for chunk in retrieved_chunks
         ]
@@ -172,6 +335,104 @@ DOCUMENTOS DISPONIBLES:
         
         return result
     
+    def _prefix_hash(self, prefix: str) -> str:
+        return hashlib.sha1(f"{self.model}\n{prefix}".encode("utf-8")).hexdigest()
+    
+    def store_context(
+        self,
+        conversation_id: int,
+        result: Dict[str, Any],
+        system_prompt: Optional[str] = None,
+        company_profile: Optional[str] = None
+    ):
+        """
+        Guarda el contexto KV de una respuesta para el siguiente turno de la conversación
+        
+        También sirve para conversaciones que recibieron una respuesta
+        compartida: el prompt fue el mismo, así que el contexto es válido.
+        
+        Args:
+            conversation_id: Conversación
+            result: Respuesta de generate_with_rag
+            system_prompt: Prompt del sistema usado
+            company_profile: Datos de la empresa usados en el prefijo
+        """
+        if not self.context_reuse:
+            return
+        new_context = result.get("context") or []
+        if new_context and len(new_context) <= self.context_reuse_max_tokens:
+            prefix_hash = self._prefix_hash(self._build_stable_prefix(system_prompt, company_profile))
+            self.context_cache.put(conversation_id, prefix_hash, new_context)
+        else:
+            # Contexto demasiado largo: el próximo turno reinicia con resumen + historial
+            self.context_cache.invalidate(conversation_id)
+    
+    def _build_stable_prefix(self, system_prompt: Optional[str] = None, company_profile: Optional[str] = None) -> str:
+        """
+        Prefijo estable del prompt RAG: instrucciones y datos de la empresa
+        
+        No incluye nada que cambie entre turnos (fechas, documentos, historial)
+        para que sea idéntico byte a byte y Ollama reutilice su caché de prefijo.
+        
+        Args:
+            system_prompt: Prompt del sistema personalizado (opcional)
+            company_profile: Datos fijos de la empresa (opcional)
+            
+        Returns:
+            Prefijo del prompt
+        """
+        prefix = (system_prompt or DEFAULT_RAG_SYSTEM_PROMPT).strip()
+        if company_profile:
+            prefix += f"\n\nEMPRESA:\n{company_profile.strip()}"
+        return prefix + "\n\n"
+    
+    def _build_turn_prompt(
+        self,
+        query: str,
+        retrieved_chunks: List[Dict[str, Any]],
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        memory_summary: Optional[str] = None
+    ) -> str:
+        """
+        Parte variable del prompt RAG: memoria, historial, documentos y pregunta
+        
+        Args:
+            query: Pregunta del usuario
+            retrieved_chunks: Chunks recuperados del vector store
+            conversation_history: Historial de conversación
+            memory_summary: Resumen de los turnos anteriores (opcional)
+            
+        Returns:
+            Texto del turno
+        """
+        parts = []
+        
+        if memory_summary:
+            parts.append(f"RESUMEN DE LA CONVERSACIÓN:\n{memory_summary}\n\n")
+        
+        if conversation_history:
+            parts.append("HISTORIAL DE CONVERSACIÓN:\n")
+            for msg in conversation_history[-5:]:  # Últimos 5 mensajes
+                role = msg.get("role", "user")
+                content = msg.get("content", "")
+                parts.append(f"{role.upper()}: {content}\n")
+            parts.append("\n")
+        
+        # Construir contexto desde chunks
+        context_parts = []
+        for i, chunk in enumerate(retrieved_chunks, 1):
+            content = chunk.get("content", "")
+            filename = chunk.get("metadata", {}).get("filename", "documento")
+            page = chunk.get("metadata", {}).get("page")
+            source = f"{filename}, pág. {page}" if page else filename
+            context_parts.append(f"[Documento {i}: {source}]\n{content}")
+        context = "\n\n".join(context_parts) if context_parts else "No hay documentos disponibles."
+        parts.append(f"DOCUMENTOS DISPONIBLES:\n{context}\n\n")
+        
+        parts.append(f"PREGUNTA DEL USUARIO:\n{query}\n\nRESPUESTA:")
+        
+        return "".join(parts)
+    
     def _build_prompt(
         self,
         prompt: str,
@@ -204,31 +465,44 @@ DOCUMENTOS DISPONIBLES:
         
         return "\n".join(parts)
     
-    def check_health(self) -> bool:
+    def check_health(self, base_url: Optional[str] = None) -> bool:
         """
         Verifica que Ollama esté funcionando
         
+        Args:
+            base_url: Servidor a verificar (por defecto el principal)
+            
         Returns:
             True si Ollama está disponible
         """
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = requests.get(f"{base_url or self.base_url}/api/tags", timeout=5)
             return response.status_code == 200
         except:
             return False
     
-    def list_models(self) -> List[str]:
+    def fetch_models(self, base_url: Optional[str] = None) -> List[str]:
+        """
+        Como list_models, pero propaga los errores (el pool de backends no
+        debe confundir un timeout con "el servidor no tiene modelos")
+        """
+        response = requests.get(f"{base_url or self.base_url}/api/tags", timeout=5)
+        response.raise_for_status()
+        data = response.json()
+        return [model["name"] for model in data.get("models", [])]
+    
+    def list_models(self, base_url: Optional[str] = None) -> List[str]:
         """
         Lista los modelos disponibles en Ollama
         
+        Args:
+            base_url: Servidor a consultar (por defecto el principal)
+            
         Returns:
             Lista de nombres de modelos
         """
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            return [model["name"] for model in data.get("models", [])]
+            return self.fetch_models(base_url)
         except Exception as e:
             logger.error(f"Error listando modelos: {e}")
             return []
@@ -238,5 +512,15 @@ DOCUMENTOS DISPONIBLES:
 from app.core.config import settings
 ollama_service = OllamaService(
     base_url=settings.ollama.base_url,
-    model=settings.ollama.MODEL
+    model=settings.ollama.MODEL,
+    keep_alive=settings.ollama.KEEP_ALIVE,
+    num_ctx=settings.ollama.NUM_CTX,
+    context_reuse=settings.ollama.CONTEXT_REUSE,
+    context_reuse_max_tokens=settings.ollama.CONTEXT_REUSE_MAX_TOKENS,
+    context_cache=ConversationContextCache(
+        max_entries=settings.ollama.CONTEXT_CACHE_SIZE,
+        ttl_seconds=settings.ollama.CONTEXT_CACHE_TTL
+    ),
+    backend_urls=parse_backend_urls(settings.ollama.URLS, settings.ollama.base_url),
+    health_interval=settings.ollama.HEALTH_INTERVAL
 )
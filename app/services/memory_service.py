@@ -0,0 +1,278 @@
+"""
+Memoria conversacional con resumen incremental
+Compacta los turnos antiguos en un resumen (LONG_TERM) y en entidades
+extraídas (ENTITY) guardados en conversation_memory, para que el prompt
+lleve un resumen corto más los últimos mensajes en lugar de todo el historial
+"""
+
+import logging
+import re
+import threading
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.current import Message
+from app.models.rag_models import ConversationMemory, MemoryType
+from app.services.llm_scheduler import LLMBusyError, llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Marcas y tipos de producto reconocidos al extraer entidades
+KNOWN_BRANDS = (
+    "asus", "msi", "lenovo", "hp", "dell", "acer", "apple", "samsung", "xiaomi",
+    "huawei", "lg", "sony", "logitech", "razer", "gigabyte", "motorola", "honor", "realme",
+)
+PRODUCT_TYPES = (
+    "laptop", "notebook", "pc", "computadora", "monitor", "celular", "smartphone", "tablet",
+    "audífonos", "audifonos", "teclado", "mouse", "impresora", "smartwatch", "consola", "tv", "televisor",
+)
+_BUDGET_PATTERN = re.compile(
+    r"(?:s/\.?\s*|presupuesto(?:\s+de)?\s*|hasta\s+|bajo\s+|menos\s+de\s+|m[aá]ximo\s+)(\d[\d,]*(?:\.\d+)?)(?:\s*soles)?"
+    r"|(\d[\d,]*(?:\.\d+)?)\s*soles",
+    re.IGNORECASE
+)
+
+SUMMARY_PROMPT = """Resume la conversación entre un cliente y un asistente de ventas.
+Conserva: productos consultados, presupuesto, preferencias, datos del cliente y compromisos pendientes.
+Escribe en español, en un solo párrafo de máximo {max_words} palabras.
+
+RESUMEN ANTERIOR:
+{previous}
+
+NUEVOS MENSAJES:
+{messages}
+
+RESUMEN ACTUALIZADO:"""
+
+
+def extract_entities(texts: List[str], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Extrae entidades de interés comercial de los mensajes del cliente
+
+    Args:
+        texts: Mensajes del cliente (orden cronológico)
+        previous: Entidades ya conocidas (se combinan)
+
+    Returns:
+        {"brands": [...], "products": [...], "budget": float | None}
+    """
+    entities = {
+        "brands": list((previous or {}).get("brands", [])),
+        "products": list((previous or {}).get("products", [])),
+        "budget": (previous or {}).get("budget"),
+    }
+    for text in texts:
+        lowered = text.lower()
+        words = set(re.findall(r"[a-záéíóúñ]+", lowered))
+        for brand in KNOWN_BRANDS:
+            if brand in words and brand not in entities["brands"]:
+                entities["brands"].append(brand)
+        for product in PRODUCT_TYPES:
+            if product in words and product not in entities["products"]:
+                entities["products"].append(product)
+        for match in _BUDGET_PATTERN.finditer(text):
+            amount = (match.group(1) or match.group(2)).replace(",", "")
+            try:
+                entities["budget"] = float(amount)  # el último monto mencionado manda
+            except ValueError:
+                pass
+    return entities
+
+
+def format_entities(entities: Dict[str, Any]) -> str:
+    """Representación corta de las entidades para el prompt"""
+    parts = []
+    if entities.get("products"):
+        parts.append(f"Productos de interés: {', '.join(entities['products'])}")
+    if entities.get("brands"):
+        parts.append(f"Marcas: {', '.join(entities['brands'])}")
+    if entities.get("budget"):
+        parts.append(f"Presupuesto: S/ {entities['budget']:,.0f}")
+    return ". ".join(parts)
+
+
+class ConversationMemoryService:
+    """Resumen incremental y entidades por conversación"""
+
+    def __init__(self, llm, recent_messages: int = 4, compact_batch: int = 6, summary_max_tokens: int = 200, scheduler=None):
+        """
+        Args:
+            llm: Servicio LLM con método generate (OllamaService)
+            scheduler: FairScheduler que da el turno (baja prioridad) para generar el resumen
+            recent_messages: Mensajes recientes que se envían sin resumir
+            compact_batch: Mensajes antiguos acumulados que disparan una compactación
+            summary_max_tokens: Tokens máximos del resumen
+        """
+        self.llm = llm
+        self.recent_messages = recent_messages
+        self.compact_batch = compact_batch
+        self.summary_max_tokens = summary_max_tokens
+        self.scheduler = scheduler
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def _memory_rows(self, session: Session, conversation_id: int) -> Dict[MemoryType, ConversationMemory]:
+        rows = session.execute(
+            select(ConversationMemory).where(
+                ConversationMemory.conversation_id == conversation_id,
+                ConversationMemory.memory_type.in_([MemoryType.LONG_TERM, MemoryType.ENTITY])
+            )
+        ).scalars().all()
+        return {row.memory_type: row for row in rows}
+
+    def load_context(self, session: Session, conversation_id: int, exclude_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Carga lo que va al prompt: resumen, entidades y mensajes recientes sin resumir
+
+        Args:
+            session: Sesión de BD
+            conversation_id: ID de la conversación
+            exclude_message_id: Mensaje a excluir (p.ej. la pregunta actual)
+
+        Returns:
+            {"summary": str | None, "history": [{"role", "content"}]}
+        """
+        rows = self._memory_rows(session, conversation_id)
+        summary_row = rows.get(MemoryType.LONG_TERM)
+        entity_row = rows.get(MemoryType.ENTITY)
+        summarized_until = (summary_row.memory_metadata or {}).get("summarized_until", 0) if summary_row else 0
+
+        query = select(Message).where(
+            Message.conversation_id == conversation_id,
+            Message.id > summarized_until
+        )
+        if exclude_message_id:
+            query = query.where(Message.id != exclude_message_id)
+        recent = session.execute(
+            query.order_by(Message.id.desc()).limit(self.recent_messages)
+        ).scalars().all()
+
+        summary_parts = []
+        if summary_row and summary_row.content:
+            summary_parts.append(summary_row.content)
+        if entity_row and entity_row.content:
+            summary_parts.append(entity_row.content)
+
+        return {
+            "summary": "\n".join(summary_parts) or None,
+            "history": [{"role": msg.role, "content": msg.content} for msg in reversed(recent)],
+        }
+
+    def compact(self, conversation_id: int, loop=None):
+        """
+        Compacta los mensajes antiguos de una conversación (pensado para un hilo
+        en segundo plano)
+
+        Solo actúa cuando hay al menos compact_batch mensajes sin resumir además
+        de los recent_messages más nuevos, así el LLM se invoca cada pocos turnos.
+        El turno del scheduler se pide solo para la llamada al LLM.
+
+        Args:
+            conversation_id: ID de la conversación
+            loop: Event loop del scheduler (None = generar sin pedir turno)
+        """
+        with self._lock:
+            if conversation_id in self._running:
+                return
+            self._running.add(conversation_id)
+        try:
+            from app.database.connection import session_scope
+            with session_scope() as session:
+                self._compact(session, conversation_id, loop)
+        except LLMBusyError:
+            logger.info(f"Compactación de memoria omitida por saturación del LLM: conversación {conversation_id}")
+        except Exception as e:
+            logger.error(f"Error compactando memoria de conversación {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(conversation_id)
+
+    def _compact(self, session: Session, conversation_id: int, loop=None):
+        rows = self._memory_rows(session, conversation_id)
+        summary_row = rows.get(MemoryType.LONG_TERM)
+        entity_row = rows.get(MemoryType.ENTITY)
+        summarized_until = (summary_row.memory_metadata or {}).get("summarized_until", 0) if summary_row else 0
+
+        # Chequeo barato: la mayoría de los turnos no acumulan mensajes suficientes
+        pending_count = session.execute(
+            select(func.count(Message.id)).where(
+                Message.conversation_id == conversation_id,
+                Message.id > summarized_until
+            )
+        ).scalar_one()
+        if pending_count - self.recent_messages < self.compact_batch:
+            return
+
+        pending = session.execute(
+            select(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.id > summarized_until
+            ).order_by(Message.id.asc())
+        ).scalars().all()
+        to_fold = pending[:-self.recent_messages] if self.recent_messages else pending
+        if len(to_fold) < self.compact_batch:
+            return
+
+        transcript = "\n".join(f"{msg.role.upper()}: {msg.content}" for msg in to_fold)
+        turn = self.scheduler.background_turn(loop) if self.scheduler and loop else nullcontext()
+        with turn:
+            result = self.llm.generate(
+                prompt=SUMMARY_PROMPT.format(
+                    max_words=int(self.summary_max_tokens * 0.6),
+                    previous=summary_row.content if summary_row else "(sin resumen)",
+                    messages=transcript
+                ),
+                temperature=0.2,
+                max_tokens=self.summary_max_tokens
+            )
+        summary = result.get("response", "").strip()
+        if not summary:
+            return
+
+        last_id = to_fold[-1].id
+        if summary_row:
+            summary_row.content = summary
+            summary_row.memory_metadata = {**(summary_row.memory_metadata or {}), "summarized_until": last_id}
+        else:
+            session.add(ConversationMemory(
+                conversation_id=conversation_id,
+                memory_type=MemoryType.LONG_TERM,
+                content=summary,
+                memory_metadata={"summarized_until": last_id}
+            ))
+
+        entities = extract_entities(
+            [msg.content for msg in to_fold if msg.role == "user"],
+            entity_row.memory_metadata if entity_row else None
+        )
+        entity_text = format_entities(entities)
+        if entity_row:
+            entity_row.content = entity_text
+            entity_row.memory_metadata = entities
+        elif entity_text:
+            session.add(ConversationMemory(
+                conversation_id=conversation_id,
+                memory_type=MemoryType.ENTITY,
+                content=entity_text,
+                memory_metadata=entities
+            ))
+        logger.info(f"Memoria compactada: conversación {conversation_id}, {len(to_fold)} mensajes hasta {last_id}")
+
+
+def _build_memory_service() -> ConversationMemoryService:
+    from app.services.llm_service import ollama_service
+    return ConversationMemoryService(
+        llm=ollama_service,
+        scheduler=llm_scheduler,
+        recent_messages=settings.rag.MEMORY_RECENT_MESSAGES,
+        compact_batch=settings.rag.MEMORY_COMPACT_BATCH,
+        summary_max_tokens=settings.rag.MEMORY_SUMMARY_MAX_TOKENS
+    )
+
+
+# Instancia global del servicio de memoria
+memory_service = _build_memory_service()
@@ -0,0 +1,266 @@
+"""
+Índice secundario en memoria sobre la metadata de los chunks
+Permite resolver filtros estructurados (precio, marca, categoría, stock)
+por empresa sin recorrer el vector store completo
+"""
+
+import bisect
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.services.document_extractors import CATEGORICAL_FIELDS, NUMERIC_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Operadores de rango aceptados en los filtros → operador de ChromaDB
+RANGE_OPERATORS = {"gt": "$gt", "gte": "$gte", "lt": "$lt", "lte": "$lte"}
+
+# Cota superior para los IDs (uuid) al buscar con bisect sobre tuplas (valor, id)
+_MAX_ID = "\uffff"
+
+
+def normalize_filters(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Valida y normaliza los filtros de metadata
+
+    Formatos aceptados:
+        {"brand": "asus"}                         igualdad
+        {"brand": ["asus", "msi"]}                pertenencia
+        {"price": {"gte": 1000, "lte": 4000}}     rango (gt, gte, lt, lte)
+
+    Los campos categóricos se comparan en minúsculas (así se indexan).
+
+    Args:
+        filters: Filtros de entrada
+
+    Returns:
+        Filtros normalizados
+    """
+    normalized: Dict[str, Any] = {}
+    for field, condition in filters.items():
+        if isinstance(condition, dict):
+            unknown = set(condition) - set(RANGE_OPERATORS)
+            if unknown:
+                raise ValueError(f"Operadores no soportados para '{field}': {', '.join(sorted(unknown))}")
+            normalized[field] = {op: float(value) for op, value in condition.items()}
+        elif isinstance(condition, (list, tuple, set)):
+            normalized[field] = [_normalize_value(field, value) for value in condition]
+        else:
+            normalized[field] = _normalize_value(field, condition)
+    return normalized
+
+
+def _normalize_value(field: str, value: Any) -> Any:
+    if field in CATEGORICAL_FIELDS and isinstance(value, str):
+        return value.strip().lower()
+    if field in NUMERIC_FIELDS and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def build_where_clauses(filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Traduce filtros normalizados a cláusulas where de ChromaDB
+
+    Args:
+        filters: Filtros normalizados (ver normalize_filters)
+
+    Returns:
+        Lista de cláusulas (para combinar con $and)
+    """
+    clauses: List[Dict[str, Any]] = []
+    for field, condition in filters.items():
+        if isinstance(condition, dict):
+            for op, value in condition.items():
+                clauses.append({field: {RANGE_OPERATORS[op]: value}})
+        elif isinstance(condition, list):
+            clauses.append({field: {"$in": condition}})
+        else:
+            clauses.append({field: condition})
+    return clauses
+
+
+class _CompanyIndex:
+    """Índices de una empresa: ordenados para numéricos, invertidos para categóricos"""
+
+    def __init__(self):
+        self.ids: Set[str] = set()
+        self.numeric: Dict[str, List[tuple]] = {field: [] for field in NUMERIC_FIELDS}
+        self.categorical: Dict[str, Dict[Any, Set[str]]] = {field: {} for field in CATEGORICAL_FIELDS}
+        self.built_at = time.monotonic()
+        self._unsorted = False
+
+    def add(self, chunk_id: str, metadata: Dict[str, Any]):
+        self.ids.add(chunk_id)
+        for field in NUMERIC_FIELDS:
+            value = metadata.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.numeric[field].append((float(value), chunk_id))
+                self._unsorted = True
+        for field in CATEGORICAL_FIELDS:
+            value = metadata.get(field)
+            if value is not None:
+                self.categorical[field].setdefault(value, set()).add(chunk_id)
+
+    def match(self, field: str, condition: Any) -> Optional[Set[str]]:
+        """IDs que cumplen la condición, o None si el campo no está indexado"""
+        if field in NUMERIC_FIELDS:
+            if self._unsorted:
+                for field_values in self.numeric.values():
+                    field_values.sort()
+                self._unsorted = False
+            values = self.numeric[field]
+            if isinstance(condition, dict):
+                lo, hi = 0, len(values)
+                if "gte" in condition:
+                    lo = max(lo, bisect.bisect_left(values, (condition["gte"],)))
+                if "gt" in condition:
+                    lo = max(lo, bisect.bisect_right(values, (condition["gt"], _MAX_ID)))
+                if "lte" in condition:
+                    hi = min(hi, bisect.bisect_right(values, (condition["lte"], _MAX_ID)))
+                if "lt" in condition:
+                    hi = min(hi, bisect.bisect_left(values, (condition["lt"],)))
+                return {chunk_id for _, chunk_id in values[lo:hi]}
+            targets = condition if isinstance(condition, list) else [condition]
+            result: Set[str] = set()
+            for target in targets:
+                lo = bisect.bisect_left(values, (target,))
+                hi = bisect.bisect_right(values, (target, _MAX_ID))
+                result.update(chunk_id for _, chunk_id in values[lo:hi])
+            return result
+        if field in CATEGORICAL_FIELDS and not isinstance(condition, dict):
+            targets = condition if isinstance(condition, list) else [condition]
+            result = set()
+            for target in targets:
+                result |= self.categorical[field].get(target, set())
+            return result
+        return None
+
+
+class MetadataIndex:
+    """
+    Índice secundario por empresa sobre la metadata estructurada del vector store
+
+    Se construye perezosamente desde ChromaDB la primera vez que una empresa
+    usa filtros, se actualiza al agregar chunks y se invalida al eliminar.
+    El TTL acota la desactualización cuando hay varios workers de uvicorn
+    escribiendo en la misma colección.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 300, page_size: int = 5000):
+        """
+        Args:
+            collection: Colección de ChromaDB
+            ttl_seconds: Segundos antes de reconstruir el índice de una empresa
+            page_size: Tamaño de página al leer metadata de ChromaDB
+        """
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self._companies: Dict[int, _CompanyIndex] = {}
+        self._lock = threading.Lock()
+        # Construcciones en curso: un lock por empresa y los chunks agregados mientras tanto
+        self._build_locks: Dict[int, threading.Lock] = {}
+        self._pending: Dict[int, List[Tuple[str, Dict[str, Any]]]] = {}
+        self._generation = 0
+
+    def _build(self, company_id: int) -> _CompanyIndex:
+        index = _CompanyIndex()
+        offset = 0
+        while True:
+            page = self.collection.get(
+                where={"company_id": company_id},
+                include=["metadatas"],
+                limit=self.page_size,
+                offset=offset
+            )
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                index.add(chunk_id, metadata or {})
+            if len(page["ids"]) < self.page_size:
+                break
+            offset += self.page_size
+        logger.info(f"Índice de metadata construido para empresa {company_id}: {len(index.ids)} chunks")
+        return index
+
+    def _fresh(self, index: Optional[_CompanyIndex]) -> bool:
+        return index is not None and time.monotonic() - index.built_at <= self.ttl_seconds
+
+    def _get(self, company_id: int) -> _CompanyIndex:
+        """
+        Índice de la empresa; la reconstrucción lee ChromaDB fuera del lock
+        global, así que no bloquea a las demás empresas ni a add/invalidate.
+        Mientras se reconstruye un índice vencido, las otras consultas de la
+        empresa siguen usando el anterior.
+        """
+        with self._lock:
+            index = self._companies.get(company_id)
+            if self._fresh(index):
+                return index
+            build_lock = self._build_locks.setdefault(company_id, threading.Lock())
+
+        if not build_lock.acquire(blocking=index is None):
+            return index
+        try:
+            with self._lock:
+                current = self._companies.get(company_id)
+                if self._fresh(current):
+                    return current  # lo construyó otro hilo mientras esperábamos
+                self._pending[company_id] = []
+                generation = self._generation
+
+            index = self._build(company_id)
+
+            with self._lock:
+                for chunk_id, metadata in self._pending.pop(company_id, []):
+                    index.add(chunk_id, metadata)
+                if generation == self._generation:
+                    self._companies[company_id] = index
+                # Invalidado durante la construcción: se usa para esta consulta, no se guarda
+            return index
+        finally:
+            build_lock.release()
+
+    def candidates(self, company_id: int, filters: Dict[str, Any]) -> Optional[Set[str]]:
+        """
+        IDs de chunks de la empresa que cumplen todos los filtros
+
+        Args:
+            company_id: ID de la empresa
+            filters: Filtros normalizados
+
+        Returns:
+            Conjunto de IDs, o None si algún filtro no se puede resolver con el índice
+        """
+        index = self._get(company_id)
+        result: Optional[Set[str]] = None
+        with self._lock:
+            for field, condition in filters.items():
+                matched = index.match(field, condition)
+                if matched is None:
+                    return None
+                result = matched if result is None else result & matched
+                if not result:
+                    return set()
+        return result if result is not None else set(index.ids)
+
+    def add(self, ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]):
+        """Registra chunks recién agregados en los índices ya construidos"""
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                company_id = metadata.get("company_id")
+                index = self._companies.get(company_id)
+                if index is not None:
+                    index.add(chunk_id, metadata)
+                if company_id in self._pending:
+                    self._pending[company_id].append((chunk_id, metadata))
+
+    def invalidate(self, company_id: Optional[int] = None):
+        """Descarta el índice de una empresa (o de todas)"""
+        with self._lock:
+            self._generation += 1
+            if company_id is None:
+                self._companies.clear()
+            else:
+                self._companies.pop(company_id, None)
@@ -0,0 +1,270 @@
+"""
+Métricas Prometheus de la aplicación
+Histogramas y contadores del hot path (rutas HTTP, Ollama, embeddings,
+ChromaDB y pool de conexiones MySQL) expuestos en /metrics
+
+Con varios workers de uvicorn definir PROMETHEUS_MULTIPROC_DIR (directorio
+vacío y escribible) antes de arrancar: cada proceso escribe sus valores en
+archivos mmap y /metrics agrega todos los procesos
+"""
+
+import os
+import time
+import logging
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+MULTIPROCESS_MODE = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Buckets de latencia (segundos): desde consultas a BD hasta generaciones largas
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+HTTP_REQUESTS = Counter(
+    "chatbot_http_requests_total",
+    "Requests HTTP por ruta y código de estado",
+    ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "chatbot_http_request_duration_seconds",
+    "Latencia de requests HTTP por ruta",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS
+)
+
+# ============================================================================
+# OLLAMA
+# ============================================================================
+
+OLLAMA_DURATION = Histogram(
+    "chatbot_ollama_request_duration_seconds",
+    "Duración de llamadas a Ollama /api/generate",
+    ["model", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+OLLAMA_TOKENS_PER_SECOND = Histogram(
+    "chatbot_ollama_tokens_per_second",
+    "Velocidad de generación reportada por Ollama (eval_count / eval_duration)",
+    ["model"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+)
+OLLAMA_TOKENS = Counter(
+    "chatbot_ollama_tokens_total",
+    "Tokens procesados por Ollama",
+    ["model", "kind"]
+)
+OLLAMA_CONTEXT_REUSE = Counter(
+    "chatbot_ollama_context_reuse_total",
+    "Turnos que reutilizan el contexto KV de la conversación (hit) o envían el prompt completo (miss)",
+    ["outcome"]
+)
+OLLAMA_BACKEND_IN_FLIGHT = Gauge(
+    "chatbot_ollama_backend_in_flight",
+    "Generaciones en curso por backend Ollama",
+    ["backend"],
+    multiprocess_mode="livesum"
+)
+OLLAMA_BACKEND_HEALTHY = Gauge(
+    "chatbot_ollama_backend_healthy",
+    "1 si el backend Ollama respondió la última verificación de salud",
+    ["backend"],
+    multiprocess_mode="livemax"
+)
+OLLAMA_FAILOVERS = Counter(
+    "chatbot_ollama_failovers_total",
+    "Reintentos en otro backend por error del backend elegido",
+    ["backend", "reason"]
+)
+
+# ============================================================================
+# SCHEDULER DEL LLM
+# ============================================================================
+
+LLM_QUEUE_WAIT = Histogram(
+    "chatbot_llm_queue_wait_seconds",
+    "Espera en cola antes de obtener un turno de generación",
+    ["outcome"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "chatbot_llm_queue_depth",
+    "Solicitudes esperando turno de generación",
+    multiprocess_mode="livesum"
+)
+LLM_IN_FLIGHT = Gauge(
+    "chatbot_llm_in_flight",
+    "Generaciones en curso",
+    multiprocess_mode="livesum"
+)
+LLM_REJECTED = Counter(
+    "chatbot_llm_rejected_total",
+    "Solicitudes rechazadas por el control de admisión",
+    ["reason"]
+)
+COALESCED_REQUESTS = Counter(
+    "chatbot_coalesced_requests_total",
+    "Turnos sin historial deduplicados: leader genera, follower reutiliza su resultado",
+    ["role"]
+)
+
+# ============================================================================
+# RAG
+# ============================================================================
+
+EMBEDDING_BATCH_SIZE = Histogram(
+    "chatbot_embedding_batch_size",
+    "Chunks por lote de embeddings al indexar",
+    buckets=(1, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+VECTOR_GC_DELETED = Counter(
+    "chatbot_vector_gc_deleted_total",
+    "Chunks huérfanos borrados del vector store por el GC"
+)
+CATALOG_LOOKUPS = Counter(
+    "chatbot_catalog_lookups_total",
+    "Consultas evaluadas por el índice de productos: respondidas sin LLM (hit) o derivadas a RAG (fallback)",
+    ["outcome"]
+)
+CATALOG_LOOKUP_DURATION = Histogram(
+    "chatbot_catalog_lookup_duration_seconds",
+    "Duración de la detección de intención y producto en el índice de catálogo",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+CHROMA_QUERY_DURATION = Histogram(
+    "chatbot_chroma_query_duration_seconds",
+    "Duración de consultas al vector store",
+    ["mode"],
+    buckets=LATENCY_BUCKETS
+)
+
+# ============================================================================
+# POOL DE CONEXIONES (SQLAlchemy)
+# ============================================================================
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "chatbot_db_pool_checkout_wait_seconds",
+    "Espera para obtener una conexión del pool",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30)
+)
+DB_POOL_OVERFLOW_CONNECTIONS = Counter(
+    "chatbot_db_pool_overflow_connections_total",
+    "Conexiones abiertas por encima de pool_size (el pool se quedó corto)",
+    ["engine"]
+)
+DB_POOL_TIMEOUTS = Counter(
+    "chatbot_db_pool_timeouts_total",
+    "Requests que agotaron pool_timeout esperando una conexión",
+    ["engine"]
+)
+DB_POOL_IN_USE = Gauge(
+    "chatbot_db_pool_connections_in_use",
+    "Conexiones del pool actualmente prestadas",
+    ["engine"],
+    multiprocess_mode="livesum"
+)
+
+
+def observe_ollama(model: str, duration_seconds: float, result: dict = None, outcome: str = "ok"):
+    """
+    Registra una llamada a Ollama
+
+    Args:
+        model: Modelo usado
+        duration_seconds: Duración medida de la llamada
+        result: Respuesta de /api/generate (para tokens y velocidad)
+        outcome: ok | error
+    """
+    OLLAMA_DURATION.labels(model=model, outcome=outcome).observe(duration_seconds)
+    if not result:
+        return
+    eval_count = result.get("eval_count") or 0
+    eval_duration = result.get("eval_duration") or 0
+    OLLAMA_TOKENS.labels(model=model, kind="prompt").inc(result.get("prompt_eval_count") or 0)
+    OLLAMA_TOKENS.labels(model=model, kind="completion").inc(eval_count)
+    if eval_count and eval_duration:
+        OLLAMA_TOKENS_PER_SECOND.labels(model=model).observe(eval_count / (eval_duration / 1e9))
+
+
+def instrument_engine(engine, name: str = "sync"):
+    """
+    Registra listeners del pool para medir conexiones en uso
+
+    Args:
+        engine: Engine de SQLAlchemy (sync)
+        name: Etiqueta del engine en las métricas
+    """
+    from sqlalchemy import event
+
+    in_use = DB_POOL_IN_USE.labels(engine=name)
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        in_use.dec()
+
+
+class PrometheusMiddleware:
+    """Middleware ASGI: latencia y conteo por ruta (plantilla de ruta, no URL)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "GET")
+            HTTP_LATENCY.labels(method=method, route=route_path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method=method, route=route_path, status=str(status["code"])).inc()
+
+
+def render_metrics():
+    """
+    Serializa las métricas en formato de exposición Prometheus
+
+    Returns:
+        Tupla (contenido, content-type)
+    """
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Limpia los archivos mmap de gauges 'live' del proceso actual al terminar"""
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(os.getpid())
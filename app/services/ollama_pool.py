@@ -0,0 +1,250 @@
+"""
+Pool de servidores Ollama
+Enruta cada generación al backend menos cargado que tenga el modelo,
+verifica la salud de los backends en segundo plano y permite reintentar en
+otro backend cuando uno falla
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from app.services.metrics import OLLAMA_BACKEND_HEALTHY, OLLAMA_BACKEND_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_model_name(name: str) -> str:
+    """'mistral' y 'mistral:latest' son el mismo modelo en Ollama"""
+    return name if ":" in name else f"{name}:latest"
+
+
+def parse_backend_urls(raw: str, default: str) -> List[str]:
+    """
+    Lista de URLs de Ollama separadas por coma
+
+    Args:
+        raw: Cadena de configuración (vacía = solo default)
+        default: URL a usar si no hay lista
+
+    Returns:
+        URLs sin barra final y sin duplicados
+    """
+    urls = []
+    for item in (raw or "").split(","):
+        url = item.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls or [default.rstrip("/")]
+
+
+class OllamaBackend:
+    """Estado de un servidor Ollama"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.healthy = True
+        self.models: Optional[Set[str]] = None  # None = aún no consultado
+        self.tokens_per_second: Optional[float] = None  # promedio móvil
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+
+    def has_model(self, model: str) -> bool:
+        return self.models is None or normalize_model_name(model) in self.models
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "models": sorted(self.models) if self.models is not None else None,
+            "tokens_per_second": round(self.tokens_per_second, 2) if self.tokens_per_second else None,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaBackendPool:
+    """
+    Selección de backend por carga, modelo y afinidad
+
+    El costo estimado de un backend es (en curso + 1) / tokens por segundo:
+    un nodo más rápido puede atender más solicitudes simultáneas. Las
+    conversaciones se mantienen en el mismo backend mientras esté sano, para
+    aprovechar el contexto KV que ya tiene cargado.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        health_check: Callable[[str], bool],
+        list_models: Callable[[str], Optional[List[str]]],
+        health_interval: float = 15.0,
+        affinity_size: int = 5000,
+        ewma_alpha: float = 0.3
+    ):
+        """
+        Args:
+            urls: URLs de los servidores Ollama
+            health_check: Función url -> bool (p.ej. OllamaService.check_health)
+            list_models: Función url -> nombres de modelos (p.ej. OllamaService.fetch_models);
+                si falla (excepción o None) se conservan los modelos conocidos
+            health_interval: Segundos entre verificaciones de salud
+            affinity_size: Conversaciones recordadas para afinidad
+            ewma_alpha: Peso de la última medición de tokens/s
+        """
+        self.backends = [OllamaBackend(url) for url in urls]
+        self._health_check = health_check
+        self._list_models = list_models
+        self.health_interval = health_interval
+        self.affinity_size = affinity_size
+        self.ewma_alpha = ewma_alpha
+        self._affinity: Dict[object, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._rr = 0
+        for backend in self.backends:
+            OLLAMA_BACKEND_HEALTHY.labels(backend=backend.url).set(1)
+
+    def _cost(self, backend: OllamaBackend, default_tps: float) -> float:
+        return (backend.in_flight + 1) / (backend.tokens_per_second or default_tps)
+
+    def select(self, model: str, exclude: Optional[Set[str]] = None, affinity_key=None) -> Optional[OllamaBackend]:
+        """
+        Elige el backend para una solicitud
+
+        Args:
+            model: Modelo requerido
+            exclude: URLs ya intentadas en esta solicitud
+            affinity_key: Clave de afinidad (p.ej. conversation_id)
+
+        Returns:
+            Backend o None si no hay ninguno disponible
+        """
+        exclude = exclude or set()
+        with self._lock:
+            candidates = [
+                b for b in self.backends
+                if b.healthy and b.url not in exclude and b.has_model(model)
+            ]
+            if not candidates:
+                # Último recurso: backends marcados caídos que aún no se intentaron
+                candidates = [b for b in self.backends if b.url not in exclude and b.has_model(model)]
+            if not candidates:
+                return None
+
+            known = [b.tokens_per_second for b in candidates if b.tokens_per_second]
+            default_tps = sum(known) / len(known) if known else 1.0
+            best_cost = min(self._cost(b, default_tps) for b in candidates)
+
+            if affinity_key is not None:
+                preferred = self._affinity.get(affinity_key)
+                for backend in candidates:
+                    # Se respeta la afinidad salvo que el nodo esté claramente más cargado
+                    if backend.url == preferred and self._cost(backend, default_tps) <= best_cost * 2:
+                        return backend
+
+            best = [b for b in candidates if self._cost(b, default_tps) == best_cost]
+            self._rr = (self._rr + 1) % len(best)
+            return best[self._rr]
+
+    @contextmanager
+    def lease(self, backend: OllamaBackend, affinity_key=None):
+        """Cuenta la solicitud como en curso en el backend mientras dura el bloque"""
+        with self._lock:
+            backend.in_flight += 1
+        OLLAMA_BACKEND_IN_FLIGHT.labels(backend=backend.url).inc()
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.in_flight -= 1
+            OLLAMA_BACKEND_IN_FLIGHT.labels(backend=backend.url).dec()
+        if affinity_key is not None:
+            with self._lock:
+                self._affinity.pop(affinity_key, None)
+                self._affinity[affinity_key] = backend.url
+                while len(self._affinity) > self.affinity_size:
+                    self._affinity.pop(next(iter(self._affinity)))
+
+    def record_success(self, backend: OllamaBackend, result: Dict):
+        """Actualiza la velocidad medida del backend con una respuesta de /api/generate"""
+        eval_count = result.get("eval_count") or 0
+        eval_duration = result.get("eval_duration") or 0
+        with self._lock:
+            if eval_count and eval_duration:
+                tps = eval_count / (eval_duration / 1e9)
+                backend.tokens_per_second = (
+                    tps if backend.tokens_per_second is None
+                    else self.ewma_alpha * tps + (1 - self.ewma_alpha) * backend.tokens_per_second
+                )
+            if not backend.healthy:
+                backend.healthy = True
+                backend.last_error = None
+                OLLAMA_BACKEND_HEALTHY.labels(backend=backend.url).set(1)
+
+    def record_failure(self, backend: OllamaBackend, error: Exception):
+        """Marca el backend como caído hasta la próxima verificación de salud"""
+        with self._lock:
+            backend.healthy = False
+            backend.last_error = str(error)
+        OLLAMA_BACKEND_HEALTHY.labels(backend=backend.url).set(0)
+        logger.warning(f"Backend Ollama {backend.url} marcado como caído: {error}")
+
+    def record_missing_model(self, backend: OllamaBackend, model: str):
+        """El backend respondió que no tiene el modelo"""
+        with self._lock:
+            if backend.models is not None:
+                backend.models.discard(normalize_model_name(model))
+            else:
+                backend.models = set()
+
+    def check_all(self):
+        """Verifica salud y modelos de todos los backends"""
+        for backend in self.backends:
+            healthy = self._health_check(backend.url)
+            models = None
+            if healthy:
+                try:
+                    models = self._list_models(backend.url)
+                except Exception as e:
+                    # Un fallo transitorio de /api/tags no vacía la lista de modelos
+                    logger.warning(f"No se pudieron listar los modelos de {backend.url}: {e}")
+            with self._lock:
+                backend.healthy = healthy
+                backend.last_check = time.time()
+                if models is not None:
+                    backend.models = {normalize_model_name(name) for name in models}
+                if healthy:
+                    backend.last_error = None
+            OLLAMA_BACKEND_HEALTHY.labels(backend=backend.url).set(1 if healthy else 0)
+
+    def start(self):
+        """Inicia las verificaciones de salud periódicas"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene las verificaciones de salud"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Error verificando backends de Ollama: {e}")
+            self._stop.wait(self.health_interval)
+
+    def status(self) -> List[Dict]:
+        """Estado de cada backend"""
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
@@ -0,0 +1,126 @@
+"""
+Almacén de secciones padre (parent-document retrieval)
+Se indexan chunks hijos pequeños y, al recuperar, se devuelve la sección
+completa a la que pertenecen. El texto de las secciones se guarda por
+documento en dos archivos compactos:
+
+- <document_id>.bin: textos UTF-8 concatenados
+- <document_id>.idx: offsets (uint64), uno por sección más el final
+
+Los .bin se leen con mmap (sin cargar el documento completo en memoria) y
+los offsets se mantienen en un LRU de documentos abiertos.
+"""
+
+import logging
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ParentStore:
+    """Textos de las secciones padre por documento, servidos con mmap"""
+
+    def __init__(self, directory: str, max_open: int = 256):
+        """
+        Args:
+            directory: Carpeta de los archivos .bin/.idx
+            max_open: Documentos con el mmap abierto a la vez (LRU)
+        """
+        self.directory = directory
+        self.max_open = max_open
+        os.makedirs(directory, exist_ok=True)
+        self._open: "OrderedDict[int, Tuple[Optional[mmap.mmap], array]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _paths(self, document_id: int) -> Tuple[str, str]:
+        base = os.path.join(self.directory, str(int(document_id)))
+        return base + ".bin", base + ".idx"
+
+    def _close(self, document_id: int):
+        entry = self._open.pop(document_id, None)
+        if entry and entry[0] is not None:
+            entry[0].close()
+
+    def put(self, document_id: int, parents: List[str]):
+        """Guarda (o reemplaza) las secciones de un documento"""
+        bin_path, idx_path = self._paths(document_id)
+        offsets = array("Q", [0])
+        with open(bin_path + ".tmp", "wb") as f:
+            for text in parents:
+                data = text.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with open(idx_path + ".tmp", "wb") as f:
+            offsets.tofile(f)
+        with self._lock:
+            self._close(document_id)
+            # El .idx se publica al final: un lector nunca ve offsets de otro .bin
+            os.replace(bin_path + ".tmp", bin_path)
+            os.replace(idx_path + ".tmp", idx_path)
+
+    def _load(self, document_id: int) -> Optional[Tuple[Optional[mmap.mmap], array]]:
+        entry = self._open.get(document_id)
+        if entry is not None:
+            self._open.move_to_end(document_id)
+            return entry
+        bin_path, idx_path = self._paths(document_id)
+        if not os.path.exists(idx_path):
+            return None
+        offsets = array("Q")
+        with open(idx_path, "rb") as f:
+            offsets.frombytes(f.read())
+        data = None
+        if offsets[-1]:
+            with open(bin_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        entry = (data, offsets)
+        self._open[document_id] = entry
+        while len(self._open) > self.max_open:
+            self._close(next(iter(self._open)))
+        return entry
+
+    def get(self, document_id: int, parent_index: int) -> Optional[str]:
+        """Texto de una sección (None si no existe)"""
+        with self._lock:
+            entry = self._load(int(document_id))
+            if entry is None:
+                return None
+            data, offsets = entry
+            if not 0 <= parent_index < len(offsets) - 1:
+                return None
+            start, end = offsets[parent_index], offsets[parent_index + 1]
+            return data[start:end].decode("utf-8") if data is not None else ""
+
+    def get_many(self, keys: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], str]:
+        """Textos de varias secciones {(document_id, parent_index): texto}"""
+        result = {}
+        for document_id, parent_index in keys:
+            text = self.get(document_id, parent_index)
+            if text is not None:
+                result[(document_id, parent_index)] = text
+        return result
+
+    def delete(self, document_id: int):
+        """Elimina las secciones de un documento"""
+        with self._lock:
+            self._close(int(document_id))
+            for path in self._paths(document_id):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def document_ids(self) -> Set[int]:
+        """Documentos con secciones guardadas"""
+        return {
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith(".idx") and name[:-4].isdigit()
+        }
+
+    def close(self):
+        with self._lock:
+            for document_id in list(self._open):
+                self._close(document_id)
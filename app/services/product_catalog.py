@@ -0,0 +1,330 @@
+"""
+Índice de productos para respuestas directas
+Al cargar documentos se extraen los productos del catálogo (marca, modelo,
+precio, stock y especificaciones; ver document_extractors.extract_products y
+products_from_rows) y se guardan en CatalogProduct.
+
+Las consultas de precio o stock que nombran un único producto ("precio del
+Lenovo Legion 5") se responden desde un índice en memoria con una plantilla,
+sin embeddings, recuperación ni LLM. Si la intención o el producto no son
+claros se devuelve None y la consulta sigue por el flujo RAG completo.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from app.models.rag_models import CatalogProduct
+from app.services.metrics import CATALOG_LOOKUPS, CATALOG_LOOKUP_DURATION
+
+logger = logging.getLogger(__name__)
+
+_PRICE_INTENT = re.compile(r"\b(precio|precios|cuesta|cuestan|cuanto sale|cuanto vale|cuanto esta|valor|costo)\b")
+_STOCK_INTENT = re.compile(r"\b(stock|disponible|disponibles|disponibilidad|quedan|unidades|hay|tienen|tienes)\b")
+# Consultas que necesitan razonar sobre varios productos o condiciones: van por RAG
+_COMPLEX_INTENT = re.compile(
+    r"\b(compar\w*|vs|versus|diferencia\w*|mejor\w*|recomiend\w*|recomend\w*|entre|"
+    r"financ\w*|cuotas|descuento\w*|promocion\w*|garantia\w*|barat\w*|car[oa]s?)\b"
+)
+
+# Puntaje mínimo cuando la consulta contiene una palabra exclusiva del producto
+_DISTINCTIVE_TOKEN_SCORE = 0.75
+
+# Palabras de categoría: no identifican un producto por sí solas ("hay mouse
+# inalambrico?"). Se suman las palabras de las categorías del propio catálogo
+_CATEGORY_WORDS = frozenset(
+    "laptop laptops notebook notebooks computadora computadoras pc macbook macbooks "
+    "mouse mouses raton ratones teclado teclados keyboard keyboards monitor monitores "
+    "pantalla pantallas audifono audifonos auricular auriculares headset headsets "
+    "webcam webcams camara camaras impresora impresoras tablet tablets celular celulares "
+    "parlante parlantes gamer gaming inalambrico inalambrica inalambricos inalambricas "
+    "wireless mecanico mecanicos oficina".split()
+)
+
+_STOPWORDS = frozenset(
+    "a al con de del el en es la las lo los mi me para por que se su un una y o "
+    "cuanto cuanta precio precios cuesta cuestan stock hay tienen tienes quedan unidades "
+    "disponible disponibles sale vale esta valor costo".split()
+)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes y con los símbolos reemplazados por espacios"""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def _tokens(text: str) -> List[str]:
+    return [token for token in normalize(text).split() if token not in _STOPWORDS]
+
+
+# ============================================================================
+# PERSISTENCIA (ingesta)
+# ============================================================================
+
+def replace_document_products(session: Session, company_id: int, document_id: int, products: List[Dict[str, Any]]) -> int:
+    """Reemplaza los productos de un documento en un solo INSERT; no hace commit"""
+    session.execute(delete(CatalogProduct).where(CatalogProduct.document_id == document_id))
+    rows = [
+        {
+            "document_id": document_id,
+            "company_id": company_id,
+            "name": product["name"][:255],
+            "brand": (product.get("brand") or "")[:100] or None,
+            "model": (product.get("model") or "")[:100] or None,
+            "sku": (product.get("sku") or "")[:100] or None,
+            "category": (product.get("category") or "")[:255] or None,
+            "price": product.get("price"),
+            "stock": product.get("stock"),
+            "specs": product.get("specs") or None,
+            "section": (product.get("section") or "")[:500] or None,
+        }
+        for product in products
+    ]
+    if rows:
+        session.execute(insert(CatalogProduct), rows)
+    return len(rows)
+
+
+# ============================================================================
+# ÍNDICE Y RESPUESTAS DIRECTAS (consulta)
+# ============================================================================
+
+class _CompanyCatalog:
+    """Productos de una empresa con índice invertido de tokens"""
+
+    def __init__(self, products: List[Dict[str, Any]]):
+        self.products = products
+        self.built_at = time.monotonic()
+        self.name_tokens: List[Set[str]] = []
+        self.codes: List[Set[str]] = []
+        self.postings: Dict[str, Set[int]] = {}
+        self.generic_tokens = set(_CATEGORY_WORDS)
+        for i, product in enumerate(products):
+            if product.get("category"):
+                self.generic_tokens.update(_tokens(product["category"]))
+            name_tokens = set(_tokens(product["name"]))
+            if product.get("brand"):
+                name_tokens.update(_tokens(product["brand"]))
+            # Modelo y SKU: como tokens y como código compacto ("g614jvn4085w")
+            codes = {normalize(code).replace(" ", "") for code in (product.get("model"), product.get("sku")) if code}
+            codes.discard("")
+            code_tokens = {token for code in (product.get("model"), product.get("sku")) if code for token in _tokens(code)}
+            self.name_tokens.append(name_tokens)
+            self.codes.append(codes)
+            for token in name_tokens | codes | code_tokens:
+                self.postings.setdefault(token, set()).add(i)
+        total = max(1, len(products))
+        self.idf = {token: math.log(1 + total / len(ids)) for token, ids in self.postings.items()}
+
+    def score(self, query_tokens: Set[str], query_compact: str) -> List[tuple]:
+        """
+        (puntaje, índice, identificado) de los productos que comparten tokens
+        con la consulta, de mayor a menor
+
+        Un producto queda identificado si la consulta contiene su modelo/SKU,
+        al menos dos palabras de su nombre que no son de categoría o una
+        palabra que solo aparece en ese producto.
+        """
+        candidates: Set[int] = set()
+        for token in query_tokens:
+            candidates |= self.postings.get(token, set())
+        scored = []
+        for i in candidates:
+            if any(len(code) >= 4 and code in query_compact for code in self.codes[i]):
+                scored.append((1.0, i, True))
+                continue
+            tokens = self.name_tokens[i]
+            weight = sum(self.idf[token] for token in tokens)
+            matched_tokens = tokens & query_tokens
+            score = sum(self.idf[token] for token in matched_tokens) / weight if weight else 0.0
+            specific_tokens = matched_tokens - self.generic_tokens
+            identified = len(specific_tokens) >= 2
+            # Una palabra que solo aparece en este producto ("deathadder") lo identifica
+            if any(len(self.postings[token]) == 1 and len(token) >= 4 and not token.isdigit() for token in specific_tokens):
+                score = max(score, _DISTINCTIVE_TOKEN_SCORE)
+                identified = True
+            scored.append((score, i, identified))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored
+
+
+class ProductCatalog:
+    """
+    Índice de productos por empresa para responder precio y stock sin LLM
+
+    Se construye desde CatalogProduct la primera vez que una empresa consulta,
+    se invalida al cargar o borrar documentos y el TTL acota la
+    desactualización con varios workers o cargas desde cargar_documentos.py.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, min_score: float = 0.6, min_margin: float = 0.2, currency: str = "S/"):
+        """
+        Args:
+            ttl_seconds: Segundos antes de recargar los productos de una empresa
+            min_score: Fracción (ponderada por IDF) del nombre que debe aparecer en la consulta
+            min_margin: Ventaja mínima sobre el segundo producto (si no, es ambiguo)
+            currency: Símbolo de moneda en las respuestas
+        """
+        self.ttl_seconds = ttl_seconds
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.currency = currency
+        self._companies: Dict[int, _CompanyCatalog] = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "fast_ms": 0.0, "rag_answers": 0, "rag_ms": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _load(self, session_factory, company_id: int) -> _CompanyCatalog:
+        session = session_factory()
+        try:
+            rows = session.execute(
+                select(CatalogProduct).where(CatalogProduct.company_id == company_id).order_by(CatalogProduct.id)
+            ).scalars().all()
+            products = [
+                {
+                    "id": row.id, "document_id": row.document_id, "name": row.name, "brand": row.brand,
+                    "model": row.model, "sku": row.sku, "category": row.category, "price": row.price,
+                    "stock": row.stock, "section": row.section,
+                }
+                for row in rows
+            ]
+        finally:
+            session.close()
+        logger.info(f"Catálogo cargado para empresa {company_id}: {len(products)} productos")
+        return _CompanyCatalog(products)
+
+    def get(self, session_factory, company_id: int) -> _CompanyCatalog:
+        """Catálogo de la empresa (lo recarga si venció el TTL)"""
+        with self._lock:
+            catalog = self._companies.get(company_id)
+            if catalog is None or time.monotonic() - catalog.built_at > self.ttl_seconds:
+                catalog = self._load(session_factory, company_id)
+                self._companies[company_id] = catalog
+            return catalog
+
+    def invalidate(self, company_id: Optional[int] = None):
+        """Descarta el índice de una empresa (o de todas)"""
+        with self._lock:
+            if company_id is None:
+                self._companies.clear()
+            else:
+                self._companies.pop(company_id, None)
+
+    def match(self, catalog: _CompanyCatalog, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Intención (precio/stock) y producto de la consulta
+
+        Returns:
+            {"intents", "product", "score"} o None si la consulta no es una
+            búsqueda directa o el producto es ambiguo
+        """
+        normalized = normalize(query)
+        intents = [
+            intent for intent, pattern in (("price", _PRICE_INTENT), ("stock", _STOCK_INTENT))
+            if pattern.search(normalized)
+        ]
+        if not intents or not catalog.products or _COMPLEX_INTENT.search(normalized):
+            return None
+        scored = catalog.score(set(_tokens(query)), normalized.replace(" ", ""))
+        if not scored:
+            return None
+        best_score, best, identified = scored[0]
+        second_score = scored[1][0] if len(scored) > 1 else 0.0
+        if not identified or best_score < self.min_score or best_score - second_score < self.min_margin:
+            return None
+        return {"intents": intents, "product": catalog.products[best], "score": round(best_score, 3)}
+
+    def render(self, match: Dict[str, Any]) -> str:
+        """Respuesta de plantilla para el producto encontrado"""
+        product = match["product"]
+        name = product["name"]
+        stock = product.get("stock")
+        price = f"{self.currency} {product['price']:,.2f}" if product.get("price") is not None else None
+        if "price" in match["intents"] and price:
+            text = f"El {name} tiene un precio de {price}."
+            if stock is not None:
+                text += f" Tenemos {stock} unidades disponibles." if stock > 0 else " Por ahora no tenemos stock disponible."
+            return text
+        if stock is None:
+            return f"El {name} está en nuestro catálogo" + (f" a {price}." if price else ".")
+        if stock > 0:
+            return f"Sí, tenemos {stock} unidades disponibles del {name}" + (f" a {price}." if price else ".")
+        return f"Por ahora no tenemos stock del {name}."
+
+    def answer(self, session_factory, company_id: int, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Responde una consulta de precio/stock desde el índice
+
+        Returns:
+            {"response", "sources", "product", "score", "elapsed_ms"} o None
+            (la consulta debe seguir por RAG)
+        """
+        start = time.perf_counter()
+        match = self.match(self.get(session_factory, company_id), query)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        CATALOG_LOOKUP_DURATION.observe(elapsed_ms / 1000)
+        CATALOG_LOOKUPS.labels(outcome="hit" if match else "fallback").inc()
+        with self._stats_lock:
+            self._stats["lookups"] += 1
+            if match:
+                self._stats["hits"] += 1
+                self._stats["fast_ms"] += elapsed_ms
+        if not match:
+            return None
+        product = match["product"]
+        return {
+            "response": self.render(match),
+            "sources": [{
+                "chunk_id": None,
+                "catalog_product_id": product["id"],
+                "document_id": product["document_id"],
+                "section": product.get("section"),
+            }],
+            "product": product["name"],
+            "score": match["score"],
+            "elapsed_ms": round(elapsed_ms, 3),
+        }
+
+    def record_rag_answer(self, elapsed_ms: float):
+        """Registra la latencia de una respuesta por RAG (para estimar el ahorro)"""
+        with self._stats_lock:
+            self._stats["rag_answers"] += 1
+            self._stats["rag_ms"] += elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        """Tasa de aciertos y ahorro estimado de latencia desde el arranque"""
+        with self._stats_lock:
+            s = dict(self._stats)
+        avg_fast = s["fast_ms"] / s["hits"] if s["hits"] else 0.0
+        avg_rag = s["rag_ms"] / s["rag_answers"] if s["rag_answers"] else 0.0
+        return {
+            "lookups": s["lookups"],
+            "hits": s["hits"],
+            "hit_rate": round(s["hits"] / s["lookups"], 4) if s["lookups"] else 0.0,
+            "avg_fast_ms": round(avg_fast, 3),
+            "avg_rag_ms": round(avg_rag, 1),
+            "estimated_saved_ms": round(max(0.0, avg_rag - avg_fast) * s["hits"], 1),
+        }
+
+
+def _create_product_catalog() -> ProductCatalog:
+    from app.core.config import settings
+
+    return ProductCatalog(
+        ttl_seconds=settings.rag.CATALOG_INDEX_TTL,
+        min_score=settings.rag.CATALOG_MIN_SCORE,
+        min_margin=settings.rag.CATALOG_MIN_MARGIN,
+        currency=settings.rag.CATALOG_CURRENCY
+    )
+
+
+# Instancia global
+product_catalog = _create_product_catalog()
@@ -5,18 +5,19 @@ Maneja el procesamiento de documentos, embeddings y consultas RAG
 
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable
 from pathlib import Path
 import hashlib
 from datetime import datetime
+import numpy as np
 
 # Document processing
-import fitz  # PyMuPDF
-from docx import Document
-import pandas as pd
+from app.services.document_extractors import (
+    extract_pdf, extract_docx, extract_excel, extract_txt,
+    iter_pdf_pages, iter_pdf_pages_parallel, pdf_page_count, iter_excel_records
+)
 
 # RAG components
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document as LangchainDocument
@@ -26,6 +27,14 @@ from sqlalchemy.orm import Session
 from app.models.current import SystemUser
 import chromadb
 from chromadb.config import Settings
+from app.core.config import settings
+from app.services.chunking import count_tokens, get_chunker, parent_child_records
+from app.services.parent_store import ParentStore
+from app.services.metadata_index import MetadataIndex, normalize_filters, build_where_clauses
+from app.services.reranker import get_reranker
+from app.services.diversity import DIVERSITY_MODES, mmr_select, remove_near_duplicates
+from app.services.tracing import span
+from app.services.metrics import EMBEDDING_BATCH_SIZE, CHROMA_QUERY_DURATION
 
 logger = logging.getLogger(__name__)
 
@@ -64,14 +73,17 @@ class RAGService:
             embedding_function=self.embeddings,
             collection_name="user_documents"
         )
+        # Colección nativa: consultas con embedding precalculado y filtros where
+        self.collection = self.vector_store._collection
         
-        # Text splitter para chunking
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=512,
-            chunk_overlap=50,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+        # Índice secundario de metadata para filtros estructurados
+        self.metadata_index = MetadataIndex(self.collection, ttl_seconds=settings.rag.METADATA_INDEX_TTL)
+        
+        # Secciones padre de los chunks hijos (parent-document retrieval)
+        self.parent_store = ParentStore(os.path.join(persist_directory, "parents"))
+        
+        # Versión del conjunto de documentos: cambia con cada alta o baja de chunks
+        self.documents_version = 0
         
         logger.info("RAG Service inicializado correctamente")
     
@@ -85,15 +97,26 @@ class RAGService:
         Returns:
             Texto extraído del PDF
         """
-        try:
-            text = ""
-            with fitz.open(file_path) as doc:
-                for page in doc:
-                    text += page.get_text()
-            return text
-        except Exception as e:
-            logger.error(f"Error procesando PDF {file_path}: {e}")
-            raise
+        return extract_pdf(file_path)
+    
+    def iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        """
+        Itera las páginas de un PDF en streaming
+        
+        Los PDFs grandes se dividen en rangos de páginas que se extraen en
+        procesos worker; los pequeños se leen en el proceso actual.
+        
+        Args:
+            file_path: Ruta al archivo PDF
+            
+        Yields:
+            Tuplas (número de página 1-based, texto de la página)
+        """
+        workers = settings.rag.PDF_WORKERS
+        if workers > 1 and pdf_page_count(file_path) >= settings.rag.PDF_PARALLEL_MIN_PAGES:
+            logger.info(f"Extrayendo PDF en paralelo ({workers} workers): {file_path}")
+            return iter_pdf_pages_parallel(file_path, workers)
+        return iter_pdf_pages(file_path)
     
     def process_docx(self, file_path: str) -> str:
         """
@@ -105,13 +128,7 @@ class RAGService:
         Returns:
             Texto extraído del documento
         """
-        try:
-            doc = Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
-        except Exception as e:
-            logger.error(f"Error procesando DOCX {file_path}: {e}")
-            raise
+        return extract_docx(file_path)
     
     def process_excel(self, file_path: str) -> str:
         """
@@ -123,16 +140,20 @@ class RAGService:
         Returns:
             Texto extraído del Excel (formato CSV-like)
         """
-        try:
-            df = pd.read_excel(file_path, sheet_name=None)  # Lee todas las hojas
-            text = ""
-            for sheet_name, sheet_df in df.items():
-                text += f"\n\n=== Hoja: {sheet_name} ===\n"
-                text += sheet_df.to_string(index=False)
-            return text
-        except Exception as e:
-            logger.error(f"Error procesando Excel {file_path}: {e}")
-            raise
+        return extract_excel(file_path)
+    
+    def process_excel_structured(self, file_path: str, rows_per_chunk: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Extrae un Excel fila a fila (modo estructurado)
+        
+        Args:
+            file_path: Ruta al archivo Excel
+            rows_per_chunk: Filas por chunk (por defecto settings.rag.EXCEL_ROWS_PER_CHUNK)
+            
+        Yields:
+            Chunks {"content", "metadata"} con encabezados y valores de la fila
+        """
+        return iter_excel_records(file_path, rows_per_chunk or settings.rag.EXCEL_ROWS_PER_CHUNK)
     
     def process_txt(self, file_path: str) -> str:
         """
@@ -144,12 +165,7 @@ class RAGService:
         Returns:
             Contenido del archivo
         """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error procesando TXT {file_path}: {e}")
-            raise
+        return extract_txt(file_path)
     
     def process_document(self, file_path: str, file_type: str) -> str:
         """
@@ -176,24 +192,119 @@ class RAGService:
         
         return processor(file_path)
     
-    def chunk_text(self, text: str, chunk_size: int = 512, chunk_overlap: int = 50) -> List[str]:
+    def chunk_text(self, text: str, chunk_size: int = 512, chunk_overlap: int = 50, strategy: str = "recursive") -> List[str]:
         """
         Divide el texto en chunks
         
         Args:
             text: Texto a dividir
-            chunk_size: Tamaño de cada chunk
+            chunk_size: Tamaño de cada chunk (caracteres en recursive, tokens en el resto)
             chunk_overlap: Overlap entre chunks
+            strategy: recursive | tokens | markdown (ver app.services.chunking)
             
         Returns:
             Lista de chunks de texto
         """
-        # Actualizar configuración del splitter
-        self.text_splitter.chunk_size = chunk_size
-        self.text_splitter.chunk_overlap = chunk_overlap
+        # Chunker inmutable compartido: no se modifica estado entre cargas concurrentes
+        return get_chunker(strategy, chunk_size, chunk_overlap).split_text(text)
+    
+    def chunk_records(
+        self,
+        text: str,
+        chunk_size: int = 512,
+        chunk_overlap: int = 50,
+        strategy: str = "recursive"
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Divide el texto en chunks con la metadata de la estrategia
         
-        chunks = self.text_splitter.split_text(text)
-        return chunks
+        Yields:
+            Diccionarios {"content", "metadata"} (markdown agrega la sección)
+        """
+        return get_chunker(strategy, chunk_size, chunk_overlap).split_records(text)
+    
+    def chunk_pages(
+        self,
+        pages: Iterable[Tuple[int, str]],
+        chunk_size: int = 512,
+        chunk_overlap: int = 50,
+        strategy: str = "recursive"
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Divide en chunks un documento paginado a medida que llegan las páginas
+        
+        Cada página se divide por separado para que cada chunk pueda citar
+        la página de la que proviene.
+        
+        Args:
+            pages: Iterable de tuplas (número de página, texto)
+            chunk_size: Tamaño de cada chunk
+            chunk_overlap: Overlap entre chunks
+            strategy: recursive | tokens | markdown
+            
+        Yields:
+            Diccionarios {"content", "metadata": {"page": n}}
+        """
+        chunker = get_chunker(strategy, chunk_size, chunk_overlap)
+        for page_number, page_text in pages:
+            if not page_text.strip():
+                continue
+            for record in chunker.split_records(page_text):
+                yield {"content": record["content"], "metadata": {**record["metadata"], "page": page_number}}
+    
+    def split_children(self, parent_records: Iterable[Dict[str, Any]], parents: List[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Subdivide chunks padre en hijos de PARENT_CHILD_SIZE tokens
+        
+        Args:
+            parent_records: Iterable de {"content", "metadata"} (p.ej. chunk_records)
+            parents: Lista donde se acumulan los textos padre; al terminar
+                se guardan con parent_store.put(document_id, parents)
+            
+        Yields:
+            Chunks hijos con "parent_index" en la metadata
+        """
+        child_chunker = get_chunker("tokens", settings.rag.PARENT_CHILD_SIZE, settings.rag.PARENT_CHILD_OVERLAP)
+        return parent_child_records(parent_records, child_chunker, parents)
+    
+    def build_chunk_metadata(
+        self,
+        system_user_id: int,
+        company_id: int,
+        document_id: int,
+        filename: str,
+        chunk_index: int,
+        total_chunks: Optional[int] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Construye la metadata estándar de un chunk en el vector store
+        
+        Args:
+            system_user_id: ID del usuario (SystemUser)
+            company_id: ID de la empresa
+            document_id: ID del documento
+            filename: Nombre del archivo
+            chunk_index: Índice del chunk en el documento
+            total_chunks: Total de chunks del documento (None si se desconoce, p.ej. en streaming)
+            metadata: Metadata adicional
+            
+        Returns:
+            Diccionario de metadata del chunk
+        """
+        doc_metadata = {
+            "user_id": system_user_id,
+            "company_id": company_id,
+            "document_id": document_id,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "timestamp": datetime.now().isoformat()
+        }
+        if total_chunks is not None:
+            doc_metadata["total_chunks"] = total_chunks
+        if metadata:
+            doc_metadata.update(metadata)
+        return doc_metadata
     
     def add_document_to_vectorstore(
         self,
@@ -222,17 +333,15 @@ class RAGService:
             # Preparar documentos para LangChain
             documents = []
             for i, chunk in enumerate(chunks):
-                doc_metadata = {
-                    "user_id": system_user_id,
-                    "company_id": company_id,
-                    "document_id": document_id,
-                    "filename": filename,
-                    "chunk_index": i,
-                    "total_chunks": len(chunks),
-                    "timestamp": datetime.now().isoformat()
-                }
-                if metadata:
-                    doc_metadata.update(metadata)
+                doc_metadata = self.build_chunk_metadata(
+                    system_user_id=system_user_id,
+                    company_id=company_id,
+                    document_id=document_id,
+                    filename=filename,
+                    chunk_index=i,
+                    total_chunks=len(chunks),
+                    metadata=metadata
+                )
                 
                 documents.append(
                     LangchainDocument(
@@ -242,7 +351,10 @@ class RAGService:
                 )
             
             # Agregar al vector store
+            EMBEDDING_BATCH_SIZE.observe(len(documents))
             ids = self.vector_store.add_documents(documents)
+            self.metadata_index.add(ids, [doc.metadata for doc in documents])
+            self.documents_version += 1
             
             # ChromaDB 0.4.x persiste automáticamente, no necesita persist() manual
             
@@ -253,6 +365,91 @@ class RAGService:
             logger.error(f"Error agregando documento al vector store: {e}")
             raise
     
+    def add_chunk_batch(self, texts: List[str], metadatas: List[Dict[str, Any]]) -> List[str]:
+        """
+        Agrega un lote de chunks (posiblemente de varios documentos) al vector store
+        
+        Los embeddings del lote se calculan en una sola llamada al modelo,
+        lo que aprovecha el batching de sentence-transformers en cargas masivas.
+        
+        Args:
+            texts: Contenido de cada chunk
+            metadatas: Metadata de cada chunk (ver build_chunk_metadata)
+            
+        Returns:
+            Lista de IDs de los chunks en el vector store (mismo orden que texts)
+        """
+        if not texts:
+            return []
+        try:
+            EMBEDDING_BATCH_SIZE.observe(len(texts))
+            ids = self.vector_store.add_texts(texts=texts, metadatas=metadatas)
+            self.metadata_index.add(ids, metadatas)
+            self.documents_version += 1
+            logger.info(f"Agregado lote de {len(texts)} chunks al vector store")
+            return ids
+        except Exception as e:
+            logger.error(f"Error agregando lote al vector store: {e}")
+            raise
+    
+    def add_chunk_stream(
+        self,
+        chunk_records: Iterable[Dict[str, Any]],
+        system_user_id: int,
+        company_id: int,
+        document_id: int,
+        filename: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        batch_size: Optional[int] = None,
+        on_batch: Optional[Callable[[List[str], List[str], List[Dict[str, Any]]], None]] = None
+    ) -> List[str]:
+        """
+        Indexa chunks a medida que se producen, en lotes de embeddings
+        
+        Args:
+            chunk_records: Iterable de {"content", "metadata"} (p.ej. chunk_pages)
+            system_user_id: ID del usuario (SystemUser)
+            company_id: ID de la empresa
+            document_id: ID del documento
+            filename: Nombre del archivo
+            metadata: Metadata común a todos los chunks
+            batch_size: Chunks por lote (por defecto settings.rag.EMBEDDING_BATCH_SIZE)
+            on_batch: Callback (ids, texts, metadatas) tras indexar cada lote,
+                p.ej. para insertar las filas de DocumentChunk
+            
+        Returns:
+            Lista de IDs de los chunks en el vector store
+        """
+        batch_size = batch_size or settings.rag.EMBEDDING_BATCH_SIZE
+
+        def flush(texts: List[str], metadatas: List[Dict[str, Any]]):
+            batch_ids = self.add_chunk_batch(texts, metadatas)
+            if on_batch and batch_ids:
+                on_batch(batch_ids, texts, metadatas)
+            ids.extend(batch_ids)
+
+        ids: List[str] = []
+        texts: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        for i, record in enumerate(chunk_records):
+            chunk_metadata = dict(metadata or {})
+            chunk_metadata.update(record.get("metadata") or {})
+            texts.append(record["content"])
+            metadatas.append(self.build_chunk_metadata(
+                system_user_id=system_user_id,
+                company_id=company_id,
+                document_id=document_id,
+                filename=filename,
+                chunk_index=i,
+                metadata=chunk_metadata
+            ))
+            if len(texts) >= batch_size:
+                flush(texts, metadatas)
+                texts, metadatas = [], []
+        flush(texts, metadatas)
+        logger.info(f"Indexados {len(ids)} chunks del documento {document_id} en streaming")
+        return ids
+    
     def search_similar_chunks(
         self,
         query: str,
@@ -260,17 +457,28 @@ class RAGService:
         company_id: Optional[int] = None,
         top_k: int = 5,
         filter_metadata: Optional[Dict[str, Any]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        rerank: Optional[str] = None,
+        diversity: Optional[str] = None,
         **kwargs
     ) -> List[Dict[str, Any]]:
         """
         Busca chunks similares a una query
 
+        Con reranking o diversificación se recuperan RERANK_CANDIDATES
+        candidatos y se devuelven los top_k mejores según el reranker, sin
+        casi-duplicados (dedup) o balanceando relevancia y diversidad (mmr).
+
         Args:
             query: Query de búsqueda
             user_id: ID del usuario (opcional)
             company_id: ID de la empresa (opcional)
             top_k: Número de resultados a retornar
-            filter_metadata: Filtros adicionales de metadata
+            filter_metadata: Filtros adicionales de metadata (igualdad exacta)
+            filters: Filtros estructurados por rango/igualdad sobre metadata
+                (p.ej. {"price": {"lte": 4000}, "brand": "asus", "stock": {"gt": 0}})
+            rerank: Modo de reranking (off | lexical | cross-encoder); por defecto RAG_RERANK_MODE
+            diversity: Diversificación (off | dedup | mmr); por defecto RAG_DIVERSITY_MODE
             
         Returns:
             Lista de chunks relevantes con metadata
@@ -291,6 +499,32 @@ class RAGService:
                 for k, v in filter_metadata.items():
                     filter_list.append({k: v})
 
+            structured_filters = normalize_filters(filters) if filters else None
+            reranker = get_reranker(rerank or settings.rag.RERANK_MODE)
+            diversity = diversity or settings.rag.DIVERSITY_MODE
+            if diversity not in DIVERSITY_MODES:
+                raise ValueError(f"Modo de diversificación inválido: {diversity!r}")
+            diversify = diversity != "off"
+            # Con parent-document retrieval varios hijos pueden colapsar en la misma sección
+            widen = reranker or diversify or settings.rag.PARENT_RETRIEVAL
+            fetch_k = max(top_k, settings.rag.RERANK_CANDIDATES) if widen else top_k
+            with span("retrieval.embed_query"):
+                query_embedding = self.embeddings.embed_query(query)
+
+            # Filtros selectivos: resolver candidatos con el índice secundario
+            # y rankear solo esos embeddings, sin pasar por el índice HNSW
+            if structured_filters and company_id and not user_id and not filter_metadata:
+                with span("retrieval.metadata_index"):
+                    candidate_ids = self.metadata_index.candidates(company_id, structured_filters)
+                if candidate_ids is not None and len(candidate_ids) <= settings.rag.EXACT_SEARCH_MAX_CANDIDATES:
+                    with span("retrieval.vector_search"):
+                        formatted_results = self._exact_search(query_embedding, list(candidate_ids), fetch_k)
+                    logger.info(f"Encontrados {len(formatted_results)} chunks por índice de metadata ({len(candidate_ids)} candidatos, company_id={company_id})")
+                    return self._select(query, query_embedding, formatted_results, top_k, reranker, diversity)
+
+            if structured_filters:
+                filter_list.extend(build_where_clauses(structured_filters))
+
             final_filter = None
             if len(filter_list) == 1:
                 final_filter = filter_list[0]
@@ -298,28 +532,161 @@ class RAGService:
                 final_filter = {"$and": filter_list}
         
             # Buscar documentos similares
-            results = self.vector_store.similarity_search_with_score(
-                query=query,
-                k=top_k,
-                filter=final_filter
-            )
-            
-            # Formatear resultados
-            formatted_results = []
-            for doc, score in results:
-                formatted_results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "similarity_score": float(score)
-                })
+            with span("retrieval.vector_search"):
+                formatted_results = self._query_collection(
+                    query_embedding, fetch_k, final_filter, with_embeddings=diversify
+                )
             
             logger.info(f"Encontrados {len(formatted_results)} chunks (user_id={user_id}, company_id={company_id})")
-            return formatted_results
+            return self._select(query, query_embedding, formatted_results, top_k, reranker, diversity)
             
         except Exception as e:
             logger.error(f"Error buscando chunks similares: {e}")
             raise
     
+    def _select(
+        self,
+        query: str,
+        query_embedding: List[float],
+        results: List[Dict[str, Any]],
+        top_k: int,
+        reranker=None,
+        diversity: str = "off"
+    ) -> List[Dict[str, Any]]:
+        """
+        Elige los top_k chunks finales entre los candidatos
+        
+        El reranker (si hay) ordena todos los candidatos; luego se quitan
+        casi-duplicados o se aplica MMR usando los embeddings de los candidatos.
+        Los chunks hijos se reducen al mejor de cada sección padre y los
+        elegidos se reemplazan por la sección completa.
+        """
+        if reranker and results:
+            with span("retrieval.rerank"):
+                results = reranker.rerank(query, results, len(results))
+        
+        results = self._collapse_parents(results)
+        
+        if diversity != "off" and len(results) > 1:
+            with span("retrieval.diversify"):
+                embeddings = np.asarray([r["embedding"] for r in results], dtype=np.float32)
+                if diversity == "mmr":
+                    relevance = (
+                        np.asarray([r["rerank_score"] for r in results], dtype=np.float32)
+                        if reranker else None
+                    )
+                    selected = mmr_select(
+                        query_embedding, embeddings, top_k,
+                        lambda_mult=settings.rag.MMR_LAMBDA, relevance=relevance
+                    )
+                else:
+                    selected = remove_near_duplicates(embeddings, top_k, settings.rag.DEDUP_THRESHOLD)
+            results = [results[i] for i in selected]
+        
+        # Los embeddings solo se usan aquí: no viajan al prompt ni a las respuestas
+        return self._expand_parents([
+            {key: value for key, value in result.items() if key != "embedding"}
+            for result in results[:top_k]
+        ])
+    
+    @staticmethod
+    def _parent_key(result: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        metadata = result.get("metadata") or {}
+        if metadata.get("parent_index") is None or metadata.get("document_id") is None:
+            return None
+        return int(metadata["document_id"]), int(metadata["parent_index"])
+    
+    def _collapse_parents(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Conserva solo el mejor hijo de cada sección padre (los resultados ya vienen ordenados)"""
+        seen = set()
+        collapsed = []
+        for result in results:
+            key = self._parent_key(result)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            collapsed.append(result)
+        return collapsed
+    
+    def _expand_parents(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Reemplaza cada chunk hijo por el texto de su sección padre
+        
+        Si la sección no está en el almacén o supera PARENT_MAX_TOKENS se
+        mantiene el chunk hijo.
+        """
+        keys = [key for key in map(self._parent_key, results) if key is not None]
+        if not keys:
+            return results
+        with span("retrieval.parents"):
+            parents = self.parent_store.get_many(keys)
+        for result in results:
+            parent = parents.get(self._parent_key(result))
+            if parent and count_tokens(parent) <= settings.rag.PARENT_MAX_TOKENS:
+                result["matched_content"] = result["content"]
+                result["content"] = parent
+        return results
+    
+    def _query_collection(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        where: Optional[Dict[str, Any]],
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Consulta el índice vectorial de ChromaDB con un embedding ya calculado"""
+        include = ["documents", "metadatas", "distances"]
+        if with_embeddings:
+            include.append("embeddings")
+        with CHROMA_QUERY_DURATION.labels(mode="hnsw").time():
+            result = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                where=where,
+                include=include
+            )
+        formatted = [
+            {
+                "id": chunk_id,
+                "content": content,
+                "metadata": metadata,
+                "similarity_score": float(distance)
+            }
+            for chunk_id, content, metadata, distance in zip(
+                result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+            )
+        ]
+        if with_embeddings:
+            for item, embedding in zip(formatted, result["embeddings"][0]):
+                item["embedding"] = embedding
+        return formatted
+    
+    def _exact_search(self, query_embedding: List[float], ids: List[str], top_k: int) -> List[Dict[str, Any]]:
+        """Ranking exacto (distancia L2² como el índice de Chroma) sobre un conjunto de IDs"""
+        if not ids:
+            return []
+        with CHROMA_QUERY_DURATION.labels(mode="exact").time():
+            page = self.collection.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            # IDs del índice de metadata ya borrados (documento eliminado o GC antes del TTL)
+            return []
+        matrix = np.asarray(page["embeddings"], dtype=np.float32)
+        distances = np.sum((matrix - np.asarray(query_embedding, dtype=np.float32)) ** 2, axis=1)
+        k = min(top_k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return [
+            {
+                "id": page["ids"][i],
+                "content": page["documents"][i],
+                "metadata": page["metadatas"][i],
+                "similarity_score": float(distances[i]),
+                "embedding": matrix[i]
+            }
+            for i in best
+        ]
+    
     def delete_document_from_vectorstore(self, document_id: int) -> bool:
         """
         Elimina todos los chunks de un documento del vector store
@@ -333,6 +700,9 @@ class RAGService:
         try:
             # Eliminar del vector store usando el document_id en la metadata
             self.vector_store.delete(where={"document_id": document_id})
+            self.parent_store.delete(document_id)
+            self.metadata_index.invalidate()
+            self.documents_version += 1
             logger.info(f"✅ Documento {document_id} eliminado del vector store")
             return True
         except Exception as e:
@@ -0,0 +1,207 @@
+"""
+Reranking de chunks recuperados
+Se recuperan N candidatos baratos del vector store y se reordenan con un
+scorer más fino (solapamiento léxico o cross-encoder en CPU) para enviar al
+LLM solo los k mejores
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.single_flight import normalize_query
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODES = ("off", "lexical", "cross-encoder")
+
+# Palabras vacías frecuentes en consultas de clientes (no aportan al ranking)
+STOPWORDS = frozenset((
+    "a", "al", "algo", "con", "de", "del", "el", "en", "es", "hay", "la", "las", "lo", "los",
+    "me", "mi", "para", "por", "que", "quiero", "se", "su", "tiene", "tienen", "un", "una",
+    "y", "o", "hola", "info", "informacion", "cual", "cuales", "como", "cuanto", "esta",
+))
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos normalizados (sin tildes ni puntuación) sin palabras vacías"""
+    return [token for token in normalize_query(text).split() if token not in STOPWORDS]
+
+
+def vector_similarity(distance: float) -> float:
+    """Similitud coseno a partir de la distancia L2² de Chroma (embeddings normalizados)"""
+    return max(0.0, min(1.0, 1.0 - distance / 2.0))
+
+
+class ScoreCache:
+    """Cache LRU de scores por (consulta normalizada, chunk)"""
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+
+    def get_many(self, query_key: str, chunk_ids: List[str]) -> Dict[str, float]:
+        found = {}
+        with self._lock:
+            for chunk_id in chunk_ids:
+                score = self._entries.get((query_key, chunk_id))
+                if score is not None:
+                    self._entries.move_to_end((query_key, chunk_id))
+                    found[chunk_id] = score
+            self.hits += len(found)
+            self.misses += len(chunk_ids) - len(found)
+        return found
+
+    def put_many(self, query_key: str, scores: Dict[str, float]):
+        with self._lock:
+            for chunk_id, score in scores.items():
+                self._entries[(query_key, chunk_id)] = score
+                self._entries.move_to_end((query_key, chunk_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class LexicalReranker:
+    """
+    BM25 sobre el conjunto de candidatos combinado con la similitud vectorial
+
+    No necesita modelo: premia los chunks que contienen los términos de la
+    consulta (modelos, marcas, SKUs) que los embeddings tienden a difuminar.
+    """
+
+    def __init__(self, weight: float = 0.5, k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            weight: Peso del score léxico frente a la similitud vectorial (0-1)
+            k1: Saturación de frecuencia de BM25
+            b: Normalización por longitud de BM25
+        """
+        self.weight = weight
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        terms = set(tokenize(query))
+        documents = [Counter(tokenize(c.get("content", ""))) for c in candidates]
+        if not terms or not documents:
+            return [vector_similarity(c.get("similarity_score", 2.0)) for c in candidates]
+
+        avg_len = sum(sum(doc.values()) for doc in documents) / len(documents) or 1.0
+        doc_freq = {term: sum(1 for doc in documents if term in doc) for term in terms}
+        n_docs = len(documents)
+        bm25 = []
+        for doc in documents:
+            length = sum(doc.values())
+            total = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                total += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+            bm25.append(total)
+
+        top = max(bm25) or 1.0
+        return [
+            self.weight * (lexical / top)
+            + (1 - self.weight) * vector_similarity(candidate.get("similarity_score", 2.0))
+            for lexical, candidate in zip(bm25, candidates)
+        ]
+
+
+class CrossEncoderReranker:
+    """Cross-encoder de sentence-transformers en CPU (carga diferida)"""
+
+    def __init__(self, model_name: str, max_length: int = 512):
+        self.model_name = model_name
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Cargando cross-encoder {self.model_name}...")
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        return self._model
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        model = self._load()
+        pairs = [(query, candidate.get("content", "")) for candidate in candidates]
+        return [float(score) for score in model.predict(pairs, batch_size=32, show_progress_bar=False)]
+
+
+class Reranker:
+    """Reordena candidatos con un scorer y cachea los scores por (consulta, chunk)"""
+
+    def __init__(self, scorer, cache: Optional[ScoreCache] = None):
+        self.scorer = scorer
+        self.cache = cache or ScoreCache()
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """
+        Args:
+            query: Consulta del usuario
+            candidates: Chunks recuperados (con "id", "content" y "similarity_score")
+            top_k: Chunks a conservar
+
+        Returns:
+            Los top_k candidatos por score, con "rerank_score"
+        """
+        if not candidates:
+            return []
+        query_key = ScoreCache.query_key(query)
+        ids = [candidate["id"] for candidate in candidates]
+        scores = self.cache.get_many(query_key, ids)
+        # El scorer léxico depende del conjunto de candidatos (IDF), así que se
+        # recalcula completo si falta alguno; el cross-encoder solo los faltantes
+        missing = [c for c in candidates if c["id"] not in scores]
+        if missing:
+            to_score = candidates if isinstance(self.scorer, LexicalReranker) else missing
+            new_scores = dict(zip((c["id"] for c in to_score), self.scorer.score(query, to_score)))
+            self.cache.put_many(query_key, new_scores)
+            scores.update(new_scores)
+
+        ranked = sorted(candidates, key=lambda c: scores[c["id"]], reverse=True)[:top_k]
+        return [{**candidate, "rerank_score": scores[candidate["id"]]} for candidate in ranked]
+
+
+_rerankers: Dict[str, Reranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(mode: str) -> Optional[Reranker]:
+    """
+    Reranker para el modo indicado (instancia compartida por proceso)
+
+    Args:
+        mode: off | lexical | cross-encoder
+
+    Returns:
+        Reranker o None si el modo es "off"
+    """
+    if mode not in RERANK_MODES:
+        raise ValueError(f"Modo de rerank inválido: {mode!r} (usar {', '.join(RERANK_MODES)})")
+    if mode == "off":
+        return None
+    with _rerankers_lock:
+        if mode not in _rerankers:
+            from app.core.config import settings
+            scorer = (
+                CrossEncoderReranker(settings.rag.RERANK_MODEL) if mode == "cross-encoder"
+                else LexicalReranker(weight=settings.rag.RERANK_LEXICAL_WEIGHT)
+            )
+            _rerankers[mode] = Reranker(scorer, ScoreCache(settings.rag.RERANK_CACHE_SIZE))
+        return _rerankers[mode]
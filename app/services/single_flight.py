@@ -0,0 +1,124 @@
+"""
+Deduplicación de solicitudes idénticas en curso (single-flight)
+Si llega una solicitud con la misma clave que otra que todavía se está
+procesando, espera el resultado de la primera en lugar de repetir la
+recuperación y la generación
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from app.services.metrics import COALESCED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza una consulta para comparar mensajes equivalentes
+
+    Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados:
+    "Hola, ¿info del precio?" y "hola info del precio" producen la misma clave.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def _filters_key(filters: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(filters, sort_keys=True, default=str) if filters else ""
+
+
+def retrieval_key(company_id: int, query: str, filters: Optional[Dict[str, Any]], documents_version: int) -> Tuple:
+    """Clave de deduplicación de una búsqueda en el vector store"""
+    return (company_id, normalize_query(query), _filters_key(filters), documents_version)
+
+
+def request_key(
+    company_id: int,
+    query: str,
+    system_prompt: Optional[str],
+    filters: Optional[Dict[str, Any]],
+    documents_version: int,
+    model: str
+) -> Tuple:
+    """
+    Clave de deduplicación de un turno sin historial
+
+    Incluye todo lo que puede cambiar la respuesta: empresa, consulta
+    normalizada, configuración del prompt, filtros, versión del conjunto de
+    documentos y modelo.
+    """
+    prompt_hash = hashlib.sha1((system_prompt or "").encode("utf-8")).hexdigest()
+    return retrieval_key(company_id, query, filters, documents_version) + (prompt_hash, model)
+
+
+class SingleFlight:
+    """
+    Comparte el resultado de una corrutina entre llamadas concurrentes con la misma clave
+
+    Solo deduplica mientras la primera llamada está en curso; no guarda
+    resultados. El estado vive en el event loop, sin locks.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self) -> int:
+        """Claves con una llamada en curso"""
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Ejecuta func() o se une a la ejecución en curso con la misma clave
+
+        Args:
+            key: Clave de deduplicación
+            func: Corrutina sin argumentos que produce el resultado
+
+        Returns:
+            Tupla (resultado, compartido) donde compartido indica que el
+            resultado vino de otra solicitud
+        """
+        while True:
+            leader = self._in_flight.get(key)
+            if leader is None:
+                break
+            try:
+                result = await asyncio.shield(leader)
+                COALESCED_REQUESTS.labels(role="follower").inc()
+                return result, True
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # La solicitud líder se canceló (cliente desconectado): reintentar
+
+        future = asyncio.get_running_loop().create_future()
+        # Evita el aviso "exception was never retrieved" si nadie más esperaba
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        COALESCED_REQUESTS.labels(role="leader").inc()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._in_flight.pop(key, None)
+
+
+# Instancias globales: búsquedas y generaciones de simulate_message
+retrieval_coalescer = SingleFlight()
+request_coalescer = SingleFlight()
@@ -0,0 +1,273 @@
+"""
+Trazas por request con desglose de latencia por etapa
+Los spans se registran con un contextvar (sin pasar objetos entre capas) y
+las trazas terminadas se escriben por lotes en rag_usage_stats desde un
+hilo en segundo plano
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Traza de un request: spans por etapa y resultado final"""
+
+    def __init__(self, name: str, query: str = "", system_user_id: Optional[int] = None):
+        """
+        Args:
+            name: Nombre de la operación (p.ej. simulate_message)
+            query: Texto de la consulta del usuario
+            system_user_id: Usuario al que se atribuye la traza
+        """
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.query = query
+        self.system_user_id = system_user_id
+        self.conversation_id: Optional[int] = None
+        self.model_used: Optional[str] = None
+        self.retrieved_chunks_count = 0
+        self.success = True
+        self.error_message: Optional[str] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self.total_ms: Optional[float] = None
+
+    def add_span(self, name: str, duration_ms: float, start_ms: Optional[float] = None):
+        """
+        Registra un span ya medido
+
+        Args:
+            name: Nombre de la etapa
+            duration_ms: Duración en milisegundos
+            start_ms: Inicio relativo al comienzo de la traza (por defecto: ahora - duración)
+        """
+        if start_ms is None:
+            start_ms = (time.perf_counter() - self._start) * 1000 - duration_ms
+        # list.append es atómico: seguro desde hilos de asyncio.to_thread
+        self.spans.append({
+            "name": name,
+            "start_ms": round(start_ms, 2),
+            "duration_ms": round(duration_ms, 2)
+        })
+
+    @contextmanager
+    def span(self, name: str):
+        """Mide el bloque como un span de esta traza"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.add_span(name, (end - start) * 1000, (start - self._start) * 1000)
+
+    def fail(self, error: Any):
+        """Marca la traza como fallida"""
+        self.success = False
+        self.error_message = str(error)
+
+    def finish(self) -> float:
+        """Cierra la traza y retorna la duración total en milisegundos"""
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self._start) * 1000
+        return self.total_ms
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """Traza activa en el contexto actual (None fuera de un request trazado)"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """Mide el bloque como span de la traza activa (no-op si no hay traza)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def record_span(name: str, duration_ms: float):
+    """Registra en la traza activa un span medido externamente (p.ej. reportado por Ollama)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, duration_ms)
+
+
+@contextmanager
+def trace_request(name: str, query: str = "", system_user_id: Optional[int] = None):
+    """
+    Abre una traza para el request actual y la envía al recorder al terminar
+
+    Args:
+        name: Nombre de la operación
+        query: Texto de la consulta
+        system_user_id: Usuario al que se atribuye la traza
+
+    Yields:
+        La traza activa
+    """
+    trace = RequestTrace(name, query=query, system_user_id=system_user_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.fail(e)
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        trace_recorder.submit(trace)
+
+
+class TraceRecorder:
+    """Escribe trazas terminadas en rag_usage_stats por lotes, en un hilo aparte"""
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 2.0, max_queue: int = 10000):
+        """
+        Args:
+            batch_size: Trazas por inserción
+            flush_interval: Segundos máximos entre escrituras
+            max_queue: Trazas en cola antes de empezar a descartar
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[RequestTrace]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.dropped = 0
+
+    def start(self):
+        """Inicia el hilo escritor"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo escritor y vacía la cola"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        batch = self._drain()
+        while batch:
+            self._flush(batch)
+            batch = self._drain()
+
+    def submit(self, trace: RequestTrace):
+        """Encola una traza terminada (nunca bloquea el request)"""
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> List[RequestTrace]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stop.is_set():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[RequestTrace]):
+        if not batch:
+            return
+        from sqlalchemy import insert
+        from app.database.connection import session_scope
+        from app.models.rag_models import RAGUsageStats
+
+        rows = [
+            {
+                "system_user_id": trace.system_user_id,
+                "conversation_id": trace.conversation_id,
+                "query": trace.query,
+                "retrieved_chunks_count": trace.retrieved_chunks_count,
+                "response_time_ms": int(trace.total_ms or 0),
+                "model_used": trace.model_used,
+                "success": trace.success,
+                "error_message": trace.error_message,
+                "stage_timings": trace.spans,
+            }
+            for trace in batch
+            if trace.system_user_id is not None
+        ]
+        if not rows:
+            return
+        try:
+            with session_scope() as session:
+                session.execute(insert(RAGUsageStats), rows)
+        except Exception as e:
+            logger.error(f"Error guardando {len(rows)} trazas en rag_usage_stats: {e}")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por interpolación lineal sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize_latencies(records: Iterable[Dict[str, Any]], percentiles=(50, 90, 95, 99)) -> Dict[str, Any]:
+    """
+    Resume latencias por etapa a partir de filas de rag_usage_stats
+
+    Args:
+        records: Diccionarios con response_time_ms, success y stage_timings
+        percentiles: Percentiles a calcular
+
+    Returns:
+        {"requests", "errors", "stages": {etapa: {"count", "p50", ...}}}
+    """
+    stages: Dict[str, List[float]] = {"total": []}
+    requests = 0
+    errors = 0
+    for record in records:
+        requests += 1
+        if not record.get("success", True):
+            errors += 1
+        if record.get("response_time_ms") is not None:
+            stages["total"].append(float(record["response_time_ms"]))
+        for stage in record.get("stage_timings") or []:
+            stages.setdefault(stage["name"], []).append(float(stage["duration_ms"]))
+
+    summary = {}
+    for name, values in stages.items():
+        values.sort()
+        summary[name] = {"count": len(values)}
+        for pct in percentiles:
+            summary[name][f"p{pct}"] = round(percentile(values, pct), 2)
+    return {"requests": requests, "errors": errors, "stages": summary}
+
+
+# Instancia global del recorder de trazas
+trace_recorder = TraceRecorder()
@@ -0,0 +1,129 @@
+"""
+Exportación de conversaciones como datos de entrenamiento (JSONL)
+Una sola consulta con join recorrida con cursor del lado del servidor
+(yield_per): las conversaciones se arman y codifican de a una, así que la
+memoria no crece con el número de mensajes exportados
+"""
+
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.current import Client, Conversation, Message
+
+DEFAULT_TRAINING_SYSTEM_PROMPT = (
+    "Eres un asesor de ventas experto de TechStore Perú, especializado en productos tecnológicos."
+)
+
+# Roles válidos en el formato de chat (OpenAI compatible)
+TRAINING_ROLES = ("user", "assistant")
+
+
+def iter_training_examples(
+    session: Session,
+    company_id: int,
+    system_prompt: Optional[str] = None,
+    min_messages: int = 2,
+    batch_size: int = 1000
+) -> Iterator[Dict[str, Any]]:
+    """
+    Recorre las conversaciones de una empresa en formato de chat
+
+    Args:
+        session: Sesión síncrona (la conexión queda tomada mientras se itera)
+        company_id: Empresa cuyas conversaciones se exportan
+        system_prompt: Mensaje de sistema de cada ejemplo
+        min_messages: Mínimo de mensajes user/assistant para incluir una conversación
+        batch_size: Filas que se traen del servidor por lote
+
+    Yields:
+        {"messages": [{"role": ..., "content": ...}, ...]} por conversación
+    """
+    system_message = {"role": "system", "content": system_prompt or DEFAULT_TRAINING_SYSTEM_PROMPT}
+    stmt = (
+        select(Message.conversation_id, Message.role, Message.content)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .join(Client, Client.id == Conversation.client_id)
+        .where(Client.company_id == company_id, Message.role.in_(TRAINING_ROLES))
+        .order_by(Message.conversation_id, Message.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    current_id = None
+    messages = []
+    for conversation_id, role, content in session.execute(stmt):
+        if conversation_id != current_id:
+            if len(messages) >= min_messages:
+                yield {"messages": [system_message] + messages}
+            current_id = conversation_id
+            messages = []
+        if content:
+            messages.append({"role": role, "content": content})
+    if len(messages) >= min_messages:
+        yield {"messages": [system_message] + messages}
+
+
+def iter_jsonl(examples: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Codifica cada ejemplo como una línea JSONL (UTF-8)"""
+    for example in examples:
+        yield (json.dumps(example, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6, flush_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Comprime un flujo de bytes en formato gzip sin acumularlo
+
+    Args:
+        chunks: Bytes de entrada
+        level: Nivel de compresión (1-9)
+        flush_bytes: Bytes de entrada acumulados antes de emitir un bloque
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = 0
+    for chunk in chunks:
+        pending += len(chunk)
+        data = compressor.compress(chunk)
+        if pending >= flush_bytes:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_training_data(
+    company_id: int,
+    system_prompt: Optional[str] = None,
+    min_messages: int = 2,
+    compress: bool = False,
+    stats: Optional[Dict[str, int]] = None
+) -> Iterator[bytes]:
+    """
+    Flujo JSONL (opcionalmente gzip) con su propia sesión
+
+    La sesión se abre al empezar a iterar y se cierra al terminar o si el
+    cliente corta la descarga, así que sirve directo a un StreamingResponse.
+
+    Args:
+        stats: Diccionario opcional donde se acumulan "conversations" y "bytes"
+    """
+    from app.database.connection import SessionLocal
+
+    session = SessionLocal()
+    try:
+        def counted(examples):
+            for example in examples:
+                if stats is not None:
+                    stats["conversations"] = stats.get("conversations", 0) + 1
+                yield example
+
+        lines = iter_jsonl(counted(iter_training_examples(session, company_id, system_prompt, min_messages)))
+        for chunk in (iter_gzip(lines) if compress else lines):
+            if stats is not None:
+                stats["bytes"] = stats.get("bytes", 0) + len(chunk)
+            yield chunk
+    finally:
+        session.close()
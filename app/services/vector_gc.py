@@ -0,0 +1,315 @@
+"""
+Recolector de vectores huérfanos
+Reconcilia la colección de Chroma con UserDocument y DocumentChunk: borra
+por lotes los chunks cuyo document_id ya no existe (y sus secciones padre)
+y mide la latencia de consulta antes y después.
+
+La reconciliación periódica corre en un solo proceso (lock de archivo en el
+directorio de Chroma) aunque haya varios workers de uvicorn. La compactación
+(VACUUM del SQLite de Chroma) solo se hace desde reconciliar_vectores.py
+con la aplicación detenida: otros clientes de Chroma con conexiones abiertas
+o escribiendo provocarían "database is locked".
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.models.rag_models import DocumentChunk, UserDocument
+from app.services.metrics import VECTOR_GC_DELETED
+
+logger = logging.getLogger(__name__)
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _try_lock_file(path: str):
+    """Lock exclusivo no bloqueante entre procesos; devuelve el archivo abierto o None"""
+    handle = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+    except OSError:
+        handle.close()
+        return None
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class VectorGarbageCollector:
+    """Borra del vector store los chunks de documentos que ya no existen"""
+
+    def __init__(
+        self,
+        rag_service,
+        interval: int = 86400,
+        batch_size: int = 1000,
+        page_size: int = 5000,
+        probe_queries: int = 20,
+        grace_seconds: int = 3600
+    ):
+        """
+        Args:
+            rag_service: Servicio RAG (colección, índice de metadata y versión de documentos)
+            interval: Segundos entre ejecuciones programadas (0 = solo bajo demanda)
+            batch_size: IDs por llamada de borrado a Chroma
+            page_size: IDs leídos por página al recorrer la colección
+            probe_queries: Consultas para medir la latencia antes y después
+            grace_seconds: Antigüedad mínima de un chunk para considerarlo
+                huérfano (una carga en curso indexa antes de confirmar el documento)
+        """
+        self.rag_service = rag_service
+        self.interval = interval
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.probe_queries = probe_queries
+        self.grace_seconds = grace_seconds
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process_lock = None
+
+    # ------------------------------------------------------------------
+    # Reconciliación
+    # ------------------------------------------------------------------
+
+    def _scan_collection(self, valid_documents: Set[int]):
+        """Recorre la colección por páginas y separa los IDs huérfanos"""
+        collection = self.rag_service.collection
+        scanned = 0
+        orphans: List[str] = []
+        vector_ids: Set[str] = set()
+        offset = 0
+        cutoff = (datetime.now() - timedelta(seconds=self.grace_seconds)).isoformat()
+        while True:
+            page = collection.get(include=["metadatas"], limit=self.page_size, offset=offset)
+            ids = page["ids"]
+            if not ids:
+                break
+            for chunk_id, metadata in zip(ids, page["metadatas"]):
+                vector_ids.add(chunk_id)
+                metadata = metadata or {}
+                document_id = metadata.get("document_id")
+                if document_id is not None and int(document_id) in valid_documents:
+                    continue
+                if metadata.get("timestamp", "") > cutoff:
+                    continue
+                orphans.append(chunk_id)
+            scanned += len(ids)
+            offset += len(ids)
+        return scanned, orphans, vector_ids
+
+    def _probe_latency(self) -> Dict[str, float]:
+        """Latencia de consultas con embeddings de la propia colección"""
+        collection = self.rag_service.collection
+        count = collection.count()
+        if not count or not self.probe_queries:
+            return {"p50_ms": 0.0, "p95_ms": 0.0}
+        offset = random.randint(0, max(0, count - self.probe_queries))
+        sample = collection.get(include=["embeddings"], limit=self.probe_queries, offset=offset)
+        timings = []
+        for embedding in sample["embeddings"] or []:
+            start = time.perf_counter()
+            collection.query(query_embeddings=[embedding], n_results=min(5, count), include=["distances"])
+            timings.append((time.perf_counter() - start) * 1000)
+        return {"p50_ms": round(_percentile(timings, 0.5), 2), "p95_ms": round(_percentile(timings, 0.95), 2)}
+
+    def _compact(self) -> Optional[str]:
+        """
+        VACUUM del SQLite de Chroma para devolver al disco las páginas liberadas
+
+        Chroma 0.4 no reconstruye el índice HNSW al borrar (los vectores
+        quedan marcados como eliminados y se reaprovechan en altas
+        posteriores); el espacio recuperable está en el SQLite. Requiere que
+        ningún otro proceso tenga Chroma abierto (ver reconciliar_vectores.py).
+
+        Returns:
+            Mensaje de error o None si se compactó
+        """
+        sqlite_path = os.path.join(self.rag_service.persist_directory, "chroma.sqlite3")
+        if not os.path.exists(sqlite_path):
+            return "chroma.sqlite3 no encontrado"
+        try:
+            conn = sqlite3.connect(sqlite_path, timeout=30)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+            return None
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudo compactar ChromaDB: {e}")
+            return str(e)
+
+    def _orphan_parents(self, valid_documents: Set[int]) -> List[int]:
+        """Documentos con secciones padre guardadas que ya no existen (respetando la gracia)"""
+        store = self.rag_service.parent_store
+        cutoff = time.time() - self.grace_seconds
+        orphans = []
+        for document_id in store.document_ids() - valid_documents:
+            try:
+                if os.path.getmtime(os.path.join(store.directory, f"{document_id}.idx")) < cutoff:
+                    orphans.append(document_id)
+            except OSError:
+                pass
+        return orphans
+
+    def run(self, session_factory, dry_run: bool = False, compact: bool = False) -> Dict[str, Any]:
+        """
+        Ejecuta una reconciliación completa
+
+        Args:
+            session_factory: Callable que devuelve una sesión síncrona
+            dry_run: Solo reportar, sin borrar ni compactar
+            compact: Compactar el SQLite de Chroma al terminar (solo sin la
+                aplicación en marcha)
+
+        Returns:
+            Reporte con chunks revisados, huérfanos, borrados, espacio
+            recuperado y latencia de consulta antes/después
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return {"ok": False, "detail": "Ya hay una reconciliación en curso"}
+        started = time.time()
+        try:
+            session = session_factory()
+            try:
+                valid_documents = set(session.scalars(select(UserDocument.id)).all())
+                chunk_rows = session.execute(
+                    select(DocumentChunk.id, DocumentChunk.embedding_id).where(DocumentChunk.embedding_id.isnot(None))
+                ).all()
+            finally:
+                session.close()
+
+            bytes_before = _directory_size(self.rag_service.persist_directory)
+            latency_before = self._probe_latency()
+            scanned, orphans, vector_ids = self._scan_collection(valid_documents)
+            orphan_parents = self._orphan_parents(valid_documents)
+            # Filas de DocumentChunk que apuntan a vectores inexistentes
+            missing_vectors = sum(1 for _, embedding_id in chunk_rows if embedding_id not in vector_ids)
+
+            deleted = 0
+            compact_error = None
+            if orphans and not dry_run:
+                collection = self.rag_service.collection
+                for start in range(0, len(orphans), self.batch_size):
+                    batch = orphans[start:start + self.batch_size]
+                    collection.delete(ids=batch)
+                    deleted += len(batch)
+                    VECTOR_GC_DELETED.inc(len(batch))
+                self.rag_service.metadata_index.invalidate()
+                self.rag_service.documents_version += 1
+            if compact and not dry_run:
+                compact_error = self._compact()
+            if not dry_run:
+                for document_id in orphan_parents:
+                    self.rag_service.parent_store.delete(document_id)
+
+            bytes_after = _directory_size(self.rag_service.persist_directory)
+            report = {
+                "ok": True,
+                "dry_run": dry_run,
+                "scanned": scanned,
+                "orphans": len(orphans),
+                "deleted": deleted,
+                "missing_vectors": missing_vectors,
+                "orphan_parents": len(orphan_parents),
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+                "reclaimed_bytes": max(0, bytes_before - bytes_after),
+                "compacted": compact and not dry_run and compact_error is None,
+                "compact_error": compact_error,
+                "latency_before": latency_before,
+                "latency_after": self._probe_latency() if deleted else latency_before,
+                "duration_s": round(time.time() - started, 2),
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self.last_report = report
+            logger.info(
+                f"GC de vectores: {scanned} revisados, {len(orphans)} huérfanos, {deleted} borrados, "
+                f"{report['reclaimed_bytes'] / 1024 / 1024:.1f} MB recuperados"
+            )
+            return report
+        finally:
+            self._run_lock.release()
+
+    # ------------------------------------------------------------------
+    # Ejecución programada
+    # ------------------------------------------------------------------
+
+    def start(self, session_factory):
+        """
+        Inicia la reconciliación periódica (si interval > 0)
+
+        Solo el primer proceso que toma el lock de archivo la ejecuta; en los
+        demás workers no se inicia el hilo.
+        """
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        if self._process_lock is None:
+            lock_path = os.path.join(self.rag_service.persist_directory, "vector_gc.lock")
+            self._process_lock = _try_lock_file(lock_path)
+            if self._process_lock is None:
+                logger.info("GC de vectores periódico activo en otro proceso")
+                return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory,), name="vector-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene la reconciliación periódica"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _run(self, session_factory):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run(session_factory)
+            except Exception as e:
+                logger.error(f"Error en GC de vectores: {e}")
+
+
+def _create_vector_gc() -> VectorGarbageCollector:
+    from app.core.config import settings
+    from app.services.rag_service import rag_service
+
+    return VectorGarbageCollector(
+        rag_service,
+        interval=settings.rag.VECTOR_GC_INTERVAL,
+        batch_size=settings.rag.VECTOR_GC_BATCH_SIZE
+    )
+
+
+# Instancia global
+vector_gc = _create_vector_gc()
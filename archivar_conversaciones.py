@@ -0,0 +1,62 @@
+"""
+Archivado de conversaciones antiguas a Parquet
+Mueve las conversaciones inactivas (o cerradas) y sus mensajes a
+archive/company_id=<id>/month=<YYYY-MM>/*.parquet y las borra de MySQL en
+lotes cortos. Pensado para ejecutarse periódicamente (cron)
+
+Uso:
+    python archivar_conversaciones.py --dry-run
+    python archivar_conversaciones.py --days 180 --closed-days 7 --company-id 2
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import time
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Archivar conversaciones antiguas a Parquet")
+    parser.add_argument("--days", type=int, default=settings.archive.AFTER_DAYS, help="Días sin actividad para archivar")
+    parser.add_argument("--closed-days", type=int, default=settings.archive.CLOSED_AFTER_DAYS, help="Días sin actividad para archivar conversaciones cerradas")
+    parser.add_argument("--statuses", default=settings.archive.CLOSED_STATUSES, help="Estados considerados cerrados (separados por coma)")
+    parser.add_argument("--company-id", type=int, default=None, help="Limitar a una empresa")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de conversaciones a archivar")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar las conversaciones candidatas")
+    args = parser.parse_args()
+
+    from app.database.connection import SessionLocal
+    from app.services.archive_service import archive_service
+
+    estados = [estado.strip() for estado in args.statuses.split(",") if estado.strip()]
+    inicio = time.time()
+
+    def reportar(stats):
+        print(f"   ... {stats['conversations']} conversaciones, {stats['messages']} mensajes, {stats['files']} archivos")
+
+    print(f"📦 Archivando conversaciones en {archive_service.base_dir} "
+          f"(inactivas {args.days} días, cerradas {args.closed_days} días)")
+    session = SessionLocal()
+    try:
+        stats = archive_service.archive(
+            session,
+            older_than_days=args.days,
+            closed_after_days=args.closed_days,
+            closed_statuses=estados,
+            company_id=args.company_id,
+            limit=args.limit,
+            dry_run=args.dry_run,
+            progress=reportar
+        )
+    finally:
+        session.close()
+
+    if args.dry_run:
+        print(f"ℹ️  {stats['conversations']} conversaciones serían archivadas")
+    else:
+        print(f"✅ {stats['conversations']} conversaciones archivadas "
+              f"({stats['messages']} mensajes, {stats['files']} archivos) en {time.time() - inicio:.1f}s")
@@ -0,0 +1,406 @@
+"""
+Script de carga masiva de documentos RAG desde una carpeta
+Procesa PDF/DOCX/XLSX/TXT/MD en paralelo, descarta duplicados por hash,
+inserta UserDocument/DocumentChunk en bloque y guarda un checkpoint reanudable
+
+Uso:
+    python cargar_documentos.py /ruta/a/carpeta --workers 4 --batch-size 256
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import multiprocessing
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from app.services.document_extractors import (
+    SUPPORTED_EXTENSIONS, extract_products, extract_text, file_sha256, iter_pdf_pages, iter_excel_records, products_from_rows,
+    with_product_metadata
+)
+
+UPLOAD_DIR = Path("uploads/documents")
+DEFAULT_CHECKPOINT = ".carga_documentos.checkpoint.json"
+
+
+# ============================================================================
+# WORKER (se ejecuta en procesos separados: no importa BD ni vector store)
+# ============================================================================
+
+def _procesar_archivo(file_path: str, chunk_size: int, chunk_overlap: int, excel_rows_per_chunk: int = 0, strategy: str = "auto", parent_child: tuple = None) -> dict:
+    """
+    Extrae texto, calcula hash y divide en chunks un archivo
+
+    Con parent_child=(tamaño, overlap) los chunks se subdividen en hijos y
+    los textos padre se devuelven en "parents"
+    """
+    from app.services.chunking import get_chunker, parent_child_records
+
+    ext = file_path.rsplit(".", 1)[-1].lower()
+    try:
+        file_hash = file_sha256(file_path)
+        chunker = get_chunker(strategy, chunk_size, chunk_overlap, file_type=ext)
+        chunks, chunk_metadata, parents, products = [], [], [], []
+        if ext == "xlsx" and excel_rows_per_chunk:
+            # Excel estructurado: un chunk por fila (o grupo) con sus valores como metadata
+            for record in iter_excel_records(file_path, excel_rows_per_chunk):
+                chunks.append(record["content"])
+                chunk_metadata.append({**record["metadata"], "structured": True})
+            products = products_from_rows(chunk_metadata)
+        else:
+            if ext == "pdf":
+                # Chunks por página para poder citar la página de origen
+                records = (
+                    {"content": record["content"], "metadata": {**record["metadata"], "page": page_number}}
+                    for page_number, page_text in iter_pdf_pages(file_path)
+                    for record in chunker.split_records(page_text)
+                )
+            else:
+                text = extract_text(file_path, ext)
+                products = extract_products(text)
+                records = with_product_metadata(chunker.split_records(text), products)
+            if parent_child:
+                records = parent_child_records(records, get_chunker("tokens", *parent_child), parents)
+            for record in records:
+                chunks.append(record["content"])
+                chunk_metadata.append(record["metadata"])
+        return {
+            "path": file_path,
+            "ext": ext,
+            "hash": file_hash,
+            "chunks": chunks,
+            "chunk_metadata": chunk_metadata,
+            "parents": parents,
+            "products": products,
+            "error": None,
+        }
+    except Exception as e:
+        return {"path": file_path, "ext": ext, "hash": None, "chunks": [], "chunk_metadata": [], "parents": [], "products": [], "error": str(e)}
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+def _clave_archivo(path: Path) -> str:
+    """Clave barata (ruta + tamaño + mtime) para saltar archivos ya cargados"""
+    stat = path.stat()
+    return f"{path.resolve()}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def cargar_checkpoint(checkpoint_path: str) -> dict:
+    """Lee el checkpoint de una ejecución anterior (si existe)"""
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"files": {}, "hashes": {}}
+
+
+def guardar_checkpoint(checkpoint_path: str, checkpoint: dict):
+    """Escribe el checkpoint de forma atómica (archivo temporal + rename)"""
+    checkpoint["updated_at"] = datetime.now().isoformat()
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def listar_archivos(directorio: str) -> list:
+    """Recorre la carpeta y retorna los archivos con extensión soportada"""
+    archivos = []
+    for root, _dirs, files in os.walk(directorio):
+        for name in sorted(files):
+            if name.rsplit(".", 1)[-1].lower() in SUPPORTED_EXTENSIONS:
+                archivos.append(Path(root) / name)
+    return archivos
+
+
+# ============================================================================
+# CARGA
+# ============================================================================
+
+class CargadorDocumentos:
+    """Acumula documentos procesados y los persiste por lotes"""
+
+    def __init__(self, session, rag_service, company_id: int, user_id: int, batch_size: int, checkpoint_path: str, checkpoint: dict):
+        self.session = session
+        self.rag_service = rag_service
+        self.company_id = company_id
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = checkpoint
+        self.pendientes = []
+        self.chunks_pendientes = 0
+        self.total_documentos = 0
+        self.total_chunks = 0
+        self.total_productos = 0
+        self.documentos_fallidos = 0
+        self.lotes = 0
+
+    def agregar(self, resultado: dict, clave: str):
+        """Encola un archivo procesado; persiste cuando el lote está lleno"""
+        resultado["clave"] = clave
+        self.pendientes.append(resultado)
+        self.chunks_pendientes += len(resultado["chunks"])
+        if self.chunks_pendientes >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Persiste los documentos encolados: BD, vector store y checkpoint"""
+        if not self.pendientes:
+            return
+
+        from sqlalchemy import insert
+        from app.models.rag_models import UserDocument, DocumentChunk, FileType
+        from app.services.chunk_store import content_hash, count_tokens
+        from app.services.product_catalog import replace_document_products
+
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.lotes += 1
+
+        # Lo escrito fuera de la transacción, para deshacerlo si el lote falla
+        copiados, ids_vector, con_padres = [], [], []
+        try:
+            # 1. Registrar documentos (un flush para obtener todos los IDs)
+            documentos = []
+            for item in self.pendientes:
+                origen = Path(item["path"])
+                destino = UPLOAD_DIR / f"{timestamp}_{item['hash'][:8]}_{origen.name}"
+                shutil.copy2(origen, destino)
+                copiados.append(destino)
+                documentos.append(UserDocument(
+                    system_user_id=self.user_id,
+                    company_id=self.company_id,
+                    filename=origen.name,
+                    file_type=FileType(item["ext"]),
+                    file_path=str(destino),
+                    file_size=destino.stat().st_size,
+                    processed=False,
+                    doc_metadata={"file_hash": item["hash"], "source_path": str(origen)}
+                ))
+            self.session.add_all(documentos)
+            self.session.flush()
+
+            # 2. Preparar chunks de todos los documentos del lote
+            texts, metadatas, filas = [], [], []
+            for doc, item in zip(documentos, self.pendientes):
+                total = len(item["chunks"])
+                for i, (chunk, extra) in enumerate(zip(item["chunks"], item["chunk_metadata"])):
+                    texts.append(chunk)
+                    metadatas.append(self.rag_service.build_chunk_metadata(
+                        system_user_id=self.user_id,
+                        company_id=self.company_id,
+                        document_id=doc.id,
+                        filename=doc.filename,
+                        chunk_index=i,
+                        total_chunks=total,
+                        metadata={"file_type": item["ext"], **extra}
+                    ))
+                    filas.append({
+                        "document_id": doc.id,
+                        "chunk_index": i,
+                        "content": chunk,
+                        "token_count": count_tokens(chunk),
+                        "content_hash": content_hash(chunk),
+                        "chunk_metadata": extra or None
+                    })
+
+            # 3. Embeddings + vector store en sub-lotes de batch_size
+            for start in range(0, len(texts), self.batch_size):
+                end = start + self.batch_size
+                ids = self.rag_service.add_chunk_batch(texts[start:end], metadatas[start:end])
+                ids_vector.extend(ids)
+                for fila, embedding_id in zip(filas[start:end], ids):
+                    fila["embedding_id"] = embedding_id
+
+            # 4. Inserción masiva de DocumentChunk (executemany)
+            if filas:
+                self.session.execute(insert(DocumentChunk), filas)
+
+            # 5. Secciones padre (parent-document retrieval) y productos del catálogo
+            for doc, item in zip(documentos, self.pendientes):
+                if item["parents"]:
+                    con_padres.append(doc.id)
+                    self.rag_service.parent_store.put(doc.id, item["parents"])
+                if item["products"]:
+                    replace_document_products(self.session, self.company_id, doc.id, item["products"])
+                    self.total_productos += len(item["products"])
+
+            for doc, item in zip(documentos, self.pendientes):
+                doc.processed = True
+                doc.chunk_count = len(item["chunks"])
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            self._deshacer_lote(copiados, ids_vector, con_padres)
+            print(f"❌ Lote {self.lotes} descartado ({len(self.pendientes)} archivos): {e}")
+            for item in self.pendientes:
+                print(f"   - {item['path']}")
+            self.documentos_fallidos += len(self.pendientes)
+            self.pendientes = []
+            self.chunks_pendientes = 0
+            return
+
+        # 6. Checkpoint alineado con el commit
+        for doc, item in zip(documentos, self.pendientes):
+            self.checkpoint["files"][item["clave"]] = doc.id
+            self.checkpoint["hashes"][item["hash"]] = doc.id
+        guardar_checkpoint(self.checkpoint_path, self.checkpoint)
+
+        self.total_documentos += len(documentos)
+        self.total_chunks += len(filas)
+        self.pendientes = []
+        self.chunks_pendientes = 0
+
+    def _deshacer_lote(self, copiados: list, ids_vector: list, con_padres: list):
+        """Borra los vectores, secciones padre y archivos copiados de un lote fallido"""
+        try:
+            if ids_vector:
+                self.rag_service.collection.delete(ids=ids_vector)
+                self.rag_service.metadata_index.invalidate()
+                self.rag_service.documents_version += 1
+            for document_id in con_padres:
+                self.rag_service.parent_store.delete(document_id)
+        except Exception as e:
+            print(f"⚠️ No se pudieron borrar {len(ids_vector)} vectores del lote (los purgará el GC de vectores): {e}")
+        for destino in copiados:
+            destino.unlink(missing_ok=True)
+
+
+def cargar_directorio(directorio: str, company_id: int, user_id: int, workers: int, batch_size: int, checkpoint_path: str, strategy: str = None):
+    """Carga todos los documentos soportados de una carpeta"""
+    from app.core.config import settings
+    from app.database.connection import SessionLocal
+    from app.models.rag_models import UserDocument, UserRAGConfig
+    from app.services.rag_service import rag_service
+
+    inicio = time.perf_counter()
+    checkpoint = cargar_checkpoint(checkpoint_path)
+    archivos = listar_archivos(directorio)
+    print(f"📂 {len(archivos)} archivos soportados en {directorio}")
+
+    session = SessionLocal()
+    try:
+        config = session.query(UserRAGConfig).filter(
+            UserRAGConfig.company_id == company_id
+        ).first()
+        chunk_size = config.chunk_size if config else 512
+        chunk_overlap = config.chunk_overlap if config else 50
+        strategy = strategy or (config.chunk_strategy if config else None) or settings.rag.CHUNK_STRATEGY
+        excel_rows_per_chunk = settings.rag.EXCEL_ROWS_PER_CHUNK if settings.rag.EXCEL_STRUCTURED else 0
+        parent_child = (settings.rag.PARENT_CHILD_SIZE, settings.rag.PARENT_CHILD_OVERLAP) if settings.rag.PARENT_RETRIEVAL else None
+
+        # Hashes ya cargados en BD para esta empresa (dedupe entre ejecuciones)
+        hashes_vistos = set(checkpoint["hashes"].keys())
+        for (doc_metadata,) in session.query(UserDocument.doc_metadata).filter(
+            UserDocument.company_id == company_id
+        ):
+            if doc_metadata and doc_metadata.get("file_hash"):
+                hashes_vistos.add(doc_metadata["file_hash"])
+
+        pendientes = []
+        for path in archivos:
+            clave = _clave_archivo(path)
+            if clave not in checkpoint["files"]:
+                pendientes.append((path, clave))
+        print(f"⏭️  {len(archivos) - len(pendientes)} archivos ya cargados (checkpoint)")
+
+        cargador = CargadorDocumentos(session, rag_service, company_id, user_id, batch_size, checkpoint_path, checkpoint)
+        duplicados = 0
+        errores = 0
+        procesados = 0
+
+        # spawn: rag_service ya arrancó hilos (ChromaDB, embeddings) y un fork
+        # los copiaría a medio estado; los workers solo importan los extractores
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Ventana acotada de tareas en vuelo para mantener la memoria constante
+            ventana = workers * 4
+            cola = iter(pendientes)
+            en_vuelo = {}
+
+            def _enviar():
+                for path, clave in cola:
+                    future = pool.submit(_procesar_archivo, str(path), chunk_size, chunk_overlap, excel_rows_per_chunk, strategy, parent_child)
+                    en_vuelo[future] = clave
+                    if len(en_vuelo) >= ventana:
+                        return
+
+            _enviar()
+            while en_vuelo:
+                future = next(as_completed(en_vuelo))
+                clave = en_vuelo.pop(future)
+                resultado = future.result()
+                procesados += 1
+
+                if resultado["error"]:
+                    errores += 1
+                    print(f"❌ {resultado['path']}: {resultado['error']}")
+                elif resultado["hash"] in hashes_vistos:
+                    duplicados += 1
+                    checkpoint["files"][clave] = checkpoint["hashes"].get(resultado["hash"])
+                else:
+                    hashes_vistos.add(resultado["hash"])
+                    cargador.agregar(resultado, clave)
+
+                if procesados % 50 == 0:
+                    transcurrido = time.perf_counter() - inicio
+                    print(f"⏳ {procesados}/{len(pendientes)} archivos - {procesados / transcurrido:.1f} archivos/s - {cargador.total_chunks} chunks")
+
+                _enviar()
+
+        cargador.flush()
+        guardar_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        session.close()
+
+    transcurrido = time.perf_counter() - inicio
+    print()
+    print("=" * 60)
+    print("✅ CARGA FINALIZADA")
+    print("=" * 60)
+    print(f"  Documentos cargados: {cargador.total_documentos}")
+    print(f"  Chunks indexados:    {cargador.total_chunks}")
+    print(f"  Productos catálogo:  {cargador.total_productos}")
+    print(f"  Duplicados omitidos: {duplicados}")
+    print(f"  Errores:             {errores + cargador.documentos_fallidos}")
+    print(f"  Tiempo total:        {transcurrido:.1f} s")
+    if transcurrido > 0:
+        print(f"  Throughput:          {procesados / transcurrido:.1f} archivos/s, {cargador.total_chunks / transcurrido:.1f} chunks/s")
+    print(f"  Checkpoint:          {checkpoint_path}")
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Carga masiva de documentos RAG desde una carpeta")
+    parser.add_argument("directorio", help="Carpeta con los documentos a cargar")
+    parser.add_argument("--company-id", type=int, default=settings.demo.COMPANY_ID, help="Empresa dueña de los documentos")
+    parser.add_argument("--user-id", type=int, default=settings.demo.USER_ID, help="Usuario (SystemUser) que carga los documentos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Procesos de extracción en paralelo")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks por lote de embeddings/inserción")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Archivo de checkpoint para reanudar")
+    parser.add_argument("--strategy", choices=["recursive", "tokens", "markdown", "auto"], default=None,
+                        help="Estrategia de chunking (por defecto la de la empresa o RAG_CHUNK_STRATEGY)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directorio):
+        print(f"❌ No existe la carpeta: {args.directorio}")
+        sys.exit(1)
+
+    cargar_directorio(
+        directorio=args.directorio,
+        company_id=args.company_id,
+        user_id=args.user_id,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint,
+        strategy=args.strategy
+    )
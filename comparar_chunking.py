@@ -0,0 +1,184 @@
+"""
+Comparación de estrategias de chunking
+Divide los mismos documentos con el splitter original de langchain
+(caracteres) y con las estrategias de app.services.chunking, y reporta
+velocidad, cantidad y tamaño de los chunks y cuántas secciones del markdown
+quedan partidas en más de un chunk.
+
+Con --dataset (mismo formato que evaluar_rag.py) indexa en memoria los
+chunks de cada estrategia con el modelo de embeddings del RAG y mide
+Hit@k y MRR, sin tocar ChromaDB.
+
+Uso:
+    python comparar_chunking.py catalogo_techstore.md
+    python comparar_chunking.py catalogo_techstore.md --dataset consultas.jsonl --top-k 3
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import time
+
+ESTRATEGIAS = ["langchain", "recursive", "tokens", "markdown"]
+MODELO_EMBEDDINGS = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def crear_splitter(estrategia: str, chunk_size: int, chunk_overlap: int):
+    """Función texto -> lista de chunks para la estrategia"""
+    if estrategia == "langchain":
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+        return splitter.split_text
+
+    from app.services.chunking import get_chunker
+    return get_chunker(estrategia, chunk_size, chunk_overlap).split_text
+
+
+def secciones_partidas(textos: list, chunks: list) -> tuple:
+    """Secciones con cuerpo propio que no caben completas en un único chunk"""
+    from app.services.chunking import TextChunker
+
+    normalizar = lambda texto: " ".join(texto.split())
+    chunks_normalizados = [normalizar(chunk) for chunk in chunks]
+    total = partidas = 0
+    for texto in textos:
+        for seccion in TextChunker.markdown_sections(texto):
+            cuerpo = normalizar(seccion["body"])
+            if not cuerpo:
+                continue
+            total += 1
+            if not any(cuerpo in chunk for chunk in chunks_normalizados):
+                partidas += 1
+    return partidas, total
+
+
+def medir_estrategia(estrategia: str, textos: list, chunk_size: int, chunk_overlap: int, repeticiones: int) -> dict:
+    """Velocidad y forma de los chunks de una estrategia"""
+    from app.services.chunking import count_tokens
+
+    split = crear_splitter(estrategia, chunk_size, chunk_overlap)
+    chunks = [chunk for texto in textos for chunk in split(texto)]
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for texto in textos:
+            split(texto)
+    duracion = (time.perf_counter() - inicio) / repeticiones
+
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    partidas, secciones = secciones_partidas(textos, chunks)
+    return {
+        "estrategia": estrategia,
+        "chunks": len(chunks),
+        "chunks_por_segundo": len(chunks) / duracion if duracion else 0.0,
+        "tokens_promedio": sum(tokens) / len(tokens) if tokens else 0.0,
+        "tokens_max": max(tokens) if tokens else 0,
+        "secciones_partidas": partidas,
+        "secciones": secciones,
+        "_chunks": chunks,
+    }
+
+
+def evaluar_recuperacion(chunks: list, casos: list, modelo, top_k: int) -> dict:
+    """Hit@k y MRR buscando por similitud coseno sobre los chunks en memoria"""
+    from evaluar_rag import es_relevante
+
+    if not chunks:
+        return {"hit_rate": 0.0, "mrr": 0.0}
+    vectores = modelo.encode(chunks, batch_size=64, normalize_embeddings=True)
+    consultas = modelo.encode([caso["query"] for caso in casos], normalize_embeddings=True)
+    aciertos = 0
+    reciprocal_ranks = 0.0
+    for caso, consulta in zip(casos, consultas):
+        puntajes = vectores @ consulta
+        mejores = puntajes.argsort()[::-1][:top_k]
+        for rank, indice in enumerate(mejores, 1):
+            if es_relevante({"content": chunks[indice]}, caso):
+                aciertos += 1
+                reciprocal_ranks += 1 / rank
+                break
+    total = len(casos) or 1
+    return {"hit_rate": aciertos / total, "mrr": reciprocal_ranks / total}
+
+
+def imprimir_resultados(resultados: list, chunk_size: int, con_recuperacion: bool):
+    """Tabla comparativa por estrategia"""
+    print()
+    print("=" * 96)
+    print(f"📊 COMPARACIÓN DE CHUNKING (chunk_size={chunk_size}: caracteres en langchain/recursive, tokens en el resto)")
+    print("=" * 96)
+    encabezado = f"{'Estrategia':<12}{'Chunks':>8}{'Chunks/s':>12}{'Tokens prom':>13}{'Tokens max':>12}{'Secc. partidas':>16}"
+    if con_recuperacion:
+        encabezado += f"{'Hit@k':>8}{'MRR':>8}"
+    print(encabezado)
+    for r in resultados:
+        linea = (
+            f"{r['estrategia']:<12}{r['chunks']:>8}{r['chunks_por_segundo']:>12.0f}{r['tokens_promedio']:>13.1f}"
+            f"{r['tokens_max']:>12}{r['secciones_partidas']:>9}/{r['secciones']:<6}"
+        )
+        if con_recuperacion:
+            linea += f"{r['hit_rate']:>8.3f}{r['mrr']:>8.3f}"
+        print(linea)
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Comparación de estrategias de chunking")
+    parser.add_argument("archivos", nargs="+", help="Documentos a dividir (txt, md, pdf, docx, ...)")
+    parser.add_argument("--strategies", default=",".join(ESTRATEGIAS), help=f"Estrategias a comparar ({', '.join(ESTRATEGIAS)})")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Tamaño máximo de un chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="Solapamiento entre chunks")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Repeticiones para medir la velocidad")
+    parser.add_argument("--dataset", default=None, help="JSONL de consultas para medir Hit@k y MRR")
+    parser.add_argument("--top-k", type=int, default=settings.rag.TOP_K, help="Chunks por consulta")
+    parser.add_argument("--json", action="store_true", help="Imprimir resultados como JSON")
+    args = parser.parse_args()
+
+    estrategias = [e.strip() for e in args.strategies.split(",") if e.strip()]
+    invalidas = [e for e in estrategias if e not in ESTRATEGIAS]
+    if invalidas:
+        print(f"❌ Estrategias inválidas: {', '.join(invalidas)}")
+        sys.exit(1)
+
+    textos = []
+    for archivo in args.archivos:
+        ext = archivo.rsplit(".", 1)[-1].lower()
+        if ext in ("txt", "md"):
+            with open(archivo, encoding="utf-8") as f:
+                textos.append(f.read())
+        else:
+            from app.services.document_extractors import extract_text
+            textos.append(extract_text(archivo, ext))
+    print(f"📄 {len(textos)} documentos, {sum(len(t) for t in textos)} caracteres")
+
+    resultados = [
+        medir_estrategia(estrategia, textos, args.chunk_size, args.chunk_overlap, args.repeticiones)
+        for estrategia in estrategias
+    ]
+
+    if args.dataset:
+        from sentence_transformers import SentenceTransformer
+        from evaluar_rag import cargar_dataset
+
+        casos = cargar_dataset(args.dataset)
+        modelo = SentenceTransformer(MODELO_EMBEDDINGS)
+        for resultado in resultados:
+            resultado.update(evaluar_recuperacion(resultado["_chunks"], casos, modelo, args.top_k))
+
+    for resultado in resultados:
+        del resultado["_chunks"]
+
+    if args.json:
+        print(json.dumps(resultados, indent=2, ensure_ascii=False))
+    else:
+        imprimir_resultados(resultados, args.chunk_size, bool(args.dataset))
@@ -0,0 +1,186 @@
+"""
+Evaluación de la recuperación RAG
+Ejecuta un conjunto de consultas contra el vector store y compara modos de
+reranking: aciertos@k, MRR, tamaño del contexto enviado al LLM y latencia
+
+Formato del dataset (JSONL, una consulta por línea):
+    {"query": "precio de la laptop ASUS ROG", "expected": ["ROG Strix", "S/ 6,499"]}
+
+Un chunk cuenta como relevante si contiene alguno de los textos de
+"expected" (sin distinguir mayúsculas) o si su archivo coincide con "filename".
+
+Uso:
+    python evaluar_rag.py consultas.jsonl --top-k 3 --modes off,lexical,cross-encoder --diversity mmr
+    python evaluar_rag.py consultas.jsonl --catalog
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import time
+
+
+def cargar_dataset(path: str) -> list:
+    """Lee las consultas del archivo JSONL"""
+    casos = []
+    with open(path, encoding="utf-8") as f:
+        for numero, linea in enumerate(f, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            caso = json.loads(linea)
+            if not caso.get("query"):
+                raise ValueError(f"Línea {numero}: falta 'query'")
+            casos.append(caso)
+    return casos
+
+
+def es_relevante(chunk: dict, caso: dict) -> bool:
+    """Un chunk es relevante si contiene un texto esperado o viene del archivo esperado"""
+    contenido = chunk.get("content", "").lower()
+    if any(esperado.lower() in contenido for esperado in caso.get("expected", [])):
+        return True
+    filename = caso.get("filename")
+    return bool(filename) and chunk.get("metadata", {}).get("filename") == filename
+
+
+def evaluar_modo(rag_service, casos: list, company_id: int, top_k: int, modo: str, diversidad: str = None) -> dict:
+    """Corre todas las consultas con un modo de reranking y agrega las métricas"""
+    aciertos = 0
+    reciprocal_ranks = 0.0
+    caracteres = 0
+    chunks_totales = 0
+    latencias = []
+
+    for caso in casos:
+        inicio = time.perf_counter()
+        chunks = rag_service.search_similar_chunks(
+            query=caso["query"],
+            company_id=company_id,
+            top_k=top_k,
+            filters=caso.get("filters"),
+            rerank=modo,
+            diversity=diversidad
+        )
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+        chunks_totales += len(chunks)
+        caracteres += sum(len(chunk.get("content", "")) for chunk in chunks)
+        for rank, chunk in enumerate(chunks, 1):
+            if es_relevante(chunk, caso):
+                aciertos += 1
+                reciprocal_ranks += 1 / rank
+                break
+
+    latencias.sort()
+    total = len(casos) or 1
+    return {
+        "modo": modo,
+        "hit_rate": aciertos / total,
+        "mrr": reciprocal_ranks / total,
+        "chunks_promedio": chunks_totales / total,
+        "caracteres_promedio": caracteres / total,
+        "latencia_p50_ms": latencias[len(latencias) // 2] if latencias else 0.0,
+        "latencia_p95_ms": latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] if latencias else 0.0,
+    }
+
+
+def evaluar_catalogo(casos: list, company_id: int) -> dict:
+    """
+    Respuestas directas del índice de productos: cuántas consultas resuelve,
+    cuántas de esas contienen el texto esperado y su latencia
+    """
+    from app.database.connection import SessionLocal
+    from app.services.product_catalog import product_catalog
+
+    aciertos = 0
+    correctas = 0
+    latencias = []
+    for caso in casos:
+        inicio = time.perf_counter()
+        respuesta = product_catalog.answer(SessionLocal, company_id, caso["query"])
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        if respuesta:
+            aciertos += 1
+            if es_relevante({"content": respuesta["response"]}, caso):
+                correctas += 1
+
+    latencias.sort()
+    total = len(casos) or 1
+    return {
+        "hit_rate": aciertos / total,
+        "precision": correctas / aciertos if aciertos else 0.0,
+        "respondidas": aciertos,
+        "latencia_p50_ms": latencias[len(latencias) // 2] if latencias else 0.0,
+    }
+
+
+def imprimir_resultados(resultados: list, top_k: int, total: int):
+    """Tabla comparativa por modo"""
+    print()
+    print("=" * 86)
+    print(f"📊 EVALUACIÓN DE RECUPERACIÓN ({total} consultas, top_k={top_k})")
+    print("=" * 86)
+    print(f"{'Modo':<15}{'Hit@k':>8}{'MRR':>8}{'Chunks':>9}{'Caracteres':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in resultados:
+        print(
+            f"{r['modo']:<15}{r['hit_rate']:>8.3f}{r['mrr']:>8.3f}{r['chunks_promedio']:>9.1f}"
+            f"{r['caracteres_promedio']:>12.0f}{r['latencia_p50_ms']:>10.1f}{r['latencia_p95_ms']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+    from app.services.reranker import RERANK_MODES
+
+    parser = argparse.ArgumentParser(description="Evaluación de la recuperación RAG por modo de reranking")
+    parser.add_argument("dataset", help="Archivo JSONL con las consultas")
+    parser.add_argument("--company-id", type=int, default=settings.demo.COMPANY_ID, help="Empresa cuyos documentos se consultan")
+    parser.add_argument("--top-k", type=int, default=settings.rag.TOP_K, help="Chunks por consulta")
+    parser.add_argument("--modes", default="off,lexical", help=f"Modos a comparar ({', '.join(RERANK_MODES)})")
+    parser.add_argument("--diversity", default=None, help="Diversificación: off, dedup o mmr (por defecto RAG_DIVERSITY_MODE)")
+    parser.add_argument("--catalog", action="store_true", help="Evaluar también las respuestas directas del índice de productos")
+    parser.add_argument("--json", action="store_true", help="Imprimir resultados como JSON")
+    args = parser.parse_args()
+
+    modos = [m.strip() for m in args.modes.split(",") if m.strip()]
+    invalidos = [m for m in modos if m not in RERANK_MODES]
+    if invalidos:
+        print(f"❌ Modos inválidos: {', '.join(invalidos)}")
+        sys.exit(1)
+
+    casos = cargar_dataset(args.dataset)
+    if not casos:
+        print(f"❌ El dataset {args.dataset} no tiene consultas")
+        sys.exit(1)
+
+    from app.services.rag_service import rag_service
+
+    resultados = []
+    for modo in modos:
+        # Primera pasada para calentar modelos y caches; se mide la segunda
+        evaluar_modo(rag_service, casos[:1], args.company_id, args.top_k, modo, args.diversity)
+        resultados.append(evaluar_modo(rag_service, casos, args.company_id, args.top_k, modo, args.diversity))
+
+    catalogo = None
+    if args.catalog:
+        # La primera consulta carga el índice de la empresa desde la BD
+        evaluar_catalogo(casos[:1], args.company_id)
+        catalogo = evaluar_catalogo(casos, args.company_id)
+        # Ahorro mínimo: solo la recuperación (la generación con Ollama suma segundos por consulta)
+        recuperacion_ms = resultados[0]["latencia_p50_ms"] if resultados else 0.0
+        catalogo["ahorro_recuperacion_ms"] = catalogo["respondidas"] * max(0.0, recuperacion_ms - catalogo["latencia_p50_ms"])
+
+    if args.json:
+        print(json.dumps({"modos": resultados, "catalogo": catalogo} if catalogo else resultados, indent=2, ensure_ascii=False))
+    else:
+        imprimir_resultados(resultados, args.top_k, len(casos))
+        if catalogo:
+            print()
+            print(f"⚡ Catálogo: {catalogo['respondidas']} consultas respondidas sin LLM "
+                  f"(hit rate {catalogo['hit_rate']:.3f}, precisión {catalogo['precision']:.3f}, "
+                  f"p50 {catalogo['latencia_p50_ms']:.2f} ms); "
+                  f"ahorro mínimo {catalogo['ahorro_recuperacion_ms']:.0f} ms solo en recuperación")
@@ -0,0 +1,52 @@
+"""
+Exportación de conversaciones para fine-tuning
+Escribe un JSONL (formato de chat OpenAI compatible) con una conversación por
+línea, leyendo los mensajes con un cursor del servidor: la memoria se mantiene
+constante aunque se exporten millones de mensajes
+
+Uso:
+    python exportar_entrenamiento.py salida.jsonl --company-id 2
+    python exportar_entrenamiento.py salida.jsonl.gz --gzip --min-messages 4
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import time
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Exportar conversaciones como datos de entrenamiento JSONL")
+    parser.add_argument("salida", help="Archivo de salida (.jsonl o .jsonl.gz)")
+    parser.add_argument("--company-id", type=int, default=settings.demo.COMPANY_ID, help="Empresa cuyas conversaciones se exportan")
+    parser.add_argument("--min-messages", type=int, default=2, help="Mínimo de mensajes por conversación")
+    parser.add_argument("--system-prompt", default=None, help="Archivo con el mensaje de sistema de cada ejemplo")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida (por defecto si termina en .gz)")
+    args = parser.parse_args()
+
+    system_prompt = None
+    if args.system_prompt:
+        with open(args.system_prompt, encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+
+    from app.services.training_export import stream_training_data
+
+    comprimir = args.gzip or args.salida.endswith(".gz")
+    stats = {}
+    reportado = 0
+    inicio = time.time()
+    print(f"📤 Exportando conversaciones de company_id={args.company_id} a {args.salida}")
+    with open(args.salida, "wb") as f:
+        for chunk in stream_training_data(args.company_id, system_prompt, max(1, args.min_messages), comprimir, stats):
+            f.write(chunk)
+            if stats.get("conversations", 0) - reportado >= 10000:
+                reportado = stats["conversations"]
+                print(f"   ... {reportado} conversaciones")
+
+    duracion = time.time() - inicio
+    print(f"✅ {stats.get('conversations', 0)} conversaciones exportadas "
+          f"({stats.get('bytes', 0) / 1024 / 1024:.1f} MB en {duracion:.1f}s)")
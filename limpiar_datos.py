@@ -1,130 +1,303 @@
 """
-Script para limpiar completamente la base de datos
-Elimina: conversaciones, mensajes, clientes, documentos RAG
-Mantiene: estructura de tablas, empresa demo, usuario demo
+Script para limpiar la base de datos
+Elimina: conversaciones, mensajes, clientes, documentos RAG (y sus chunks en
+ChromaDB y archivos subidos)
+Mantiene: estructura de tablas, empresas, usuarios del sistema
+
+Borra por lotes de claves primarias con una pausa entre lotes: cada DELETE es
+una transacción corta, así que puede ejecutarse con la aplicación en marcha.
+El alcance se puede limitar a una empresa y/o a un rango de fechas.
+
+Uso:
+    python limpiar_datos.py                                   # todo
+    python limpiar_datos.py --company-id 2
+    python limpiar_datos.py --desde 2024-01-01 --hasta 2024-06-30 --batch-size 500 --pausa 0.2
 """
 
 import sys
 import os
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app.database.connection import SessionLocal
-from app.models.current import Client, Conversation, Message
-from app.models.rag_models import UserDocument
+import argparse
 import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import and_, delete, func, or_, select, true
+
+from app.database.connection import SessionLocal
+from app.models.current import ChatAssignment, Client, Conversation, Message
+from app.models.rag_models import CatalogProduct, ConversationMemory, DocumentChunk, UserDocument
+
+CHROMA_PATH = "./chroma_db"
+CHROMA_COLLECTION = "user_documents"
+PARENTS_PATH = os.path.join(CHROMA_PATH, "parents")
+UPLOADS_PATH = "./uploads"
+
+
+class Alcance:
+    """Empresa y rango de fechas a limpiar (sin filtros = todo)"""
+
+    def __init__(self, company_id=None, desde=None, hasta=None):
+        self.company_id = company_id
+        self.desde = desde
+        self.hasta = hasta
+
+    @property
+    def completo(self) -> bool:
+        return self.company_id is None and self.desde is None and self.hasta is None
+
+    def _rango(self, columna):
+        condiciones = []
+        if self.desde is not None:
+            condiciones.append(columna >= self.desde)
+        if self.hasta is not None:
+            condiciones.append(columna < self.hasta)
+        return condiciones
+
+    def clientes(self):
+        """Clientes de la empresa (None si el alcance no filtra por empresa)"""
+        if self.company_id is None:
+            return None
+        return select(Client.id).where(Client.company_id == self.company_id)
+
+    def conversaciones(self):
+        condiciones = self._rango(func.coalesce(Conversation.last_message_at, Conversation.created_at))
+        if self.company_id is not None:
+            condiciones.append(Conversation.client_id.in_(self.clientes()))
+        return and_(true(), *condiciones)
+
+    def mensajes(self):
+        if self.completo:
+            return true()
+        en_conversaciones = Message.conversation_id.in_(select(Conversation.id).where(self.conversaciones()))
+        if self.company_id is not None and self.desde is None and self.hasta is None:
+            # Mensajes sueltos (sin conversación) de clientes de la empresa
+            return or_(en_conversaciones, Message.client_id.in_(self.clientes()))
+        return en_conversaciones
+
+    def documentos(self):
+        condiciones = self._rango(UserDocument.upload_date)
+        if self.company_id is not None:
+            condiciones.append(UserDocument.company_id == self.company_id)
+        return and_(true(), *condiciones)
+
+    def describir(self) -> str:
+        if self.completo:
+            return "TODOS los datos"
+        partes = []
+        if self.company_id is not None:
+            partes.append(f"company_id={self.company_id}")
+        if self.desde is not None:
+            partes.append(f"desde {self.desde:%Y-%m-%d}")
+        if self.hasta is not None:
+            partes.append(f"hasta {(self.hasta - timedelta(days=1)):%Y-%m-%d}")
+        return ", ".join(partes)
+
+
+def borrar_por_lotes(session, modelo, condicion, etiqueta: str, batch_size: int, pausa: float, antes_de_borrar=None) -> int:
+    """
+    Borra las filas que cumplen la condición en lotes por clave primaria
+
+    Cada lote selecciona hasta batch_size IDs (avanzando por PK, sin volver a
+    recorrer lo ya borrado), los borra, hace commit y espera `pausa` segundos
+    para dejar pasar la carga de la aplicación.
+
+    Args:
+        antes_de_borrar: Callback opcional con los IDs del lote (limpieza asociada)
+
+    Returns:
+        Filas eliminadas
+    """
+    total = 0
+    ultimo_id = 0
+    inicio = time.time()
+    while True:
+        ids = session.scalars(
+            select(modelo.id).where(condicion, modelo.id > ultimo_id).order_by(modelo.id).limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        if antes_de_borrar:
+            antes_de_borrar(ids)
+        total += session.execute(delete(modelo).where(modelo.id.in_(ids))).rowcount or 0
+        session.commit()
+        ultimo_id = ids[-1]
+        velocidad = total / max(time.time() - inicio, 1e-6)
+        print(f"\r   {etiqueta}: {total} eliminados ({velocidad:.0f}/s)", end="", flush=True)
+        if pausa:
+            time.sleep(pausa)
+    print(f"\r✅ {etiqueta}: {total} eliminados" + " " * 20)
+    return total
+
+
+def _coleccion_chroma():
+    """Colección de ChromaDB (None si no existe)"""
+    if not os.path.exists(CHROMA_PATH):
+        return None
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+    try:
+        return client.get_collection(CHROMA_COLLECTION)
+    except Exception:
+        return None
+
+
+def limpiar_chroma_por_lotes(coleccion, where=None, batch_size: int = 1000, pausa: float = 0.0) -> int:
+    """Borra de la colección los chunks que cumplen el filtro, por lotes de IDs"""
+    if coleccion is None:
+        return 0
+    total = 0
+    while True:
+        ids = coleccion.get(where=where, limit=batch_size, include=[])["ids"]
+        if not ids:
+            break
+        coleccion.delete(ids=ids)
+        total += len(ids)
+        if pausa:
+            time.sleep(pausa)
+    return total
+
 
-def limpiar_base_datos():
-    """Limpiar todas las conversaciones y datos relacionados"""
+def limpiar_base_datos(alcance: Alcance, batch_size: int, pausa: float):
+    """Limpiar conversaciones, mensajes y clientes del alcance"""
     session = SessionLocal()
-    
     try:
-        print("🧹 Iniciando limpieza de base de datos...")
-        
-        # 1. Eliminar mensajes
-        mensajes_count = session.query(Message).count()
-        session.query(Message).delete()
-        print(f"✅ Eliminados {mensajes_count} mensajes")
-        
-        # 2. Eliminar conversaciones
-        conversaciones_count = session.query(Conversation).count()
-        session.query(Conversation).delete()
-        print(f"✅ Eliminadas {conversaciones_count} conversaciones")
-        
-        # 3. Eliminar clientes
-        clientes_count = session.query(Client).count()
-        session.query(Client).delete()
-        print(f"✅ Eliminados {clientes_count} clientes")
-        
-        # 4. Eliminar documentos RAG de BD
-        documentos_count = session.query(UserDocument).count()
-        session.query(UserDocument).delete()
-        print(f"✅ Eliminados {documentos_count} documentos RAG de BD")
-        
-        # Commit cambios
-        session.commit()
-        print("\n✅ Base de datos MySQL limpiada correctamente")
-        
+        print("🧹 Limpiando conversaciones...")
+        borrar_por_lotes(session, Message, alcance.mensajes(), "Mensajes", batch_size, pausa)
+
+        conversaciones = alcance.conversaciones()
+
+        def borrar_dependientes(ids):
+            # Memoria y asignaciones de las conversaciones del lote
+            session.execute(delete(ConversationMemory).where(ConversationMemory.conversation_id.in_(ids)))
+            session.execute(delete(ChatAssignment).where(ChatAssignment.conversation_id.in_(ids)))
+
+        borrar_por_lotes(session, Conversation, conversaciones, "Conversaciones", batch_size, pausa, borrar_dependientes)
+
+        if alcance.desde is None and alcance.hasta is None:
+            # Los clientes no tienen fecha: solo se borran sin rango de fechas
+            condicion = true() if alcance.company_id is None else Client.company_id == alcance.company_id
+            borrar_por_lotes(session, Client, condicion, "Clientes", batch_size, pausa)
     except Exception as e:
         session.rollback()
-        print(f"❌ Error limpiando base de datos: {e}")
+        print(f"\n❌ Error limpiando base de datos: {e}")
     finally:
         session.close()
 
-def limpiar_chromadb():
-    """Limpiar base de datos vectorial ChromaDB"""
-    try:
-        chroma_path = "./chroma_db"
-        if os.path.exists(chroma_path):
-            shutil.rmtree(chroma_path)
-            print(f"✅ ChromaDB eliminado: {chroma_path}")
-        else:
-            print("ℹ️  ChromaDB no existe")
-    except Exception as e:
-        print(f"❌ Error limpiando ChromaDB: {e}")
 
-def limpiar_uploads():
-    """Limpiar archivos subidos"""
+def limpiar_documentos(alcance: Alcance, batch_size: int, pausa: float):
+    """Limpiar documentos RAG del alcance junto con sus chunks en ChromaDB y sus archivos"""
+    session = SessionLocal()
+    coleccion = _coleccion_chroma()
+    archivos = {"eliminados": 0}
+    vectores = {"eliminados": 0}
     try:
-        uploads_path = "./uploads"
-        if os.path.exists(uploads_path):
-            # Eliminar todos los archivos pero mantener el directorio
-            for filename in os.listdir(uploads_path):
-                file_path = os.path.join(uploads_path, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-            print(f"✅ Archivos subidos eliminados: {uploads_path}")
-        else:
-            print("ℹ️  Directorio uploads no existe")
+        print("🧹 Limpiando documentos RAG...")
+
+        def borrar_asociados(ids):
+            rutas = session.scalars(select(UserDocument.file_path).where(UserDocument.id.in_(ids))).all()
+            vectores["eliminados"] += limpiar_chroma_por_lotes(coleccion, {"document_id": {"$in": list(ids)}}, batch_size)
+            session.execute(delete(DocumentChunk).where(DocumentChunk.document_id.in_(ids)))
+            session.execute(delete(CatalogProduct).where(CatalogProduct.document_id.in_(ids)))
+            for document_id in ids:
+                # Secciones padre (parent-document retrieval)
+                for extension in (".bin", ".idx"):
+                    ruta_padre = os.path.join(PARENTS_PATH, f"{document_id}{extension}")
+                    if os.path.isfile(ruta_padre):
+                        os.remove(ruta_padre)
+            for ruta in rutas:
+                if ruta and os.path.isfile(ruta):
+                    os.remove(ruta)
+                    archivos["eliminados"] += 1
+
+        borrar_por_lotes(session, UserDocument, alcance.documentos(), "Documentos RAG", batch_size, pausa, borrar_asociados)
+
+        if alcance.completo:
+            # Chunks huérfanos (sin documento en BD) y archivos sueltos
+            vectores["eliminados"] += limpiar_chroma_por_lotes(coleccion, None, batch_size, pausa)
+            shutil.rmtree(PARENTS_PATH, ignore_errors=True)
+            if os.path.exists(UPLOADS_PATH):
+                for archivo in Path(UPLOADS_PATH).rglob("*"):
+                    if archivo.is_file():
+                        archivo.unlink()
+                        archivos["eliminados"] += 1
+
+        print(f"✅ ChromaDB: {vectores['eliminados']} chunks eliminados")
+        print(f"✅ Uploads: {archivos['eliminados']} archivos eliminados")
     except Exception as e:
-        print(f"❌ Error limpiando uploads: {e}")
+        session.rollback()
+        print(f"\n❌ Error limpiando documentos: {e}")
+    finally:
+        session.close()
+
 
 def limpiar_cache():
     """Limpiar cache de Python"""
     try:
-        import subprocess
-        # Limpiar __pycache__ recursivamente
-        subprocess.run(
-            ["find", ".", "-type", "d", "-name", "__pycache__", "-exec", "rm", "-rf", "{}", "+"],
-            shell=True,
-            check=False
-        )
-        print("✅ Cache de Python eliminado")
+        eliminados = 0
+        for directorio in Path(".").rglob("__pycache__"):
+            if directorio.is_dir():
+                shutil.rmtree(directorio, ignore_errors=True)
+                eliminados += 1
+        print(f"✅ Cache de Python eliminado ({eliminados} directorios)")
     except Exception as e:
         print(f"❌ Error limpiando cache: {e}")
 
+
+def _fecha(valor: str) -> datetime:
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Limpieza de datos por lotes")
+    parser.add_argument("--company-id", type=int, default=None, help="Limitar a una empresa")
+    parser.add_argument("--desde", type=_fecha, default=None, help="Fecha inicial (YYYY-MM-DD, inclusive)")
+    parser.add_argument("--hasta", type=_fecha, default=None, help="Fecha final (YYYY-MM-DD, inclusive)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Filas por DELETE")
+    parser.add_argument("--pausa", type=float, default=0.05, help="Segundos de espera entre lotes")
+    parser.add_argument("--sin-documentos", action="store_true", help="No tocar documentos RAG, ChromaDB ni uploads")
+    parser.add_argument("--si", action="store_true", help="No pedir confirmación")
+    args = parser.parse_args()
+
+    alcance = Alcance(
+        company_id=args.company_id,
+        desde=args.desde,
+        hasta=args.hasta + timedelta(days=1) if args.hasta else None
+    )
+
     print("=" * 60)
-    print("🧹 LIMPIEZA COMPLETA DEL SISTEMA")
+    print("🧹 LIMPIEZA DEL SISTEMA")
     print("=" * 60)
+    print(f"Alcance: {alcance.describir()} (lotes de {args.batch_size}, pausa {args.pausa}s)")
     print()
-    
+
     # Confirmación
-    respuesta = input("⚠️  ¿Estás seguro de eliminar TODOS los datos? (sí/no): ")
-    if respuesta.lower() != "sí":
-        print("❌ Limpieza cancelada")
-        sys.exit(0)
-    
-    print()
-    
-    # Ejecutar limpieza
-    limpiar_base_datos()
-    print()
-    limpiar_chromadb()
-    print()
-    limpiar_uploads()
-    print()
-    limpiar_cache()
-    
+    if not args.si:
+        respuesta = input(f"⚠️  ¿Estás seguro de eliminar {alcance.describir()}? (sí/no): ")
+        if respuesta.lower() != "sí":
+            print("❌ Limpieza cancelada")
+            sys.exit(0)
+        print()
+
+    inicio = time.time()
+    limpiar_base_datos(alcance, args.batch_size, args.pausa)
     print()
+    if not args.sin_documentos:
+        limpiar_documentos(alcance, args.batch_size, args.pausa)
+        print()
+    if alcance.completo:
+        limpiar_cache()
+        print()
+
     print("=" * 60)
-    print("✅ LIMPIEZA COMPLETA FINALIZADA")
+    print(f"✅ LIMPIEZA FINALIZADA en {time.time() - inicio:.1f}s")
     print("=" * 60)
     print()
     print("📝 Notas:")
     print("  - Estructura de BD mantenida")
-    print("  - Empresa demo mantenida")
-    print("  - Usuario demo mantenido")
-    print("  - ChromaDB se recreará al iniciar el servidor")
-    print()
-    print("🚀 Reinicia el servidor para aplicar cambios:")
-    print("   python -m uvicorn app.main:app --host 0.0.0.0 --port 9090")
+    print("  - Empresas y usuarios del sistema mantenidos")
+    print("  - Conversaciones archivadas (archive/) no se modifican")
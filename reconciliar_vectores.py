@@ -0,0 +1,55 @@
+"""
+Reconciliación del vector store sin la aplicación en marcha
+Borra de ChromaDB los chunks de documentos eliminados (igual que
+POST /api/rag/gc) y, con --compactar, hace VACUUM del SQLite de Chroma para
+devolver al disco el espacio liberado.
+
+La compactación necesita acceso exclusivo a chroma.sqlite3: detener antes
+los workers de uvicorn y cualquier cargar_documentos.py en curso.
+
+Uso:
+    python reconciliar_vectores.py --dry-run
+    python reconciliar_vectores.py --compactar
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconciliación y compactación del vector store")
+    parser.add_argument("--dry-run", action="store_true", help="Solo reportar, sin borrar ni compactar")
+    parser.add_argument("--compactar", action="store_true", help="VACUUM del SQLite de Chroma (con la aplicación detenida)")
+    parser.add_argument("--json", action="store_true", help="Imprimir el reporte como JSON")
+    args = parser.parse_args()
+
+    from app.database.connection import SessionLocal
+    from app.services.vector_gc import vector_gc
+
+    print("🧹 Reconciliando ChromaDB con los documentos...")
+    if args.compactar and not args.dry_run:
+        print("⚠️  La compactación requiere que la aplicación esté detenida")
+    reporte = vector_gc.run(SessionLocal, dry_run=args.dry_run, compact=args.compactar)
+
+    if args.json:
+        print(json.dumps(reporte, indent=2, ensure_ascii=False))
+        sys.exit(0 if reporte.get("ok") else 1)
+
+    if not reporte.get("ok"):
+        print(f"❌ {reporte.get('detail')}")
+        sys.exit(1)
+    print(f"  Chunks revisados:     {reporte['scanned']}")
+    print(f"  Huérfanos:            {reporte['orphans']}")
+    print(f"  Borrados:             {reporte['deleted']}")
+    print(f"  Secciones padre:      {reporte['orphan_parents']}")
+    print(f"  Filas sin vector:     {reporte['missing_vectors']}")
+    print(f"  Espacio recuperado:   {reporte['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    if reporte["compact_error"]:
+        print(f"  ⚠️ Compactación fallida: {reporte['compact_error']}")
+    print(f"  Latencia p50/p95:     {reporte['latency_before']['p50_ms']}/{reporte['latency_before']['p95_ms']} ms → "
+          f"{reporte['latency_after']['p50_ms']}/{reporte['latency_after']['p95_ms']} ms")
+    print(f"✅ Listo en {reporte['duration_s']} s")
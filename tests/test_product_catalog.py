@@ -0,0 +1,59 @@
+"""
+Identificación de productos para las respuestas directas del catálogo
+(sobre el catálogo de ejemplo catalogo_techstore.md, sin BD)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app.services.document_extractors import extract_products
+from app.services.product_catalog import ProductCatalog, _CompanyCatalog
+
+CATALOGO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "catalogo_techstore.md")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    with open(CATALOGO, encoding="utf-8") as f:
+        products = extract_products(f.read())
+    for i, product in enumerate(products):
+        product["id"] = i
+        product["document_id"] = 1
+    return _CompanyCatalog(products)
+
+
+def _match(catalog, query):
+    match = ProductCatalog().match(catalog, query)
+    return match["product"]["name"] if match else None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("precio del deathadder", "Razer DeathAdder V3 Pro"),
+    ("precio de la legion", "Lenovo Legion 5 Pro"),
+])
+def test_palabra_exclusiva_identifica_el_producto(catalog, query, expected):
+    assert _match(catalog, query) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("precio del Lenovo Legion 5", "Lenovo Legion 5 Pro"),
+    ("¿hay stock del keychron k8?", "Keychron K8 Pro"),
+    ("precio G614JV-N4085W", "ASUS ROG Strix G16 (2024)"),
+])
+def test_codigo_o_dos_palabras_identifican_el_producto(catalog, query, expected):
+    assert _match(catalog, query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "hay mouse inalambrico?",
+    "precio del mouse microsoft",
+    "precio del logitech g pro x",
+    "compara el legion con el rog",
+    "precio del iphone 15",
+])
+def test_consultas_genericas_o_ambiguas_van_por_rag(catalog, query):
+    assert _match(catalog, query) is None